@@ -1,7 +1,13 @@
 import streamlit as st
 import os
-import shutil
-from main import create_demucs_karaoke, adjust_pitch, get_audio_duration
+import time
+from jobs import JobManager, karaoke_job, preview_job, warm_job_worker
+from preview import PREVIEW_SECONDS
+from media_index import media_info
+from uploads import save_upload
+from workspace import Workspace
+from file_server import start_file_server, result_url, FILE_SERVER_PORT, FILE_BASE_URL
+from telemetry import start_metrics_server, install_telemetry, METRICS_PORT
 
 st.set_page_config(
     page_title="AI Karaoke Maker - Basic Demo",
@@ -44,20 +50,41 @@ with col2:
 
 input_file = None
 youtube_url = None
-
-def cleanup_temp():
-    for d in ["separated", "mdx_separated"]:
-        if os.path.exists(d):
-            shutil.rmtree(d)
-
-def process_audio(audio_path):
-    output = audio_path
-    if karaoke:
-        # Use 'basic' mode for Streamlit Cloud (lighter, faster)
-        output = create_demucs_karaoke(audio_path, mode="basic")
-    if pitch != 0:
-        output = adjust_pitch(output, pitch)
-    return output
+uploaded = None
+
+@st.cache_resource
+def get_job_manager():
+    # One worker pool per server process, shared by all sessions; its workers
+    # report stage events to the telemetry log like this process does
+    install_telemetry()
+    return JobManager(initializer=warm_job_worker)
+
+@st.cache_resource
+def get_metrics():
+    # Prometheus endpoint aggregating stage/job telemetry from every worker (KARAOKE_METRICS_PORT=0 disables)
+    if not METRICS_PORT:
+        return None
+    try:
+        return start_metrics_server(METRICS_PORT)
+    except OSError as e:
+        print(f"⚠️  Metrics endpoint unavailable: {e}")
+        return None
+
+@st.cache_resource
+def get_file_server():
+    # Results are streamed by this endpoint (Range/ETag/sendfile), not through the session.
+    # Only when browsers can reach it: otherwise its links would be dead, so use in-app downloads.
+    if not FILE_SERVER_PORT or not FILE_BASE_URL:
+        return None
+    try:
+        return start_file_server(FILE_SERVER_PORT)
+    except OSError as e:
+        print(f"⚠️  File server unavailable, falling back to in-app downloads: {e}")
+        return None
+
+jobs = get_job_manager()
+get_metrics()
+file_server = get_file_server()
 
 st.markdown("---")
 
@@ -76,11 +103,36 @@ else:
         help="Supported formats: MP3, WAV, FLAC, M4A, AAC, OGG"
     )
     if uploaded:
-        temp_path = f"temp_uploaded_{uploaded.name}"
-        with open(temp_path, "wb") as f:
-            f.write(uploaded.read())
-        input_file = temp_path
-        st.success(f"✅ File uploaded: {uploaded.name} - ready to process!")
+        # The page reruns while a job polls; save each upload once, not on every rerun
+        upload_key = (uploaded.file_id if hasattr(uploaded, 'file_id') else uploaded.name, uploaded.size)
+        saved = st.session_state.get('upload')
+        if not saved or saved['key'] != upload_key or not os.path.exists(saved['path']):
+            if saved and saved['space']:
+                saved['space'].cleanup()  # Replaced before it was submitted
+            # Each upload gets its own workspace, so sessions uploading the same
+            # file name never overwrite each other; the job removes it when done
+            space = Workspace('upload', tmpfs=False, quota_gb=0)
+            try:
+                # Streamed to disk in chunks; hashed and checked in the same pass
+                saved = dict(save_upload(uploaded, space.file(uploaded.name)), key=upload_key, space=space)
+                st.session_state.upload = saved
+            except ValueError as e:
+                space.cleanup()
+                st.error(f"❌ {e}")
+                saved = None
+                st.session_state.pop('upload', None)
+        if saved:
+            temp_path = saved['path']
+            input_file = temp_path
+            try:
+                # From the upload's header when possible, otherwise probed once and indexed
+                duration = saved.get('duration') or media_info(temp_path)['duration']
+                st.success(f"✅ File uploaded: {uploaded.name} ({int(duration // 60)}:{int(duration % 60):02d}) - ready to process!")
+            except RuntimeError:
+                st.success(f"✅ File uploaded: {uploaded.name} - ready to process!")
+            if saved['content_hash']:
+                # Same bytes as an earlier upload: no decode or hashing needed, cached stems are reused
+                st.info("⚡ Recognised from an earlier upload - cached results will be reused.")
 
 st.markdown("---")
 
@@ -90,140 +142,125 @@ with col2:
     process_button = st.button("🚀 Start Processing", type="primary", use_container_width=True)
 
 if process_button:
+    if mode == "YouTube URL" and not youtube_url:
+        st.error("Please enter a YouTube URL.")
+    elif mode != "YouTube URL" and not input_file:
+        st.error("Please upload an audio file.")
+    else:
+        # A new request replaces this session's unfinished one
+        if st.session_state.get('job_id'):
+            jobs.cancel(st.session_state.job_id, 'replaced')
+
+        # The job owns the uploaded file from here on and removes it when it ends;
+        # submitting again saves the upload afresh for the next job
+        upload = st.session_state.pop('upload', None) if mode != "YouTube URL" else None
+
+        # Queue the work in the background; this script run returns immediately
+        st.session_state.job_id = jobs.submit(
+            karaoke_job,
+            youtube_url if mode == "YouTube URL" else input_file,
+            is_url=mode == "YouTube URL",
+            karaoke=karaoke,
+            pitch=pitch,
+            trim_start=trim_start,
+            trim_end=trim_end,
+            # A short excerpt is rendered right away, so the song can be checked early
+            preview=preview_job,
+            cleanup=upload['space'].cleanup if upload else None
+        )
+        st.session_state.job_settings = {
+            'karaoke': karaoke,
+            'pitch': pitch,
+            'label': "🎵 Song" if mode == "YouTube URL" else "📁 File",
+            'name': uploaded.name if uploaded else None,
+        }
+
+job_id = st.session_state.get('job_id')
+poll = False
+if job_id:
+    settings = st.session_state.job_settings
+
     # Show processing summary
     st.markdown("### 📋 Processing Summary")
     summary_cols = st.columns(3)
     with summary_cols[0]:
         st.metric("Mode", "Basic (Demucs)")
     with summary_cols[1]:
-        st.metric("Karaoke", "Yes" if karaoke else "No")
+        st.metric("Karaoke", "Yes" if settings['karaoke'] else "No")
     with summary_cols[2]:
-        st.metric("Pitch Shift", f"{pitch:+d} semitones" if pitch != 0 else "None")
-
-    with st.spinner("🎵 Processing your audio... This may take 3-5 minutes."):
-        try:
-            if mode == "YouTube URL":
-                if not youtube_url:
-                    st.error("Please enter a YouTube URL.")
-                else:
-                    # Download audio using pytubefix
-                    from pytubefix import YouTube
-                    yt = YouTube(youtube_url)
-                    audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
-                    if not audio_stream:
-                        st.error("No audio stream found!")
-                    else:
-                        audio_file = audio_stream.download(filename="temp_youtube_audio.mp4")
-                        # Trim if needed
-                        if trim_start > 0 or trim_end > 0:
-                            trimmed = "temp_youtube_audio_trimmed.mp4"
-                            cmd_parts = ['ffmpeg', '-y']
-
-                            # Add trim-start if specified
-                            if trim_start > 0:
-                                cmd_parts.extend(['-ss', str(trim_start)])
-
-                            cmd_parts.extend(['-i', audio_file])
-
-                            # Add trim-end if specified (calculate duration)
-                            if trim_end > 0:
-                                duration = get_audio_duration(audio_file)
-                                target_duration = duration - trim_start - trim_end
-                                if target_duration <= 0:
-                                    st.error(f"⚠️ Error: Trim settings would result in zero or negative duration! Audio duration: {duration:.1f}s")
-                                    st.stop()
-                                cmd_parts.extend(['-t', str(target_duration)])
-
-                            cmd_parts.extend(['-c', 'copy', trimmed])
-                            os.system(' '.join(f"'{p}'" if ' ' in str(p) else str(p) for p in cmd_parts))
-                            os.remove(audio_file)
-                            audio_file = trimmed
-                        # Convert to mp3
-                        mp3_file = yt.title.replace('/', '-').replace('\\', '-') + ".mp3"
-                        os.system(f"ffmpeg -y -i '{audio_file}' -vn -ab 320k -ar 48000 '{mp3_file}'")
-                        os.remove(audio_file)
-                        output = process_audio(mp3_file)
-
-                        # Success message with download
-                        st.success("✅ Processing complete!")
-                        st.balloons()
-
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.markdown(f"**🎵 Song:** {yt.title}")
-                            if karaoke:
-                                st.markdown("**🎤 Type:** Karaoke (vocals removed)")
-                            if pitch != 0:
-                                st.markdown(f"**🎶 Pitch:** {pitch:+d} semitones")
-
-                        with col2:
-                            with open(output, "rb") as f:
-                                st.download_button(
-                                    "⬇️ Download Your Track",
-                                    f,
-                                    file_name=os.path.basename(output),
-                                    mime="audio/mpeg",
-                                    type="primary",
-                                    use_container_width=True
-                                )
-
-                        cleanup_temp()
+        st.metric("Pitch Shift", f"{settings['pitch']:+d} semitones" if settings['pitch'] != 0 else "None")
+
+    # Polling doubles as a heartbeat: jobs nobody polls for a minute are cancelled
+    jobs.heartbeat(job_id)
+    status = jobs.status(job_id)
+
+    if status['state'] in ('queued', 'running', 'cancelling'):
+        if status['state'] == 'queued':
+            st.info(f"⏳ Waiting for a free worker... ({status['position']} job(s) ahead of you)")
+        elif status['state'] == 'running':
+            st.info(f"🎵 Processing your audio... This may take 3-5 minutes. ({status['elapsed']:.0f}s elapsed)")
+        else:
+            st.info("🛑 Cancelling...")
+
+        if status['state'] != 'cancelling':
+            if status.get('preview'):
+                preview = status['preview']
+                st.markdown(f"**🎧 Preview** ({PREVIEW_SECONDS:.0f}s from {int(preview['start'] // 60)}:{int(preview['start'] % 60):02d})")
+                st.audio(result_url(preview['output']) if file_server else preview['output'])
+                st.caption("Doesn't sound right? Cancel now to free the worker and try other settings.")
+            elif status.get('preview_error'):
+                st.caption("Preview unavailable for this song.")
             else:
-                if not input_file:
-                    st.error("Please upload an audio file.")
-                else:
-                    # Trim if needed
-                    trimmed_file = input_file
-                    if trim_start > 0 or trim_end > 0:
-                        trimmed_file = f"trimmed_{input_file}"
-                        cmd_parts = ['ffmpeg', '-y']
-
-                        # Add trim-start if specified
-                        if trim_start > 0:
-                            cmd_parts.extend(['-ss', str(trim_start)])
-
-                        cmd_parts.extend(['-i', input_file])
-
-                        # Add trim-end if specified (calculate duration)
-                        if trim_end > 0:
-                            duration = get_audio_duration(input_file)
-                            target_duration = duration - trim_start - trim_end
-                            if target_duration <= 0:
-                                st.error(f"⚠️ Error: Trim settings would result in zero or negative duration! Audio duration: {duration:.1f}s")
-                                st.stop()
-                            cmd_parts.extend(['-t', str(target_duration)])
-
-                        cmd_parts.extend(['-c', 'copy', trimmed_file])
-                        os.system(' '.join(f"'{p}'" if ' ' in str(p) else str(p) for p in cmd_parts))
-                    output = process_audio(trimmed_file)
-
-                    # Success message with download
-                    st.success("✅ Processing complete!")
-                    st.balloons()
-
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.markdown(f"**📁 File:** {uploaded.name}")
-                        if karaoke:
-                            st.markdown("**🎤 Type:** Karaoke (vocals removed)")
-                        if pitch != 0:
-                            st.markdown(f"**🎶 Pitch:** {pitch:+d} semitones")
-
-                    with col2:
-                        with open(output, "rb") as f:
-                            st.download_button(
-                                "⬇️ Download Your Track",
-                                f,
-                                file_name=os.path.basename(output),
-                                mime="audio/mpeg",
-                                type="primary",
-                                use_container_width=True
-                            )
-
-                    cleanup_temp()
-        except Exception as e:
-            st.error(f"❌ Error: {e}")
-            st.info("💡 Tip: If you're experiencing issues, try with a shorter audio file or simpler settings.")
+                st.caption("🎧 Preparing a preview...")
+        if status['state'] != 'cancelling' and st.button("Cancel"):
+            jobs.cancel(job_id)
+        poll = True
+    elif status['state'] == 'done':
+        result = jobs.result(job_id)
+        output = result['output']
+
+        # Success message with download
+        st.success("✅ Processing complete!")
+        if not st.session_state.get('celebrated') == job_id:
+            st.balloons()
+            st.session_state.celebrated = job_id
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"**{settings['label']}:** {settings['name'] or result['title']}")
+            if settings['karaoke']:
+                st.markdown("**🎤 Type:** Karaoke (vocals removed)")
+            if settings['pitch'] != 0:
+                st.markdown(f"**🎶 Pitch:** {settings['pitch']:+d} semitones")
+
+        with col2:
+            if file_server:
+                # The browser fetches the file directly; seeking uses Range requests
+                st.audio(result_url(output))
+                st.link_button(
+                    "⬇️ Download Your Track",
+                    result_url(output, download=True),
+                    type="primary",
+                    use_container_width=True
+                )
+            else:
+                with open(output, "rb") as f:
+                    st.download_button(
+                        "⬇️ Download Your Track",
+                        f,
+                        file_name=os.path.basename(output),
+                        mime="audio/mpeg",
+                        type="primary",
+                        use_container_width=True
+                    )
+    elif status['state'] == 'failed':
+        st.error(f"❌ Error: {status['error']}")
+        st.info("💡 Tip: If you're experiencing issues, try with a shorter audio file or simpler settings.")
+    elif status['state'] == 'cancelled':
+        st.warning(f"🛑 Processing {status['reason']}.")
+    else:
+        # Server restarted or the job expired
+        del st.session_state.job_id
 
 # Footer
 st.markdown("---")
@@ -260,3 +297,8 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+
+# Poll again shortly, once the whole page (footer included) has been rendered
+if poll:
+    time.sleep(2)
+    st.rerun()
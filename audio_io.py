@@ -0,0 +1,252 @@
+import os
+import struct
+
+import numpy as np
+
+from cancellation import run_process
+
+# Formats used between pipeline stages:
+# - 'mp3': 320kbps MP3 (smallest files, lossy re-encode at every stage)
+# - 'wav': 32-bit float WAV (lossless, memory-mappable, no encode CPU)
+INTERMEDIATE_FORMATS = ('mp3', 'wav')
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Frames processed per block when streaming through memory-mapped files
+BLOCK_FRAMES = 1 << 20
+
+
+def encode_args(output_path: str) -> list:
+    """
+    FFmpeg output codec arguments for a stage output, chosen by file extension.
+
+    Args:
+        output_path: Path of the file FFmpeg will write
+
+    Returns:
+        List of FFmpeg arguments to place before the output path
+    """
+    if output_path.lower().endswith('.wav'):
+        return ['-c:a', 'pcm_f32le']
+    return ['-b:a', '320k']
+
+
+def read_wav(path: str):
+    """
+    Memory-map the samples of a PCM or float WAV file without decoding it.
+
+    Args:
+        path: Path to WAV file
+
+    Returns:
+        Tuple of (samples, sample_rate) where samples is a read-only
+        np.memmap of shape (frames, channels)
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError(f"Not a WAV file: {path}")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"WAV file has no data chunk: {path}")
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+
+            if chunk_id == b'fmt ':
+                chunk = f.read(chunk_size)
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', chunk[:16])
+                if audio_format == WAVE_FORMAT_EXTENSIBLE:
+                    # Real format code is the first two bytes of the sub-format GUID
+                    audio_format = struct.unpack('<H', chunk[24:26])[0]
+                fmt = (audio_format, channels, sample_rate, bits)
+            elif chunk_id == b'data':
+                data_offset = f.tell()
+                data_size = chunk_size
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    if fmt is None:
+        raise ValueError(f"WAV file has no fmt chunk: {path}")
+
+    audio_format, channels, sample_rate, bits = fmt
+    if audio_format == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        dtype = np.float32
+    elif audio_format == WAVE_FORMAT_PCM and bits == 16:
+        dtype = np.int16
+    elif audio_format == WAVE_FORMAT_PCM and bits == 32:
+        dtype = np.int32
+    else:
+        raise ValueError(f"Unsupported WAV encoding (format {audio_format}, {bits} bits): {path}")
+
+    # Streaming writers may leave the size field at 0/0xFFFFFFFF, so trust the file size
+    available = os.path.getsize(path) - data_offset
+    if data_size == 0 or data_size > available:
+        data_size = available
+    frames = data_size // (channels * np.dtype(dtype).itemsize)
+
+    samples = np.memmap(path, dtype=dtype, mode='r', offset=data_offset, shape=(frames, channels))
+    return samples, sample_rate
+
+
+def to_float(samples) -> np.ndarray:
+    """Convert a block of PCM samples to float32 in [-1, 1] (float input is returned as is)."""
+    if samples.dtype == np.float32:
+        return samples
+    scale = float(np.iinfo(samples.dtype).max) + 1.0
+    return samples.astype(np.float32) / scale
+
+
+def _wav_header(frames: int, channels: int, sample_rate: int) -> bytes:
+    data_size = frames * channels * 4
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, WAVE_FORMAT_IEEE_FLOAT, channels, sample_rate,
+        sample_rate * channels * 4, channels * 4, 32,
+        b'data', data_size
+    )
+
+
+def create_wav(path: str, frames: int, channels: int, sample_rate: int) -> np.memmap:
+    """
+    Create a 32-bit float WAV file of a given length and memory-map it for writing.
+
+    Args:
+        path: Output path
+        frames: Number of sample frames
+        channels: Number of channels
+        sample_rate: Sample rate in Hz
+
+    Returns:
+        Writable np.memmap of shape (frames, channels); call .flush() when done
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    header = _wav_header(frames, channels, sample_rate)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + frames * channels * 4)
+    return np.memmap(path, dtype=np.float32, mode='r+', offset=len(header), shape=(frames, channels))
+
+
+def write_wav(path: str, samples, sample_rate: int) -> str:
+    """
+    Write samples of shape (frames, channels) as a 32-bit float WAV file.
+
+    Returns:
+        path
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    frames, channels = samples.shape
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(_wav_header(frames, channels, sample_rate))
+        np.ascontiguousarray(samples).tofile(f)
+    return path
+
+
+def blend_wavs(paths: list, weights: list, output_path: str):
+    """
+    Weighted sum of WAV files, streamed block by block through memory maps.
+
+    Equivalent to FFmpeg's amix with normalize=0 and duration=longest:
+    shorter inputs are treated as silence once they run out.
+
+    Args:
+        paths: Input WAV files (same sample rate and channel count)
+        weights: One weight per input
+        output_path: Float WAV file to write
+
+    Returns:
+        output_path, or None if the inputs cannot be blended in place
+        (different sample rates or channel counts)
+    """
+    inputs = [read_wav(path) for path in paths]
+    sample_rate = inputs[0][1]
+    channels = inputs[0][0].shape[1]
+    if any(rate != sample_rate or samples.shape[1] != channels for samples, rate in inputs):
+        return None
+
+    frames = max(samples.shape[0] for samples, _ in inputs)
+    output = create_wav(output_path, frames, channels, sample_rate)
+
+    for start in range(0, frames, BLOCK_FRAMES):
+        end = min(start + BLOCK_FRAMES, frames)
+        block = np.zeros((end - start, channels), dtype=np.float32)
+        for (samples, _), weight in zip(inputs, weights):
+            part = samples[start:end]
+            if len(part):
+                block[:len(part)] += weight * to_float(part)
+        output[start:end] = block
+
+    output.flush()
+    del output
+    return output_path
+
+
+def decode_to_wav(input_path: str, output_path: str, sample_rate: int = 44100, channels: int = 2,
+                  start: float = None, duration: float = None) -> str:
+    """
+    Decode any FFmpeg-readable file to a 32-bit float WAV.
+
+    Args:
+        input_path: Source audio file
+        output_path: WAV file to write
+        sample_rate: Output sample rate in Hz
+        channels: Output channel count
+        start: Optional start offset in seconds
+        duration: Optional length in seconds
+
+    Returns:
+        output_path
+    """
+    command = ['ffmpeg', '-y', '-v', 'error', '-i', input_path, '-vn']
+    if start:
+        command.extend(['-ss', str(start)])
+    if duration:
+        command.extend(['-t', str(duration)])
+    command.extend(['-ar', str(sample_rate), '-ac', str(channels), '-c:a', 'pcm_f32le', output_path])
+
+    result = run_process(command, partial=[output_path], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to decode {input_path}: {result.stderr}")
+    return output_path
+
+
+def slice_audio(input_path: str, output_path: str, start: float, duration: float) -> str:
+    """
+    Cut [start, start + duration) seconds out of an audio file.
+
+    Float/PCM WAV input to a WAV output is sliced through a memory map (exact and
+    lossless); anything else is cut by FFmpeg after decoding, exact to the sample.
+
+    Returns:
+        output_path
+    """
+    if input_path.lower().endswith('.wav') and output_path.lower().endswith('.wav'):
+        try:
+            samples, sample_rate = read_wav(input_path)
+        except ValueError:
+            samples = None
+        if samples is not None:
+            first = int(round(start * sample_rate))
+            last = min(first + int(round(duration * sample_rate)), samples.shape[0])
+            return write_wav(output_path, to_float(samples[first:last]), sample_rate)
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    result = run_process(
+        ['ffmpeg', '-y', '-v', 'error', '-i', input_path, '-ss', str(start), '-t', str(duration),
+         *encode_args(output_path), output_path],
+        partial=[output_path],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to slice {input_path}: {result.stderr}")
+    return output_path
@@ -0,0 +1,315 @@
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from ingest import ingest_stream, convert_audio, stream_duration
+from jobs import default_worker_count, init_job_worker
+from cancellation import JobCancelled, cancel_scope, remove_partial
+from workspace import Workspace, reap_stale_workspaces
+from scheduler import total_cores
+from telemetry import telemetry_installed
+
+# Summary of a batch run: one entry per input with its outputs or error
+DEFAULT_REPORT = 'batch_report.json'
+
+
+def read_manifest(path: str) -> list:
+    """
+    Read the inputs listed in a manifest file.
+
+    Either a text file with one YouTube URL or file path per line (blank lines
+    and lines starting with # are skipped), or a .json file holding a list of them.
+    Relative file paths are resolved against the manifest's folder.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.lower().endswith('.json'):
+            entries = [str(entry) for entry in json.load(f)]
+        else:
+            entries = [line.strip() for line in f]
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    sources = []
+    for entry in entries:
+        if not entry or entry.startswith('#'):
+            continue
+        local_path = os.path.join(base_dir, entry)
+        if not os.path.isfile(entry) and os.path.isfile(local_path):
+            entry = local_path
+        sources.append(entry)
+    return sources
+
+
+def collect_sources(args: list) -> list:
+    """Expand command-line inputs: manifest files (.txt / .json) are replaced by their entries."""
+    sources = []
+    for arg in args:
+        arg = arg.replace('\\', '')
+        if os.path.isfile(arg) and arg.lower().endswith(('.txt', '.json')):
+            sources.extend(read_manifest(arg))
+        else:
+            sources.append(arg)
+    return sources
+
+
+class OutputNames:
+    """File names claimed by the songs of one batch; a repeated title gets a numbered suffix."""
+
+    def __init__(self):
+        self._taken = set()
+        self._lock = threading.Lock()
+
+    def claim(self, title: str) -> str:
+        base = title.replace('/', '-').replace('\\', '-')
+        with self._lock:
+            name, number = base, 2
+            while name in self._taken:
+                name, number = f"{base} ({number})", number + 1
+            self._taken.add(name)
+            return name
+
+
+def prepare_item(index: int, source: str, trim_start: int = 0, trim_end: int = 0,
+                 names: OutputNames = None) -> dict:
+    """
+    Download and convert stage: turn one input into a local audio file.
+
+    YouTube URLs are streamed, trimmed and converted to 320kbps MP3 @ 48kHz
+    exactly like single-song karaoke mode; local files are used as they are.
+    The item's workspace is created here, when its turn comes, and holds the
+    temporary download; it is handed on to the separation stage.
+
+    Args:
+        names: File names already taken in this batch, so two songs with the same
+            title never write (and overwrite) the same files
+
+    Returns:
+        Dict with 'audio' (local file to process), 'title', 'name' (base of its
+        output file names), 'is_url' and 'space' (the item's Workspace, to be
+        cleaned up by the caller)
+    """
+    space = Workspace(f"batch{os.getpid()}x{index}")
+    space.start_monitor()
+    try:
+        if os.path.isfile(source):
+            title = os.path.splitext(os.path.basename(source))[0]
+            return {'audio': source, 'title': title, 'name': title, 'is_url': False, 'space': space}
+
+        from pytubefix import YouTube
+
+        yt = YouTube(source)
+        audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
+        if not audio_stream:
+            raise RuntimeError("No audio stream found!")
+
+        name = (names or OutputNames()).claim(yt.title)
+        mp3_filename = f"{name}.mp3"
+        duration = stream_duration(audio_stream, yt.length)
+        try:
+            ingest_stream(audio_stream, mp3_filename, trim_start, trim_end, duration)
+        except JobCancelled:
+            raise
+        except RuntimeError:
+            # Not decodable from a pipe, download first (dropping anything half-written)
+            remove_partial([mp3_filename])
+            audio_file = audio_stream.download(output_path=space.path, filename='temp_batch_audio.mp4')
+            try:
+                convert_audio(audio_file, mp3_filename, trim_start, trim_end, duration)
+            finally:
+                os.remove(audio_file)
+
+        return {'audio': mp3_filename, 'title': yt.title, 'name': name, 'is_url': True, 'space': space}
+    except BaseException:
+        space.cleanup()
+        raise
+
+
+def process_item(audio_file: str, title: str, is_url: bool, karaoke: bool = True, pitch: int = 0,
+                 pitch_ladder: list = None, parallel: bool = True, fused: bool = False,
+                 intermediate: str = None, quality: str = None, deadline: float = None,
+                 vad: bool = None, work_dir: str = None, workspace_name: str = None,
+                 auto_trim: bool = False, keep_stages: bool = False) -> list:
+    """
+    Separation stage for one song. Runs in a batch worker process, which keeps its
+    separation models warm for every song it handles.
+
+    Args:
+        title: Base of the output file names of YouTube songs
+        auto_trim: Cut leading and trailing silence first, like --auto-trim
+        keep_stages: With fused, also write the ensemble / polished intermediates
+        deadline: Epoch time the whole batch should finish by; each song picks its
+            quality against the time left when its separation starts
+        work_dir: The item's workspace, for separation output and intermediates
+        workspace_name: Name of that workspace; a quota breach cancels the item
+
+    Returns:
+        List of output files
+    """
+    if workspace_name:
+        with cancel_scope(workspace_name):
+            return process_item(audio_file, title, is_url, karaoke, pitch, pitch_ladder, parallel,
+                                fused, intermediate, quality, deadline, vad, work_dir,
+                                auto_trim=auto_trim, keep_stages=keep_stages)
+
+    from main import create_demucs_karaoke, adjust_pitch, adjust_pitch_ladder
+    from vad import trim_silence
+
+    pitch_ladder = pitch_ladder or []
+
+    if auto_trim:
+        # Same as single-song mode: a downloaded MP3 is trimmed in place, a local
+        # file is left untouched and its trimmed copy is processed instead
+        base, ext = os.path.splitext(audio_file)
+        trimmed = audio_file if is_url else f"{base}_trimmed{ext}"
+        cut_start, cut_end = trim_silence(audio_file, trimmed, work_dir)
+        if cut_start or cut_end:
+            print(f"✂️  Auto-trim {title}: cut {cut_start:.1f}s of leading and {cut_end:.1f}s of trailing silence")
+            audio_file = trimmed
+
+    if not karaoke:
+        if pitch_ladder:
+            return [path for semitones, path in adjust_pitch_ladder(audio_file, pitch_ladder).items() if semitones != 0]
+        return [adjust_pitch(audio_file, pitch)]
+
+    output = create_demucs_karaoke(
+        audio_file, mode='professional', parallel=parallel,
+        pitch=pitch, fused=fused, keep_stages=keep_stages, intermediate=intermediate, work_dir=work_dir,
+        quality=quality, deadline=deadline, vad=vad
+    )
+
+    variants = []
+    if pitch_ladder:
+        for semitones, variant in adjust_pitch_ladder(output, pitch_ladder).items():
+            if semitones == 0:
+                continue
+            if is_url:
+                variant_filename = f"{title}_KARAOKE_pitch{semitones:+d}.mp3"
+                shutil.move(variant, variant_filename)
+                variant = variant_filename
+            variants.append(variant)
+
+    if is_url:
+        # Same naming as single-song YouTube karaoke mode
+        karaoke_filename = f"{title}_KARAOKE.mp3"
+        shutil.move(output, karaoke_filename)
+        output = karaoke_filename
+
+    return [output] + variants
+
+
+def run_batch(sources: list, workers: int = None, report_path: str = DEFAULT_REPORT,
+              trim_start: int = 0, trim_end: int = 0, **options) -> dict:
+    """
+    Process many songs as a two-stage pipeline.
+
+    Downloads and conversions run in a thread pool; as soon as a song is ready it
+    is handed to a pool of worker processes for separation, so downloading the
+    next songs overlaps with separating the previous ones. At most two songs per
+    worker are in flight at a time; every song gets its own workspace when it
+    enters the pipeline, removed as soon as the song is done. A failing song is
+    recorded in the report and does not stop the batch.
+
+    Args:
+        sources: YouTube URLs and/or local audio files
+        workers: Number of songs separated at the same time (default: by CPU cores and memory)
+        report_path: Where to write the JSON summary report
+        trim_start: Seconds to cut from the start (YouTube inputs)
+        trim_end: Seconds to cut from the end (YouTube inputs)
+        **options: Passed to process_item (karaoke, pitch, pitch_ladder, parallel, fused, intermediate,
+            quality, deadline, vad, auto_trim, keep_stages)
+
+    Returns:
+        The report dict (also written to report_path)
+    """
+    workers = workers or default_worker_count()
+    started = time.time()
+    items = [{'index': index, 'source': source, 'status': 'pending'} for index, source in enumerate(sources, 1)]
+
+    print(f"\n📦 Batch mode: {len(items)} songs, {workers} worker processes")
+
+    # One workspace per song, so concurrent songs never share temp files or separation folders.
+    # Songs enter the pipeline a few at a time, so only those in flight have a workspace.
+    reap_stale_workspaces()
+    waiting = deque(items)
+    max_in_flight = 2 * workers
+    spaces = {}
+    names = OutputNames()
+    item_started = {}
+    downloads = {}
+    separating = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as download_pool, \
+                ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_job_worker, initargs=(max(1, total_cores() // workers), None, telemetry_installed())
+                ) as separation_pool:
+
+            def admit():
+                while waiting and len(downloads) + len(separating) < max_in_flight:
+                    item = waiting.popleft()
+                    item_started[id(item)] = time.time()
+                    downloads[download_pool.submit(
+                        prepare_item, item['index'], item['source'], trim_start, trim_end, names
+                    )] = item
+
+            admit()
+            while downloads or separating:
+                done, _ = wait([*downloads, *separating], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in downloads:
+                        item = downloads.pop(future)
+                        item['prepare_seconds'] = round(time.time() - item_started[id(item)], 1)
+                        try:
+                            ready = future.result()
+                        except Exception as e:
+                            item.update(status='failed', stage='download', error=str(e))
+                            print(f"❌ [{item['index']}/{len(items)}] Download failed: {item['source']} ({e})")
+                            continue
+
+                        item['title'] = ready['title']
+                        item_started[id(item)] = time.time()
+                        print(f"⬇️  [{item['index']}/{len(items)}] Ready for separation: {ready['title']}")
+                        space = spaces[id(item)] = ready['space']
+                        separating[separation_pool.submit(
+                            process_item, ready['audio'], ready['name'], ready['is_url'],
+                            work_dir=space.path, workspace_name=space.name, **options
+                        )] = item
+                    else:
+                        item = separating.pop(future)
+                        item['process_seconds'] = round(time.time() - item_started[id(item)], 1)
+                        try:
+                            item.update(status='ok', outputs=future.result())
+                            print(f"✅ [{item['index']}/{len(items)}] Done: {item['title']}")
+                        except Exception as e:
+                            item.update(status='failed', stage='separation', error=str(e))
+                            print(f"❌ [{item['index']}/{len(items)}] Failed: {item['title']} ({e})")
+                        spaces.pop(id(item)).cleanup()
+                admit()
+    finally:
+        for space in spaces.values():
+            space.cleanup()
+        # Workspaces of downloads still running when the batch was interrupted
+        for future in downloads:
+            if future.done() and not future.exception():
+                future.result()['space'].cleanup()
+
+    report = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'elapsed_seconds': round(time.time() - started, 1),
+        'workers': workers,
+        'succeeded': sum(1 for item in items if item['status'] == 'ok'),
+        'failed': sum(1 for item in items if item['status'] == 'failed'),
+        'items': items,
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n📊 Batch complete: {report['succeeded']} succeeded, {report['failed']} failed "
+          f"in {report['elapsed_seconds'] / 60:.1f} min")
+    print(f"📁 Report: {report_path}")
+    return report
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Check the concurrent video/audio download of video mode against a local HTTP
+stand-in for YouTube.
+
+Two files are served by http.server, the video one throttled so its download
+takes a few seconds, and fetched through stream objects with a pytubefix-style
+download(filename=..., interrupt_checker=...) method. main.download_video_and_audio()
+must start processing the audio while the video is still downloading. When the
+processing fails, the error must come back without waiting for the video, and
+no partial video file may be left behind.
+
+    python benchmarks/check_download.py
+    python benchmarks/check_download.py --video-mb=16 --rate-mb=4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from check_ingest import QuietHandler, serve, http_chunks
+from main import download_video_and_audio
+
+CHUNK_SIZE = 64 * 1024
+
+
+def throttled_handler(rate: float):
+    """Request handler sending video files at `rate` bytes per second, everything else at once."""
+    class ThrottledHandler(QuietHandler):
+        def copyfile(self, source, outputfile):
+            if not self.path.startswith('/video'):
+                return super().copyfile(source, outputfile)
+            try:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    outputfile.write(chunk)
+                    time.sleep(len(chunk) / rate)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client stopped the download
+    return ThrottledHandler
+
+
+class LocalStream:
+    """Stand-in for a pytubefix Stream served from the local test server."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.finished = threading.Event()
+
+    def download(self, filename: str = None, interrupt_checker=None):
+        with open(filename, 'wb') as f:
+            for chunk in http_chunks(self.url, CHUNK_SIZE):
+                # Same contract as pytubefix: stop quietly, return None, keep the partial file
+                if interrupt_checker is not None and interrupt_checker():
+                    return None
+                f.write(chunk)
+        self.finished.set()
+        return filename
+
+
+def check_overlap(server, workdir: str) -> bool:
+    base = f'http://127.0.0.1:{server.server_port}'
+    video, audio = LocalStream(f'{base}/video.mp4'), LocalStream(f'{base}/audio.mp4')
+    seen = {}
+
+    def process_audio(audio_file):
+        seen['video_done'] = video.finished.is_set()
+        return audio_file
+
+    video_file, audio_file = download_video_and_audio(
+        video, audio, process_audio,
+        video_filename=os.path.join(workdir, 'video.mp4'), audio_filename=os.path.join(workdir, 'audio.mp4')
+    )
+    complete = all(
+        os.path.getsize(path) == os.path.getsize(os.path.join(workdir, 'www', name))
+        for path, name in ((video_file, 'video.mp4'), (audio_file, 'audio.mp4'))
+    )
+    ok = seen.get('video_done') is False and complete
+    print(f"{'✅' if ok else '❌'} Overlap: audio processed {'after' if seen.get('video_done') else 'while'} "
+          f"the video downloaded, {'both files complete' if complete else 'incomplete files'}")
+    return ok
+
+
+def check_failure(server, workdir: str, video_seconds: float) -> bool:
+    base = f'http://127.0.0.1:{server.server_port}'
+    video, audio = LocalStream(f'{base}/video.mp4'), LocalStream(f'{base}/audio.mp4')
+    video_path = os.path.join(workdir, 'failed_video.mp4')
+
+    def process_audio(audio_file):
+        raise RuntimeError('pitch shift failed')
+
+    started = time.time()
+    try:
+        download_video_and_audio(video, audio, process_audio, video_filename=video_path,
+                                 audio_filename=os.path.join(workdir, 'failed_audio.mp4'))
+    except RuntimeError as e:
+        elapsed = time.time() - started
+        prompt = elapsed < video_seconds / 2
+        clean = not os.path.exists(video_path)
+        ok = str(e) == 'pitch shift failed' and prompt and clean
+        print(f"{'✅' if ok else '❌'} Failure: error raised after {elapsed:.2f}s "
+              f"(video takes {video_seconds:.1f}s), {'no partial video left' if clean else 'partial video left behind'}")
+        return ok
+    print("❌ Failure: the processing error was not raised")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video-mb', type=float, default=8, help='Size of the served video file')
+    parser.add_argument('--audio-mb', type=float, default=1, help='Size of the served audio file')
+    parser.add_argument('--rate-mb', type=float, default=4, help='Video download speed in MB/s')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='download_check_')
+    os.makedirs(os.path.join(workdir, 'www'))
+    for name, megabytes in (('video.mp4', args.video_mb), ('audio.mp4', args.audio_mb)):
+        with open(os.path.join(workdir, 'www', name), 'wb') as f:
+            f.write(os.urandom(int(megabytes * 1024 * 1024)))
+
+    server = serve(os.path.join(workdir, 'www'), throttled_handler(args.rate_mb * 1024 * 1024))
+    try:
+        results = [
+            check_overlap(server, workdir),
+            check_failure(server, workdir, args.video_mb / args.rate_mb),
+        ]
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Check the streaming ingest path against a local HTTP stand-in for YouTube.
+
+A synthetic track is served by http.server and piped through
+ingest.ingest_stream() exactly like a pytubefix stream body, with a trim at both
+ends; the output duration must match the trimmed length. A second run serves
+bytes FFmpeg cannot decode, which must raise RuntimeError (the callers' cue to
+fall back to a download) and leave no partial output behind.
+
+    python benchmarks/check_ingest.py
+    python benchmarks/check_ingest.py --seconds=60 --trim-start=5 --trim-end=5
+"""
+import argparse
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import urllib.request
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from run_pipeline import synthetic_song
+from ingest import ingest_stream
+from media_index import probe_media
+
+# MP3 encoder delay and frame padding
+DURATION_TOLERANCE = 0.1
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory: str, handler=QuietHandler) -> ThreadingHTTPServer:
+    """Serve directory on a free local port from a background thread."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=directory))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='ingest-check-server', daemon=True).start()
+    return server
+
+
+def http_chunks(url: str, chunk_size: int = 64 * 1024):
+    """Yield the body of url as it arrives, like pytubefix.request.stream()."""
+    with urllib.request.urlopen(url) as response:
+        for chunk in iter(lambda: response.read(chunk_size), b''):
+            yield chunk
+
+
+def check_trimmed(server, workdir: str, seconds: float, trim_start: float, trim_end: float) -> bool:
+    source = synthetic_song(os.path.join(workdir, 'www', 'song.mp3'), seconds)
+    url = f'http://127.0.0.1:{server.server_port}/song.mp3'
+    stream = SimpleNamespace(url=url, filesize=os.path.getsize(source))
+    output = os.path.join(workdir, 'ingested.mp3')
+
+    ingest_stream(stream, output, trim_start, trim_end, seconds, chunks=http_chunks(url))
+    duration = probe_media(output)['duration']
+    expected = seconds - trim_start - trim_end
+    ok = abs(duration - expected) <= DURATION_TOLERANCE
+    print(f"{'✅' if ok else '❌'} Trimmed stream: {duration:.3f}s (expected {expected:.3f}s)")
+    return ok
+
+
+def check_undecodable(server, workdir: str) -> bool:
+    with open(os.path.join(workdir, 'www', 'broken.mp4'), 'wb') as f:
+        f.write(os.urandom(256 * 1024))
+    url = f'http://127.0.0.1:{server.server_port}/broken.mp4'
+    output = os.path.join(workdir, 'broken.mp3')
+
+    try:
+        ingest_stream(SimpleNamespace(url=url, filesize=None), output, chunks=http_chunks(url))
+    except RuntimeError:
+        ok = not os.path.exists(output)
+        print(f"{'✅' if ok else '❌'} Undecodable stream: RuntimeError raised, "
+              f"{'no partial output left' if ok else 'partial output left behind'}")
+        return ok
+    print("❌ Undecodable stream: no RuntimeError, the download fallback would never run")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=30, help='Length of the served test track')
+    parser.add_argument('--trim-start', type=float, default=3, help='Seconds cut from the start')
+    parser.add_argument('--trim-end', type=float, default=2, help='Seconds cut from the end')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ingest_check_')
+    os.makedirs(os.path.join(workdir, 'www'))
+    server = serve(os.path.join(workdir, 'www'))
+    try:
+        results = [
+            check_trimmed(server, workdir, args.seconds, args.trim_start, args.trim_end),
+            check_undecodable(server, workdir),
+        ]
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
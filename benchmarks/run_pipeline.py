@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Stage-level benchmark of the karaoke pipeline.
+
+Generates synthetic stereo material, runs basic and/or professional mode end to
+end with stand-in `demucs` / `audio-separator` binaries (benchmarks/stubs, no
+network or GPU needed) and records wall time, CPU time, peak RSS and bytes
+written for every pipeline stage. Results are written as JSON so runs can be
+compared across commits:
+
+    python benchmarks/run_pipeline.py --seconds=120 --modes=basic,professional
+    python benchmarks/run_pipeline.py --baseline=benchmarks/results/<earlier>.json
+
+Every run happens in a fresh working directory and cache, in its own process.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_DIR = os.path.join(BENCH_DIR, 'stubs')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+SAMPLE_RATE = 44100
+
+
+def synthetic_song(path: str, seconds: float, seed: int = 0) -> str:
+    """
+    Write a stereo test track: panned chord pad and bass (the "instrumental") plus
+    a centered vibrato lead (the "vocal") and noise percussion.
+    """
+    import numpy as np
+    sys.path.insert(0, REPO_DIR)
+    from audio_io import write_wav
+
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * SAMPLE_RATE)
+    t = np.arange(frames) / SAMPLE_RATE
+    left = np.zeros(frames, dtype=np.float32)
+    right = np.zeros(frames, dtype=np.float32)
+
+    beat = SAMPLE_RATE // 2
+    chords = [(57, 60, 64), (53, 57, 60), (55, 59, 62), (52, 55, 59)]
+    for start in range(0, frames, beat * 4):
+        end = min(start + beat * 4, frames)
+        chord = chords[(start // (beat * 4)) % len(chords)]
+        for index, note in enumerate(chord):
+            tone = 0.12 * np.sin(2 * np.pi * 440 * 2 ** ((note - 69) / 12) * t[start:end])
+            pan = index / (len(chord) - 1)
+            left[start:end] += tone * (1 - pan)
+            right[start:end] += tone * pan
+        bass = 0.2 * np.sin(2 * np.pi * 440 * 2 ** ((chord[0] - 81) / 12) * t[start:end])
+        left[start:end] += bass
+        right[start:end] += bass
+
+    melody = rng.integers(64, 76, size=frames // beat + 1)
+    frequency = 440 * 2 ** ((melody[np.arange(frames) // beat] - 69) / 12)
+    phase = 2 * np.pi * np.cumsum(frequency * (1 + 0.01 * np.sin(2 * np.pi * 5 * t))) / SAMPLE_RATE
+    vocal = (0.2 * np.sin(phase)).astype(np.float32)
+    left += vocal
+    right += vocal
+
+    for start in range(0, frames, beat):
+        length = min(2000, frames - start)
+        hit = 0.3 * rng.standard_normal(length) * np.exp(-np.arange(length) / 300)
+        left[start:start + length] += hit
+        right[start:start + length] += hit
+
+    samples = np.stack([left, right], axis=1)
+    wav_path = os.path.splitext(path)[0] + '.wav'
+    write_wav(wav_path, samples / max(1.0, np.abs(samples).max()), SAMPLE_RATE)
+    if path == wav_path:
+        return path
+
+    result = subprocess.run(['ffmpeg', '-y', '-v', 'error', '-i', wav_path, '-b:a', '320k', path],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to encode test track: {result.stderr}")
+    os.remove(wav_path)
+    return path
+
+
+def tree_rss_bytes() -> int:
+    """Resident memory of this process plus all its descendants (Linux /proc; 0 elsewhere)."""
+    if not os.path.isdir('/proc'):
+        return 0
+    parents = {}
+    rss = {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+            with open(f'/proc/{entry}/statm') as f:
+                resident = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        # Fields after the parenthesised command name: state, ppid, ...
+        parents[int(entry)] = int(stat.rsplit(')', 1)[1].split()[1])
+        rss[int(entry)] = resident * page_size
+
+    total = 0
+    tree = {os.getpid()}
+    for pid in sorted(parents):
+        chain = pid
+        seen = set()
+        while chain not in tree and chain in parents and chain not in seen:
+            seen.add(chain)
+            chain = parents[chain]
+        if chain in tree:
+            tree.update(seen)
+    for pid in tree:
+        total += rss.get(pid, 0)
+    return total
+
+
+def directory_sizes(path: str) -> dict:
+    sizes = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            try:
+                sizes[file_path] = os.path.getsize(file_path)
+            except OSError:
+                pass
+    return sizes
+
+
+class StageRecorder:
+    """
+    Stage listener collecting wall time, CPU time (this process and finished
+    children), peak RSS of the process tree, and bytes written to the working
+    directory for every stage.
+    """
+
+    def __init__(self, watch_dirs: list, interval: float = 0.05):
+        self.watch_dirs = watch_dirs
+        self.interval = interval
+        self.stages = []
+        self._open = {}
+        self._lock = threading.Lock()
+        self._peak = 0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = tree_rss_bytes()
+            with self._lock:
+                self._peak = max(self._peak, rss)
+                for record in self._open.values():
+                    record['peak'] = max(record['peak'], rss)
+            self._stop.wait(self.interval)
+
+    def _sizes(self) -> dict:
+        sizes = {}
+        for path in self.watch_dirs:
+            sizes.update(directory_sizes(path))
+        return sizes
+
+    @staticmethod
+    def _cpu() -> float:
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+
+    def __call__(self, event: str, name: str, info: dict):
+        key = (name, threading.get_ident())
+        if event == 'start':
+            with self._lock:
+                self._open[key] = {
+                    'wall': time.perf_counter(), 'cpu': self._cpu(),
+                    'sizes': self._sizes(), 'peak': tree_rss_bytes()
+                }
+            return
+
+        with self._lock:
+            record = self._open.pop(key, None)
+        if record is None:
+            return
+        before = record['sizes']
+        written = sum(max(0, size - before.get(path, 0)) for path, size in self._sizes().items())
+        entry = {
+            'name': name,
+            'info': {k: v for k, v in info.items() if k not in ('seconds', 'error')},
+            'wall_seconds': round(time.perf_counter() - record['wall'], 3),
+            'cpu_seconds': round(self._cpu() - record['cpu'], 3),
+            'peak_rss_mb': round(record['peak'] / 1024 ** 2, 1),
+            'bytes_written': written,
+        }
+        if 'error' in info:
+            entry['error'] = info['error']
+        with self._lock:
+            self.stages.append(entry)
+
+    def close(self) -> float:
+        """Stop sampling and return the overall peak RSS in MB."""
+        self._stop.set()
+        self._sampler.join()
+        return round(self._peak / 1024 ** 2, 1)
+
+
+def run_one(args) -> dict:
+    """Run a single pipeline invocation (called in a fresh child process)."""
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    import main as pipeline
+    from stages import add_stage_listener
+
+    input_file = os.path.join(args.workdir, f'bench_song.{args.input_format}')
+    recorder = StageRecorder([args.workdir])
+    add_stage_listener(recorder)
+
+    started = time.perf_counter()
+    cpu_started = StageRecorder._cpu()
+    error = None
+    try:
+        pipeline.create_demucs_karaoke(
+            input_file, mode=args.run_one, pitch=args.pitch,
+            fused=args.fused, intermediate=args.intermediate,
+            parallel=not args.sequential
+        )
+    except Exception as e:
+        error = str(e)
+
+    result = {
+        'mode': args.run_one,
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'total_cpu_seconds': round(StageRecorder._cpu() - cpu_started, 3),
+        'peak_rss_mb': recorder.close(),
+        'stages': recorder.stages,
+    }
+    if error:
+        result['error'] = error
+    return result
+
+
+def git_commit() -> str:
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else 'unknown'
+
+
+def summarize(report: dict) -> dict:
+    """Mean wall seconds per (mode, stage), plus each mode's total."""
+    sums = {}
+    for run in report['runs']:
+        totals = sums.setdefault((run['mode'], 'TOTAL'), [])
+        totals.append(run['total_seconds'])
+        per_stage = {}
+        for entry in run['stages']:
+            per_stage[entry['name']] = per_stage.get(entry['name'], 0) + entry['wall_seconds']
+        for name, seconds in per_stage.items():
+            sums.setdefault((run['mode'], name), []).append(seconds)
+    return {key: sum(values) / len(values) for key, values in sums.items()}
+
+
+def compare(report: dict, baseline: dict, threshold: float, min_seconds: float = 0.5) -> list:
+    """List (mode, stage, baseline, current) entries slower than baseline by more than threshold."""
+    current = summarize(report)
+    previous = summarize(baseline)
+    regressions = []
+    print(f"\n{'mode':<14}{'stage':<14}{'baseline':>10}{'current':>10}{'change':>9}")
+    for key in sorted(current):
+        if key not in previous:
+            continue
+        before, after = previous[key], current[key]
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if after - before > min_seconds and change > threshold:
+            regressions.append((*key, before, after))
+            flag = '  ⚠️'
+        print(f"{key[0]:<14}{key[1]:<14}{before:>9.2f}s{after:>9.2f}s{change:>+8.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=60, help='Length of the synthetic test track')
+    parser.add_argument('--modes', default='basic,professional', help='Comma-separated pipeline modes')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per mode')
+    parser.add_argument('--pitch', type=int, default=0, help='Pitch shift applied at the end')
+    parser.add_argument('--fused', action='store_true', help='Use the fused FFmpeg post-processing')
+    parser.add_argument('--sequential', action='store_true', help='Run Demucs and MDX-Net one after the other')
+    parser.add_argument('--intermediate', default='mp3', choices=['mp3', 'wav'], help='Intermediate format')
+    parser.add_argument('--input-format', default='mp3', choices=['mp3', 'wav'], help='Format of the test track')
+    parser.add_argument('--stub-cpu', type=float, default=0, help='Emulated separator cost, CPU seconds per audio minute')
+    parser.add_argument('--real-separators', action='store_true', help='Use the installed demucs/audio-separator instead of stubs')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<time>-<commit>.json)')
+    parser.add_argument('--baseline', help='Earlier result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown before flagging a regression')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directories')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        with open(args.result_file, 'w') as f:
+            json.dump(run_one(args), f)
+        return
+
+    env = dict(os.environ)
+    if not args.real_separators:
+        env['PATH'] = STUB_DIR + os.pathsep + env.get('PATH', '')
+        env['KARAOKE_SEPARATOR_BACKEND'] = 'cli'
+    env['BENCH_STUB_CPU'] = str(args.stub_cpu)
+    # Keep runs from leaving __pycache__ folders beside the harness and its stubs
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    report = {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'settings': {
+            'seconds': args.seconds, 'pitch': args.pitch, 'fused': args.fused,
+            'sequential': args.sequential, 'intermediate': args.intermediate,
+            'input_format': args.input_format, 'stub_cpu': args.stub_cpu,
+            'separators': 'real' if args.real_separators else 'stub',
+        },
+        'runs': [],
+    }
+
+    for mode in args.modes.split(','):
+        for repeat in range(args.repeat):
+            workdir = tempfile.mkdtemp(prefix=f'bench_{mode}_')
+            try:
+                synthetic_song(os.path.join(workdir, f'bench_song.{args.input_format}'), args.seconds)
+                run_env = dict(env, KARAOKE_CACHE_DIR=os.path.join(workdir, 'cache'))
+                result_file = os.path.join(workdir, 'result.json')
+
+                print(f"⏱️  {mode} run {repeat + 1}/{args.repeat} ({args.seconds:.0f}s of audio)...")
+                subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--run-one', mode, '--workdir', workdir,
+                     '--result-file', result_file, '--pitch', str(args.pitch),
+                     '--intermediate', args.intermediate, '--input-format', args.input_format,
+                     *(['--fused'] if args.fused else []), *(['--sequential'] if args.sequential else [])],
+                    env=run_env,
+                    stdout=subprocess.DEVNULL,
+                    check=True
+                )
+                with open(result_file) as f:
+                    run = json.load(f)
+                run['repeat'] = repeat
+                report['runs'].append(run)
+
+                status = f"❌ {run['error']}" if 'error' in run else '✅'
+                print(f"   {status} {run['total_seconds']:.2f}s wall, {run['total_cpu_seconds']:.2f}s CPU, "
+                      f"{run['peak_rss_mb']:.0f} MB peak")
+                for entry in run['stages']:
+                    print(f"      {entry['name']:<12}{entry['wall_seconds']:>8.2f}s{entry['cpu_seconds']:>8.2f}s CPU"
+                          f"{entry['peak_rss_mb']:>8.0f} MB{entry['bytes_written'] / 1024 ** 2:>8.1f} MB written")
+            finally:
+                if args.keep:
+                    print(f"   📁 Kept: {workdir}")
+                else:
+                    shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📊 Results: {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n⚠️  {len(regressions)} stage(s) slower than baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print(f"\n✅ No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import json
+import os
+import subprocess
+import time
+
+
+def audio_seconds(audio_file: str) -> float:
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', audio_file],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        return 0.0
+    return float(json.loads(result.stdout)['format']['duration'])
+
+
+def burn_cpu(audio_length: float):
+    """Busy-loop for BENCH_STUB_CPU CPU-seconds per minute of audio."""
+    per_minute = float(os.environ.get('BENCH_STUB_CPU', 0))
+    deadline = time.process_time() + per_minute * audio_length / 60
+    value = 0
+    while time.process_time() < deadline:
+        value += 1
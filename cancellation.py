@@ -0,0 +1,214 @@
+import os
+import shutil
+import signal
+import subprocess
+import threading
+from contextlib import contextmanager
+
+# Cancel requests are marker files, so the web app can cancel a job running in
+# another process without sharing anything but the filesystem
+CANCEL_DIR = os.path.expanduser(os.environ.get('KARAOKE_CANCEL_DIR', '~/.cache/ai-karaoke-maker/cancel'))
+
+# How often a running job looks for its cancel marker
+CANCEL_POLL_INTERVAL = 0.5
+
+# Seconds a process group gets to exit after SIGTERM before it is killed
+KILL_GRACE = 5
+
+
+class JobCancelled(RuntimeError):
+    """Raised inside a job once it has been cancelled."""
+
+
+def _marker(job_id: str) -> str:
+    return os.path.join(CANCEL_DIR, job_id)
+
+
+def request_cancel(job_id: str, reason: str = 'cancelled'):
+    """Ask a running job to stop; its process groups are killed within CANCEL_POLL_INTERVAL."""
+    os.makedirs(CANCEL_DIR, exist_ok=True)
+    with open(_marker(job_id), 'w') as f:
+        f.write(reason)
+
+
+def clear_cancel(job_id: str):
+    try:
+        os.remove(_marker(job_id))
+    except FileNotFoundError:
+        pass
+
+
+def _cancel_reason(job_id: str):
+    try:
+        with open(_marker(job_id)) as f:
+            return f.read() or 'cancelled'
+    except FileNotFoundError:
+        return None
+
+
+# The job running in this process (job workers run one job at a time) and the
+# subprocesses it has started
+_scope = {'job_id': None, 'reason': None}
+_processes = set()
+_lock = threading.Lock()
+
+
+def kill_group(process: subprocess.Popen):
+    """Terminate a process started by popen() together with all of its children."""
+    if process.poll() is not None:
+        return
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        process.wait(timeout=KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def cancelled() -> bool:
+    """Whether the job running in this process has been cancelled."""
+    return _scope['reason'] is not None
+
+
+def check_cancelled():
+    """Raise JobCancelled if the job running in this process has been cancelled."""
+    if _scope['reason'] is not None:
+        raise JobCancelled(f"Job {_scope['job_id']} {_scope['reason']}")
+
+
+def _watch(job_id: str, stop: threading.Event):
+    while not stop.wait(CANCEL_POLL_INTERVAL):
+        reason = _cancel_reason(job_id)
+        if reason is None:
+            continue
+        _scope['reason'] = reason
+        with _lock:
+            processes = list(_processes)
+        for process in processes:
+            kill_group(process)
+        return
+
+
+@contextmanager
+def cancel_scope(job_id: str):
+    """
+    Run a job so it can be cancelled with request_cancel(job_id).
+
+    A watcher thread polls for the cancel marker; on cancellation every process
+    group started through popen()/run_process() is killed and the job's next
+    check_cancelled() (run_process() does this itself) raises JobCancelled.
+    """
+    stop = threading.Event()
+    _scope.update(job_id=job_id, reason=_cancel_reason(job_id))
+    watcher = threading.Thread(target=_watch, args=(job_id, stop), name=f'cancel-{job_id}', daemon=True)
+    watcher.start()
+    try:
+        check_cancelled()
+        yield
+    finally:
+        stop.set()
+        watcher.join()
+        _scope.update(job_id=None, reason=None)
+        clear_cancel(job_id)
+
+
+def popen(command: list, **kwargs) -> subprocess.Popen:
+    """
+    subprocess.Popen in its own process group, killed with its children if the job
+    is cancelled. Call release() once it has exited.
+    """
+    check_cancelled()
+    process = subprocess.Popen(command, start_new_session=True, **kwargs)
+    with _lock:
+        _processes.add(process)
+    if cancelled():
+        # Cancelled between the check and the registration
+        kill_group(process)
+    return process
+
+
+def release(process: subprocess.Popen):
+    with _lock:
+        _processes.discard(process)
+
+
+def remove_partial(paths):
+    """Delete half-written outputs so later runs don't mistake them for finished ones."""
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+@contextmanager
+def atomic_outputs(*paths):
+    """
+    Have a stage write its outputs under temporary names and rename them into place.
+
+    Yields one temporary path per output (same extension, so FFmpeg picks the same
+    format). When the block finishes without an exception, every temporary file is
+    renamed over its final path; otherwise they are deleted. An existing output is
+    therefore replaced, never truncated in place while someone else reads it.
+    """
+    temps = []
+    for path in paths:
+        root, ext = os.path.splitext(path)
+        temps.append(f'{root}.{os.getpid()}.{threading.get_ident()}.part{ext}')
+    try:
+        yield temps
+        for temp, path in zip(temps, paths):
+            if os.path.exists(temp):
+                os.replace(temp, path)
+    finally:
+        remove_partial(temps)
+
+
+def run_process(command: list, timeout: float = None, partial=(), input=None,
+                capture_output: bool = False, **kwargs) -> subprocess.CompletedProcess:
+    """
+    Cancellable drop-in for subprocess.run.
+
+    The command gets its own process group, which is killed as a whole on
+    cancellation, timeout or interrupt (Ctrl+C), so no grandchild keeps running.
+
+    Args:
+        command: Command to run
+        timeout: Seconds before the process group is killed (raises subprocess.TimeoutExpired)
+        partial: Output paths to delete if the command does not succeed
+        input: Data sent to stdin
+        capture_output: Capture stdout and stderr
+        **kwargs: Other subprocess.Popen arguments (text, env, ...)
+
+    Raises:
+        JobCancelled: If the job was cancelled while the command ran
+    """
+    if capture_output:
+        kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+
+    process = popen(command, **kwargs)
+    try:
+        stdout, stderr = process.communicate(input, timeout=timeout)
+    except BaseException:
+        kill_group(process)
+        process.communicate()
+        remove_partial(partial)
+        raise
+    finally:
+        release(process)
+
+    if process.returncode != 0:
+        remove_partial(partial)
+    check_cancelled()
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
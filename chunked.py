@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from audio_io import read_wav, write_wav, create_wav, decode_to_wav, to_float, BLOCK_FRAMES
+from cancellation import run_process
+
+# Window length and crossfade for chunked separation (override with environment variables).
+# 0 disables chunking; tracks shorter than 1.5 windows are always separated in one go.
+DEFAULT_CHUNK_SECONDS = float(os.environ.get('KARAOKE_CHUNK_SECONDS', 300))
+DEFAULT_OVERLAP_SECONDS = float(os.environ.get('KARAOKE_CHUNK_OVERLAP', 10))
+DEFAULT_CHUNK_WORKERS = int(os.environ.get('KARAOKE_CHUNK_WORKERS', 1))
+
+SAMPLE_RATE = 44100
+
+
+def should_chunk(duration: float, chunk_seconds: float = None) -> bool:
+    """Whether a track of `duration` seconds is long enough to be separated in chunks."""
+    chunk_seconds = DEFAULT_CHUNK_SECONDS if chunk_seconds is None else chunk_seconds
+    return chunk_seconds > 0 and duration > chunk_seconds * 1.5
+
+
+def plan_windows(total_frames: int, chunk_frames: int, overlap_frames: int) -> list:
+    """
+    Split a track into overlapping windows.
+
+    Returns:
+        List of (start, end) frame ranges; consecutive windows share overlap_frames
+    """
+    if total_frames <= chunk_frames:
+        return [(0, total_frames)]
+
+    step = chunk_frames - overlap_frames
+    windows = []
+    start = 0
+    while True:
+        end = min(start + chunk_frames, total_frames)
+        windows.append((start, end))
+        if end >= total_frames:
+            break
+        start += step
+
+    # Fold a tiny tail window into the previous one
+    if len(windows) > 1 and windows[-1][1] - windows[-1][0] <= overlap_frames:
+        windows.pop()
+        windows[-1] = (windows[-1][0], total_frames)
+    return windows
+
+
+def crossfade_weights(length: int, fade_in: int, fade_out: int) -> np.ndarray:
+    """
+    Per-frame gain for one window: linear ramps at the overlapping edges, 1.0 elsewhere.
+    Complementary ramps of neighbouring windows sum to exactly 1.0.
+    """
+    weights = np.ones(length, dtype=np.float32)
+    if fade_in:
+        weights[:fade_in] = np.linspace(0.0, 1.0, fade_in, endpoint=False, dtype=np.float32)
+    if fade_out:
+        weights[length - fade_out:] = np.linspace(1.0, 0.0, fade_out, endpoint=False, dtype=np.float32)
+    return weights
+
+
+def separate_chunked(audio_path: str, separate_chunk, output_path: str,
+                     chunk_seconds: float = None, overlap_seconds: float = None,
+                     workers: int = None, progress=None) -> str:
+    """
+    Separate a long track window by window and crossfade the results back together.
+
+    The input is decoded once to a float WAV on disk; each window is sliced out of
+    the memory-mapped samples, separated on its own, and overlap-added into a
+    memory-mapped output. Peak memory therefore depends on the window length,
+    not on the track length.
+
+    Args:
+        audio_path: Path to input audio file
+        separate_chunk: Function (chunk_wav_path, chunk_output_dir) -> path of the
+            separated stem for that chunk
+        output_path: Where to write the stitched stem (.wav, or .mp3 to encode at the end)
+        chunk_seconds: Window length in seconds
+        overlap_seconds: Crossfade length between neighbouring windows
+        workers: Number of windows separated at the same time
+        progress: Optional callback(done_chunks, total_chunks) called as windows finish
+
+    Returns:
+        output_path
+    """
+    chunk_seconds = chunk_seconds or DEFAULT_CHUNK_SECONDS
+    overlap_seconds = DEFAULT_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+    workers = workers or DEFAULT_CHUNK_WORKERS
+
+    work_dir = tempfile.mkdtemp(prefix='chunks_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        source_wav = decode_to_wav(audio_path, os.path.join(work_dir, 'source.wav'), SAMPLE_RATE)
+        source, sample_rate = read_wav(source_wav)
+        total_frames, channels = source.shape
+
+        overlap_frames = int(overlap_seconds * sample_rate)
+        windows = plan_windows(total_frames, int(chunk_seconds * sample_rate), overlap_frames)
+        print(f"   🧩 Chunked separation: {len(windows)} windows of {chunk_seconds:.0f}s ({overlap_seconds:.0f}s crossfade)")
+
+        stitched_path = output_path if output_path.lower().endswith('.wav') else os.path.join(work_dir, 'stitched.wav')
+        stitched = create_wav(stitched_path, total_frames, channels, sample_rate)
+        stitch_lock = threading.Lock()
+
+        def run_window(index):
+            start, end = windows[index]
+            chunk_dir = os.path.join(work_dir, f'chunk_{index:04d}')
+            chunk_path = write_wav(os.path.join(chunk_dir, f'chunk_{index:04d}.wav'), source[start:end], sample_rate)
+            separated_path = separate_chunk(chunk_path, os.path.join(chunk_dir, 'out'))
+            if not separated_path or not os.path.exists(separated_path):
+                raise FileNotFoundError(f"Separator produced no output for chunk {index + 1}/{len(windows)}")
+
+            if not separated_path.lower().endswith('.wav'):
+                separated_path = decode_to_wav(separated_path, os.path.join(chunk_dir, 'separated.wav'), sample_rate, channels)
+            separated, separated_rate = read_wav(separated_path)
+            if separated_rate != sample_rate:
+                raise RuntimeError(f"Separator returned {separated_rate}Hz audio for a {sample_rate}Hz chunk")
+
+            length = end - start
+            fade_in = overlap_frames if index > 0 else 0
+            fade_out = overlap_frames if index < len(windows) - 1 else 0
+            weights = crossfade_weights(length, fade_in, fade_out)[:, None]
+
+            with stitch_lock:
+                for offset in range(0, length, BLOCK_FRAMES):
+                    block_end = min(offset + BLOCK_FRAMES, length, separated.shape[0])
+                    if block_end <= offset:
+                        break
+                    block = to_float(separated[offset:block_end]) * weights[offset:block_end]
+                    stitched[start + offset:start + block_end] += block
+
+            del separated
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_window, index) for index in range(len(windows))]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                print(f"   ✅ Chunk {done}/{len(windows)} separated")
+                if progress:
+                    progress(done, len(windows))
+
+        stitched.flush()
+        del stitched
+        del source
+
+        if stitched_path != output_path:
+            result = run_process(
+                ['ffmpeg', '-y', '-v', 'error', '-i', stitched_path, '-b:a', '320k', output_path],
+                partial=[output_path],
+                capture_output=True,
+                text=True
+            )
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to encode stitched output: {result.stderr}")
+
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,166 @@
+import email.utils
+import mimetypes
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+from jobs import RESULTS_DIR
+
+# Finished tracks are served by this endpoint instead of through the Streamlit session.
+# KARAOKE_FILE_BASE_URL is the address browsers use to reach it (e.g. through a proxy);
+# without it the server is not started and the app falls back to in-app downloads.
+FILE_SERVER_PORT = int(os.environ.get('KARAOKE_FILE_PORT', 8502))
+FILE_SERVER_HOST = os.environ.get('KARAOKE_FILE_HOST', '127.0.0.1')
+FILE_BASE_URL = os.environ.get('KARAOKE_FILE_BASE_URL')
+
+# Only job results are served: results/<job_id>/<file> with one of these extensions
+SERVED_EXTENSIONS = {'.mp3', '.m4a', '.aac', '.wav', '.flac', '.ogg', '.mp4'}
+
+# Browsers may cache a result for this long; job results never change once written
+CACHE_MAX_AGE = 24 * 3600
+
+
+def file_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int):
+    """
+    Parse a single-range 'Range: bytes=...' header.
+
+    Returns:
+        (start, end) inclusive, None to send the whole file, or False if unsatisfiable
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None  # Multi-range requests get the whole file, which RFC 7233 allows
+    first, _, last = header[6:].strip().partition('-')
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+class ResultFileHandler(BaseHTTPRequestHandler):
+    """Serves files below the results directory with Range, ETag and sendfile support."""
+
+    root = RESULTS_DIR
+    protocol_version = 'HTTP/1.1'
+
+    def _resolve(self):
+        path = unquote(urlsplit(self.path).path)
+        if not path.startswith('/results/'):
+            return None
+        root = os.path.realpath(self.root)
+        full_path = os.path.realpath(os.path.join(root, path[len('/results/'):]))
+        if not full_path.startswith(root + os.sep) or not os.path.isfile(full_path):
+            return None
+        if len(os.path.relpath(full_path, root).split(os.sep)) != 2:
+            return None  # Not inside a job folder
+        if os.path.splitext(full_path)[1].lower() not in SERVED_EXTENSIONS:
+            return None
+        return full_path
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body: bool):
+        full_path = self._resolve()
+        if full_path is None:
+            self.send_error(404)
+            return
+
+        with open(full_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            etag = file_etag(stat)
+            if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            # A stale If-Range means the client's partial copy is outdated: send everything
+            byte_range = None
+            if self.headers.get('If-Range', etag) == etag:
+                byte_range = parse_range(self.headers.get('Range'), stat.st_size)
+            if byte_range is False:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{stat.st_size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            start, end = byte_range or (0, stat.st_size - 1)
+            length = max(0, end - start + 1)
+            self.send_response(206 if byte_range else 200)
+            if byte_range:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{stat.st_size}')
+            self.send_header('Content-Type', mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+            self.send_header('Cache-Control', f'private, max-age={CACHE_MAX_AGE}')
+            if 'download=1' in (urlsplit(self.path).query or ''):
+                name = os.path.basename(full_path)
+                self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(name)}")
+            self.end_headers()
+
+            if body and length:
+                try:
+                    # sendfile(2) where available: the kernel copies file pages to the socket
+                    self.connection.sendfile(f, offset=start, count=length)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client stopped (e.g. seeked elsewhere)
+
+    def log_message(self, format, *args):
+        pass  # Keep range requests out of the app log
+
+
+def result_url(path: str, download: bool = False, base_url: str = None) -> str:
+    """
+    URL of a file inside the results directory on the file server.
+
+    Args:
+        path: Path of a job result (below RESULTS_DIR)
+        download: Ask the browser to save the file instead of playing it
+        base_url: Server address as browsers see it (None = KARAOKE_FILE_BASE_URL)
+
+    Raises:
+        ValueError: If no base URL is given or configured
+    """
+    base_url = base_url or FILE_BASE_URL
+    if not base_url:
+        raise ValueError("KARAOKE_FILE_BASE_URL is not set, so browsers cannot reach the file server")
+    relative = os.path.relpath(os.path.realpath(path), os.path.realpath(RESULTS_DIR))
+    url = f"{base_url.rstrip('/')}/results/{quote(relative.replace(os.sep, '/'))}"
+    return url + ('?download=1' if download else '')
+
+
+def start_file_server(port: int = None, host: str = None) -> ThreadingHTTPServer:
+    """
+    Serve the results directory from a background thread.
+
+    Binds to KARAOKE_FILE_HOST (default 127.0.0.1): a reverse proxy on the same
+    host publishes it under KARAOKE_FILE_BASE_URL.
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    host = host or FILE_SERVER_HOST
+    server = ThreadingHTTPServer((host, FILE_SERVER_PORT if port is None else port), ResultFileHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='file-server', daemon=True).start()
+    print(f"📤 Serving results at http://{host}:{server.server_port}/results/")
+    return server
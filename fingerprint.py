@@ -0,0 +1,370 @@
+import subprocess
+import threading
+
+import numpy as np
+
+# Chroma fingerprint settings: ~46ms per code, 24 bits per code
+SAMPLE_RATE = 11025
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+HOP_SECONDS = HOP_SIZE / SAMPLE_RATE
+CODE_BITS = 24
+
+# Code stored for silent frames; never indexed or matched
+SILENCE = np.uint32(0xFFFFFFFF)
+
+# A match needs this share of the query's frames (and at least MIN_VOTES frames)
+# voting for the same offset, and at most this share of differing bits once aligned.
+# Unrelated audio differs in about half its bits.
+MIN_VOTE_RATIO = 0.1
+MIN_VOTES = 20
+MAX_BIT_ERROR = 0.2
+
+# A query is fingerprinted from this many starting points within one hop; the one
+# closest to the stored recording's frame grid gives the fewest differing bits
+PHASES = 8
+
+# Offsets are refined to the sample by cross-correlating this much decoded audio,
+# searching this far either side of the fingerprint offset
+REFINE_RATE = 44100
+REFINE_SECONDS = 8.0
+REFINE_SEARCH_SECONDS = 2 * HOP_SECONDS
+
+# Codes shared by more index entries than this carry no information (e.g. steady tones)
+MAX_HITS_PER_CODE = 200
+
+
+def decode_mono(audio_file: str, sample_rate: int = SAMPLE_RATE, start: float = 0,
+                seconds: float = None) -> np.ndarray:
+    """Decode an audio file (or the part from start, seconds long) to mono float32 samples."""
+    window = []
+    if start > 0:
+        window.extend(['-ss', f'{start:.6f}'])
+    if seconds is not None:
+        window.extend(['-t', f'{seconds:.6f}'])
+    # Seeking after -i decodes from the top, so the window starts exactly at `start`
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-i', audio_file, *window, '-vn', '-ac', '1', '-ar', str(sample_rate),
+         '-f', 'f32le', '-'],
+        capture_output=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to decode audio for fingerprinting: {result.stderr.decode(errors='replace')}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def _chroma_matrix(sample_rate: int, frame_size: int) -> np.ndarray:
+    """Map FFT bins (55Hz-5kHz) onto the 12 pitch classes."""
+    freqs = np.fft.rfftfreq(frame_size, 1.0 / sample_rate)
+    matrix = np.zeros((len(freqs), 12), dtype=np.float32)
+    audible = (freqs >= 55) & (freqs <= 5000)
+    pitch_class = np.round(12 * np.log2(freqs[audible] / 440.0)).astype(int) % 12
+    matrix[np.nonzero(audible)[0], pitch_class] = 1.0
+    return matrix
+
+
+def chroma(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> tuple:
+    """
+    Per-frame pitch-class energy.
+
+    Returns:
+        Tuple of (chroma of shape (frames, 12), frame energy of shape (frames,))
+    """
+    if len(samples) < FRAME_SIZE:
+        return np.zeros((0, 12), dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    window = np.hanning(FRAME_SIZE).astype(np.float32)
+    matrix = _chroma_matrix(sample_rate, FRAME_SIZE)
+
+    result = np.empty((len(frames), 12), dtype=np.float32)
+    energy = np.empty(len(frames), dtype=np.float32)
+    # Blocks of frames keep the FFT buffers small for long tracks
+    for start in range(0, len(frames), 4096):
+        block = frames[start:start + 4096] * window
+        power = np.abs(np.fft.rfft(block, axis=1)) ** 2
+        result[start:start + len(block)] = power @ matrix
+        energy[start:start + len(block)] = power.sum(axis=1)
+    return result, energy
+
+
+def codes_from_chroma(chroma_frames: np.ndarray, energy: np.ndarray) -> np.ndarray:
+    """
+    Turn chroma frames into 24-bit codes: 12 bits comparing neighbouring pitch
+    classes within a frame and 12 bits comparing each pitch class with the
+    previous frame. Both survive re-encoding and gain changes.
+    """
+    if not len(chroma_frames):
+        return np.zeros(0, dtype=np.uint32)
+
+    spectral = chroma_frames > np.roll(chroma_frames, -1, axis=1)
+    previous = np.vstack([chroma_frames[:1], chroma_frames[:-1]])
+    temporal = chroma_frames > previous
+
+    bits = np.hstack([spectral, temporal]).astype(np.uint32)
+    codes = (bits << np.arange(CODE_BITS, dtype=np.uint32)).sum(axis=1).astype(np.uint32)
+
+    # Silence (60dB below the loudest frame) has no stable chroma
+    codes[energy < energy.max() * 1e-6] = SILENCE
+    return codes
+
+
+def fingerprint_samples(samples: np.ndarray) -> np.ndarray:
+    """Fingerprint of mono samples at SAMPLE_RATE: one uint32 code per HOP_SECONDS."""
+    return codes_from_chroma(*chroma(samples))
+
+
+def fingerprint(audio_file: str) -> np.ndarray:
+    """Fingerprint of an audio file: one uint32 code per HOP_SECONDS."""
+    return fingerprint_samples(decode_mono(audio_file))
+
+
+def bit_error_rate(a: np.ndarray, b: np.ndarray) -> float:
+    """Share of differing bits between two aligned code sequences (silent frames ignored)."""
+    valid = (a != SILENCE) & (b != SILENCE)
+    if not valid.any():
+        return 1.0
+    differing = np.unpackbits((a[valid] ^ b[valid]).view(np.uint8)).sum()
+    return differing / (valid.sum() * CODE_BITS)
+
+
+def correlation_lag(query: np.ndarray, reference: np.ndarray, expected: int, max_lag: int) -> int:
+    """
+    Where query lines up best inside reference, near an expected position.
+
+    Args:
+        query: Mono samples to place
+        reference: Mono samples that contain the query
+        expected: Sample position of the query in reference to search around
+        max_lag: Furthest distance from expected to consider, in samples
+
+    Returns:
+        Distance in samples from expected to the best position (normalised
+        cross-correlation peak); 0 if the query does not fit around expected
+    """
+    length = len(query)
+    first = max(0, expected - max_lag)
+    last = min(len(reference) - length, expected + max_lag)
+    if length == 0 or last < first:
+        return 0
+
+    segment = reference[first:last + length].astype(np.float64)
+    size = 1 << int(np.ceil(np.log2(len(segment) + length)))
+    spectrum = np.fft.rfft(segment, size) * np.conj(np.fft.rfft(query.astype(np.float64), size))
+    correlation = np.fft.irfft(spectrum, size)[:last - first + 1]
+
+    # Normalise by the energy under each position, so loud passages don't win by level alone
+    energy = np.concatenate([[0.0], np.cumsum(segment ** 2)])
+    window_energy = energy[length:length + len(correlation)] - energy[:len(correlation)]
+    correlation /= np.sqrt(np.maximum(window_energy, 1e-12))
+    return first + int(np.argmax(correlation)) - expected
+
+
+def refine_offset(query_file: str, reference_file: str, offset: float, duration: float) -> float:
+    """
+    Refine a fingerprint offset (HOP_SECONDS / PHASES accurate) to the sample.
+
+    A window from the middle of the query is cross-correlated with the reference
+    around the offset, at REFINE_RATE.
+
+    Args:
+        query_file: Audio that starts `offset` seconds into the reference
+        reference_file: Recording (or one of its stems) containing the query
+        offset: Approximate offset in seconds, from FingerprintIndex.match_samples()
+        duration: Length of the query in seconds
+
+    Returns:
+        Offset in seconds, exact to 1 / REFINE_RATE
+    """
+    seconds = min(REFINE_SECONDS, duration)
+    start = max(0.0, (duration - seconds) / 2)
+    query = decode_mono(query_file, REFINE_RATE, start, seconds)
+
+    search = int(REFINE_SEARCH_SECONDS * REFINE_RATE)
+    position = int(round((offset + start) * REFINE_RATE))
+    reference_start = max(0, position - search)
+    reference = decode_mono(reference_file, REFINE_RATE, reference_start / REFINE_RATE,
+                            (position - reference_start + len(query) + search) / REFINE_RATE)
+
+    lag = correlation_lag(query, reference, position - reference_start, search)
+    return offset + lag / REFINE_RATE
+
+
+class FingerprintIndex:
+    """
+    In-memory inverted index over every stored fingerprint.
+
+    All codes live in one sorted NumPy array, so a query looks up all of its
+    codes with two searchsorted calls and votes for (song, offset) pairs.
+    Fingerprints are persisted in the media index and loaded on first use; songs
+    added later are merged into the sorted arrays in linear time.
+    """
+
+    def __init__(self, media_index):
+        self.media_index = media_index
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._songs = []       # content hash per song id
+        self._song_ids = {}    # song id per content hash
+        self._song_codes = []  # full code sequence per song id
+        self._sorted = None    # (codes, song ids, frame numbers), sorted by code
+
+    @staticmethod
+    def _entries(song_id: int, song_codes: np.ndarray) -> tuple:
+        """Index entries (codes, song ids, frame numbers) of one song, silence left out."""
+        keep = np.nonzero(song_codes != SILENCE)[0]
+        return song_codes[keep], np.full(len(keep), song_id, dtype=np.int32), keep.astype(np.int32)
+
+    def _append(self, content_hash: str, song_codes: np.ndarray) -> int:
+        song_id = len(self._songs)
+        self._songs.append(content_hash)
+        self._song_ids[content_hash] = song_id
+        self._song_codes.append(song_codes)
+        return song_id
+
+    def _load(self):
+        if self._loaded:
+            return
+        for content_hash, blob in self.media_index.fingerprints():
+            self._append(content_hash, np.frombuffer(blob, dtype=np.uint32))
+
+        entries = [self._entries(song_id, song_codes) for song_id, song_codes in enumerate(self._song_codes)]
+        if entries:
+            codes, songs, frames = (np.concatenate(column) for column in zip(*entries))
+            order = np.argsort(codes, kind='stable')
+            self._sorted = (codes[order], songs[order], frames[order])
+        else:
+            self._sorted = (np.zeros(0, np.uint32), np.zeros(0, np.int32), np.zeros(0, np.int32))
+        self._loaded = True
+
+    def _insert(self, song_id: int, song_codes: np.ndarray):
+        """Merge one song's entries into the sorted arrays (one pass, no re-sort)."""
+        codes, songs, frames = self._entries(song_id, song_codes)
+        order = np.argsort(codes, kind='stable')
+        codes, songs, frames = codes[order], songs[order], frames[order]
+        positions = np.searchsorted(self._sorted[0], codes, side='right')
+        self._sorted = tuple(
+            np.insert(column, positions, new) for column, new in zip(self._sorted, (codes, songs, frames))
+        )
+
+    def add(self, content_hash: str, codes: np.ndarray):
+        """Store a song's fingerprint (persisted and added to the in-memory index)."""
+        codes = codes.astype(np.uint32)
+        with self._lock:
+            self._load()
+            if content_hash in self._song_ids:
+                return
+            self.media_index.record_fingerprint(content_hash, codes.tobytes())
+            self._insert(self._append(content_hash, codes), codes)
+
+    def codes(self, content_hash: str):
+        with self._lock:
+            self._load()
+            if content_hash in self._song_ids:
+                return self._song_codes[self._song_ids[content_hash]]
+        return None
+
+    def match(self, query: np.ndarray, exclude: str = None, limit: int = 3) -> list:
+        """
+        Find stored recordings that contain the query.
+
+        Args:
+            query: Codes of the audio to look up
+            exclude: Content hash to ignore (the query itself)
+            limit: Maximum number of matches to return
+
+        Returns:
+            List of (content_hash, offset_seconds, bit_error_rate), best first.
+            offset_seconds is where the query starts inside the stored recording.
+        """
+        with self._lock:
+            self._load()
+            codes, songs, frames = self._sorted
+            song_codes = list(self._song_codes)
+            song_hashes = list(self._songs)
+
+        query_frames = np.nonzero(query != SILENCE)[0]
+        if not len(codes) or not len(query_frames):
+            return []
+
+        left = np.searchsorted(codes, query[query_frames], side='left')
+        right = np.searchsorted(codes, query[query_frames], side='right')
+        counts = right - left
+        useful = (counts > 0) & (counts <= MAX_HITS_PER_CODE)
+        left, counts, query_frames = left[useful], counts[useful], query_frames[useful]
+        if not len(counts):
+            return []
+
+        # Positions of every hit in the sorted arrays, paired with the query frame that produced it
+        starts = np.repeat(left - np.cumsum(counts) + counts, counts)
+        positions = starts + np.arange(counts.sum())
+        hit_songs = songs[positions].astype(np.int64)
+        offsets = frames[positions].astype(np.int64) - np.repeat(query_frames, counts)
+
+        # Vote for (song, offset); queries that start before the recording can't reuse its stems
+        valid = offsets >= 0
+        votes_key = hit_songs[valid] * (1 << 32) + offsets[valid]
+        if not len(votes_key):
+            return []
+        candidates, votes = np.unique(votes_key, return_counts=True)
+        best_first = np.argsort(-votes)
+
+        matches = []
+        min_votes = max(MIN_VOTES, int(len(query_frames) * MIN_VOTE_RATIO))
+        for candidate, vote_count in zip(candidates[best_first], votes[best_first]):
+            if vote_count < min_votes or len(matches) >= limit:
+                break
+            song_id, offset = int(candidate >> 32), int(candidate & 0xFFFFFFFF)
+            content_hash = song_hashes[song_id]
+            if content_hash == exclude or any(m[0] == content_hash for m in matches):
+                continue
+
+            # The whole query has to lie inside the recording (a couple of frames of slack)
+            reference = song_codes[song_id][offset:offset + len(query)]
+            if len(reference) < len(query) - 2:
+                continue
+            error = bit_error_rate(query[:len(reference)], reference)
+            if error <= MAX_BIT_ERROR:
+                matches.append((content_hash, offset * HOP_SECONDS, error))
+        return matches
+
+    def match_samples(self, samples: np.ndarray, exclude: str = None, limit: int = 3) -> list:
+        """
+        Find stored recordings that contain the given audio.
+
+        The stored fingerprints start on their recording's first sample, while a
+        trimmed copy can start anywhere within a hop. The query is fingerprinted
+        from PHASES starting points a fraction of a hop apart and every recording
+        keeps the alignment with the fewest differing bits.
+
+        Args:
+            samples: Mono samples at SAMPLE_RATE (see decode_mono)
+            exclude: Content hash to ignore (the query itself)
+            limit: Maximum number of matches to return
+
+        Returns:
+            List of (content_hash, offset_seconds, bit_error_rate), best first;
+            offset_seconds is accurate to HOP_SECONDS / PHASES (see refine_offset)
+        """
+        best = {}
+        for phase in range(PHASES):
+            skipped = phase * HOP_SIZE // PHASES
+            for content_hash, offset, error in self.match(fingerprint_samples(samples[skipped:]), exclude, limit):
+                # The query's first frame starts `skipped` samples into it
+                if content_hash not in best or error < best[content_hash][2]:
+                    best[content_hash] = (content_hash, max(0.0, offset - skipped / SAMPLE_RATE), error)
+        return sorted(best.values(), key=lambda match: match[2])[:limit]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_fingerprint_index() -> FingerprintIndex:
+    """Return the process-wide fingerprint index."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            from media_index import get_media_index
+            _index = FingerprintIndex(get_media_index())
+        return _index
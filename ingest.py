@@ -0,0 +1,125 @@
+import subprocess
+
+from audio_io import encode_args
+from cancellation import popen, release, run_process, remove_partial, check_cancelled
+
+# Sample rate of the separation-ready audio written by the ingest stage
+INGEST_SAMPLE_RATE = 48000
+
+
+def stream_duration(stream, fallback: float = None) -> float:
+    """Duration of a pytubefix stream in seconds from its metadata (no probing)."""
+    duration_ms = getattr(stream, 'durationMs', None)
+    if duration_ms:
+        return int(duration_ms) / 1000
+    return fallback
+
+
+def conversion_command(input_path: str, output_path: str, trim_start: float = 0, trim_end: float = 0,
+                       duration: float = None, sample_rate: int = INGEST_SAMPLE_RATE) -> list:
+    """
+    FFmpeg command that trims, resamples and encodes in one decode pass
+    (sample_rate=None keeps the source rate).
+
+    Raises:
+        ValueError: If the trim settings leave nothing of the track
+    """
+    command = ['ffmpeg', '-y', '-v', 'error', '-i', input_path, '-vn']
+    if trim_start > 0:
+        # Output-side seek: decoded and cut on the exact sample
+        command.extend(['-ss', str(trim_start)])
+    if trim_end > 0:
+        if not duration:
+            raise ValueError("Trimming the end of a track needs its duration")
+        target_duration = duration - trim_start - trim_end
+        if target_duration <= 0:
+            raise ValueError(f"Trim settings would result in zero or negative duration! Audio duration: {duration:.1f}s")
+        command.extend(['-t', str(target_duration)])
+    if sample_rate:
+        command.extend(['-ar', str(sample_rate)])
+    command.extend([*encode_args(output_path), output_path])
+    return command
+
+
+def convert_audio(input_path: str, output_path: str, trim_start: float = 0, trim_end: float = 0,
+                  duration: float = None, sample_rate: int = INGEST_SAMPLE_RATE) -> str:
+    """
+    Trim and convert a downloaded file in a single FFmpeg pass.
+
+    Returns:
+        output_path
+    """
+    command = conversion_command(input_path, output_path, trim_start, trim_end, duration, sample_rate)
+    result = run_process(command, partial=[output_path], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Conversion failed: {result.stderr}")
+    return output_path
+
+
+def stream_chunks(stream):
+    """Yield the raw bytes of a pytubefix stream as they arrive over HTTP."""
+    from pytubefix import request
+    return request.stream(stream.url)
+
+
+def ingest_stream(stream, output_path: str, trim_start: float = 0, trim_end: float = 0,
+                  duration: float = None, sample_rate: int = INGEST_SAMPLE_RATE,
+                  chunks=None, progress=None) -> str:
+    """
+    Download an audio stream straight into FFmpeg.
+
+    The HTTP body is piped into a single FFmpeg process that trims, resamples and
+    encodes while bytes arrive, so the only file written is the final one
+    (no temp download, no trimmed copy, no separate conversion pass).
+
+    Args:
+        stream: pytubefix Stream to download
+        output_path: File to write (.mp3 → 320kbps, .wav → 32-bit float)
+        trim_start: Seconds to cut from the start
+        trim_end: Seconds to cut from the end (needs duration)
+        duration: Length of the source in seconds (e.g. yt.length)
+        sample_rate: Output sample rate in Hz
+        chunks: Iterable of byte chunks to use instead of downloading stream (for testing)
+        progress: Optional callback(bytes_received, total_bytes)
+
+    Returns:
+        output_path
+
+    Raises:
+        ValueError: If the trim settings leave nothing of the track
+        RuntimeError: If FFmpeg fails to decode or encode the stream
+    """
+    command = conversion_command('pipe:0', output_path, trim_start, trim_end, duration, sample_rate)
+
+    if chunks is None:
+        chunks = stream_chunks(stream)
+    total = getattr(stream, 'filesize', None) if stream is not None else None
+
+    process = popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    received = 0
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+            received += len(chunk)
+            if progress:
+                progress(received, total)
+        process.stdin.close()
+    except BrokenPipeError:
+        # FFmpeg gave up on the input; its error message explains why
+        pass
+    except BaseException:
+        process.kill()
+        process.wait()
+        release(process)
+        remove_partial([output_path])
+        raise
+
+    stderr = process.stderr.read().decode(errors='replace')
+    returncode = process.wait()
+    release(process)
+    if returncode != 0:
+        remove_partial([output_path])
+        # A cancelled job must not fall back to downloading the file instead
+        check_cancelled()
+        raise RuntimeError(f"Streaming ingest failed: {stderr}")
+    return output_path
@@ -0,0 +1,468 @@
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from ingest import ingest_stream, convert_audio, stream_duration
+from telemetry import emit, install_telemetry, telemetry_installed
+from cancellation import JobCancelled, cancel_scope, request_cancel, clear_cancel, remove_partial
+from workspace import workspace
+from scheduler import total_cores, set_stage_limit, available_memory_gb, leased_threads, LEASE_POLL_INTERVAL
+
+# Finished processed tracks are copied here, one folder per job
+RESULTS_DIR = os.environ.get('KARAOKE_RESULTS_DIR', 'results')
+
+# Memory one basic-mode job needs (Demucs htdemucs + FFmpeg), used to size the pool
+JOB_MEMORY_GB = float(os.environ.get('KARAOKE_JOB_MEMORY_GB', 3))
+
+# Forget finished jobs after this many seconds
+JOB_TTL = 6 * 3600
+
+# Cancel jobs whose session stopped polling for this many seconds (tab closed)
+JOB_HEARTBEAT_TIMEOUT = float(os.environ.get('KARAOKE_JOB_HEARTBEAT_TIMEOUT', 60))
+
+# Cancel jobs still unfinished this many seconds after submission (0 = no deadline)
+JOB_DEADLINE = float(os.environ.get('KARAOKE_JOB_DEADLINE', 0))
+
+# How often the reaper looks for abandoned and overdue jobs
+REAPER_INTERVAL = 5
+
+# Previews rendered at the same time; they run in the app process, beside the job pool
+PREVIEW_WORKERS = 2
+
+
+def default_worker_count() -> int:
+    """
+    Number of concurrent jobs this host can run: limited by CPU cores and by
+    available memory (KARAOKE_JOB_MEMORY_GB per job). KARAOKE_JOB_WORKERS overrides it.
+    """
+    if os.environ.get('KARAOKE_JOB_WORKERS'):
+        return max(1, int(os.environ['KARAOKE_JOB_WORKERS']))
+
+    cores = total_cores()
+
+    available_gb = available_memory_gb()
+    by_memory = cores if available_gb is None else int(available_gb // JOB_MEMORY_GB)
+
+    # Separation already uses several threads per job, so give each job at least 2 cores
+    return max(1, min(cores // 2, by_memory))
+
+
+def karaoke_job(job_id: str, source: str, is_url: bool = False, karaoke: bool = True,
+                pitch: int = 0, trim_start: int = 0, trim_end: int = 0) -> dict:
+    """
+    Full web-app pipeline for one request: download (YouTube) → trim → basic karaoke → pitch.
+    Runs inside a job worker process.
+
+    Args:
+        job_id: Job identifier (names the results folder)
+        source: YouTube URL or path to an uploaded file
+        is_url: Whether source is a YouTube URL
+        karaoke: Remove vocals
+        pitch: Pitch shift in semitones (0 = none)
+        trim_start: Seconds to cut from the start
+        trim_end: Seconds to cut from the end
+
+    Returns:
+        Dict with 'output' (path of the processed track) and 'title'
+    """
+    # Everything the job writes goes to its own workspace, removed when it ends
+    with workspace(job_id) as space, cancel_scope(job_id):
+        return _run_karaoke_job(job_id, space, source, is_url, karaoke, pitch, trim_start, trim_end)
+
+
+def _run_karaoke_job(job_id: str, space, source: str, is_url: bool, karaoke: bool,
+                     pitch: int, trim_start: int, trim_end: int) -> dict:
+    from main import create_demucs_karaoke, adjust_pitch, get_audio_duration
+
+    title = os.path.basename(source)
+
+    if is_url:
+        from pytubefix import YouTube
+        yt = YouTube(source)
+        title = yt.title
+        audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
+        if not audio_stream:
+            raise RuntimeError("No audio stream found!")
+
+        # Download, trim and MP3 conversion in one FFmpeg pass
+        audio_file = space.file(yt.title.replace('/', '-').replace('\\', '-') + ".mp3")
+        duration = stream_duration(audio_stream, yt.length)
+        try:
+            ingest_stream(audio_stream, audio_file, trim_start, trim_end, duration)
+        except JobCancelled:
+            raise
+        except RuntimeError:
+            # Not decodable from a pipe, download first (dropping anything half-written)
+            remove_partial([audio_file])
+            download = audio_stream.download(output_path=space.path, filename='temp_youtube_audio.mp4')
+            convert_audio(download, audio_file, trim_start, trim_end, duration)
+    elif trim_start > 0 or trim_end > 0:
+        # Trim while re-encoding, exact to the sample
+        duration = get_audio_duration(source) if trim_end > 0 else None
+        base = os.path.splitext(os.path.basename(source))[0]
+        audio_file = convert_audio(source, space.file(f"trimmed_{base}.mp3"), trim_start, trim_end, duration, sample_rate=None)
+    else:
+        audio_file = source
+
+    try:
+        output = audio_file
+        if karaoke:
+            # Use 'basic' mode for Streamlit Cloud (lighter, faster)
+            output = create_demucs_karaoke(audio_file, mode="basic", work_dir=space.path)
+        if pitch != 0:
+            output = adjust_pitch(output, pitch)
+
+        # Keep the result somewhere stable; the workspace is removed when the job ends
+        job_dir = os.path.join(RESULTS_DIR, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        result_path = os.path.join(job_dir, os.path.basename(output))
+        shutil.copy2(output, result_path)
+    except JobCancelled:
+        # Nobody will collect a cancelled job's files
+        remove_partial([os.path.join(RESULTS_DIR, job_id)])
+        raise
+
+    return {'output': result_path, 'title': title}
+
+
+def preview_job(job_id: str, source: str, is_url: bool = False, karaoke: bool = True,
+                pitch: int = 0, trim_start: int = 0, trim_end: int = 0) -> dict:
+    """
+    Preview of a karaoke_job: a short excerpt with the same settings, ready in seconds.
+    Takes the same arguments as karaoke_job and runs next to it, not in the job pool.
+
+    Returns:
+        Dict with 'output' (path of the preview) and 'start' (excerpt start in seconds)
+    """
+    from preview import render_preview, excerpt_start
+
+    job_dir = os.path.join(RESULTS_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    if is_url:
+        # FFmpeg reads just the excerpt from the stream; no download
+        from pytubefix import YouTube
+        yt = YouTube(source)
+        audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
+        if not audio_stream:
+            raise RuntimeError("No audio stream found!")
+        start = excerpt_start(stream_duration(audio_stream, yt.length) or 0, trim_start, trim_end)
+        source = audio_stream.url
+    else:
+        # Only the first window after the trim is analysed: this runs in the app process
+        from vad import analyze
+        from media_index import media_info
+        from preview import ANALYSIS_SECONDS
+        analysis = analyze(source, start=trim_start, seconds=ANALYSIS_SECONDS)
+        start = excerpt_start(media_info(source)['duration'], trim_start, trim_end, regions=analysis['regions'])
+
+    output = render_preview(source, os.path.join(job_dir, 'preview.mp3'), karaoke, pitch, start)
+    return {'output': output, 'start': start}
+
+
+def warm_job_worker():
+    """Job worker initializer: load the basic-mode model before the first job arrives."""
+    from main import SEPARATOR_BACKEND
+    if SEPARATOR_BACKEND == 'inprocess':
+        from separator_pool import get_separator_pool, DEMUCS
+        get_separator_pool().warm(DEMUCS, 'htdemucs')
+
+
+def init_job_worker(stage_threads: int, initializer=None, telemetry: bool = None):
+    """
+    Job worker initializer: cap the threads one stage of this worker asks for at its
+    fair share of the cores, report stage events if the parent process does
+    (telemetry), then run the caller's initializer.
+    """
+    set_stage_limit(stage_threads)
+    if telemetry:
+        install_telemetry()
+    if initializer:
+        initializer()
+
+
+class JobManager:
+    """
+    Bounded process pool running pipeline jobs in the background.
+
+    Jobs are identified by an ID; callers poll status() until the job is done
+    and then read its result. One manager is shared by every session of the app.
+    Submitted jobs wait in the manager's queue and are handed to a worker only
+    while the CPU lease ledger has a free share of cores for them, so a busy host
+    keeps queued jobs (and their decoded inputs) out of the worker processes.
+    Callers that stop polling (closed tab) or run past their deadline have their
+    job cancelled, which kills its FFmpeg/separator processes. A job can come
+    with a preview function, run right away in a small thread pool so it never
+    waits behind full jobs.
+    """
+
+    def __init__(self, max_workers: int = None, initializer=None):
+        self.max_workers = max_workers or default_worker_count()
+        # Each worker's stages lease at most its share of the cores (see scheduler.py)
+        self._share = max(1, total_cores() // self.max_workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_job_worker,
+            initargs=(self._share, initializer, telemetry_installed())
+        )
+        self._previews = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix='preview')
+        self._jobs = {}
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        threading.Thread(target=self._reap, name='job-reaper', daemon=True).start()
+        threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True).start()
+
+    def submit(self, func, *args, deadline: float = None, preview=None, cleanup=None, **kwargs) -> str:
+        """
+        Queue func(job_id, *args, **kwargs); it starts on the worker pool once cores are free.
+
+        Args:
+            deadline: Seconds after which the job is cancelled (None = KARAOKE_JOB_DEADLINE)
+            preview: Optional function called the same way, started immediately in
+                the preview pool; its result is reported by status() (e.g. preview_job)
+            cleanup: Optional function called without arguments once the job and its
+                preview have finished, however they ended (e.g. removing the job's input)
+
+        Returns:
+            Job ID
+        """
+        self._prune()
+        job_id = uuid.uuid4().hex[:12]
+        deadline = JOB_DEADLINE if deadline is None else deadline
+        # Resolved by the worker's future once the job is dispatched (see _admit)
+        future = Future()
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                'future': future, 'call': (func, args, kwargs), 'process': None,
+                'submitted': now, 'finished': None, 'heartbeat': now,
+                'deadline': now + deadline if deadline else None, 'cancel_reason': None,
+                'preview': self._previews.submit(preview, job_id, *args, **kwargs) if preview else None,
+                'cleanup': cleanup,
+            }
+            self._queue.append(job_id)
+        future.add_done_callback(lambda _: self._mark_finished(job_id))
+        self._wake.set()
+        return job_id
+
+    def _capacity(self, running: int) -> int:
+        """
+        Jobs that may run right now: one per share of the cores not leased by other
+        processes (other pipelines, previews), never more than max_workers. Leases
+        of this pool's own workers are left out; each running job counts as a full
+        share instead, since it leases its cores only once a stage starts.
+        """
+        workers = {process.pid for process in multiprocessing.active_children()}
+        free = total_cores() - leased_threads(exclude_pids=workers)
+        return min(self.max_workers, max(free // self._share, running))
+
+    def _admit(self):
+        """Hand queued jobs to the worker pool while the lease ledger has room for them."""
+        with self._lock:
+            while self._queue and self._jobs[self._queue[0]]['future'].cancelled():
+                self._queue.popleft()
+            if not self._queue:
+                return
+            running = sum(1 for job in self._jobs.values() if job['process'] and not job['future'].done())
+
+        capacity = self._capacity(running)
+        with self._lock:
+            while self._queue and running < capacity:
+                job_id = self._queue.popleft()
+                job = self._jobs[job_id]
+                # False if the job was cancelled while it waited
+                if not job['future'].set_running_or_notify_cancel():
+                    continue
+                func, args, kwargs = job.pop('call')
+                job['process'] = self._executor.submit(func, job_id, *args, **kwargs)
+                job['process'].add_done_callback(lambda process, future=job['future']: self._settle(future, process))
+                running += 1
+
+    @staticmethod
+    def _settle(future: Future, process: Future):
+        """Pass a worker's outcome on to the job's future."""
+        if process.cancelled():
+            future.set_exception(JobCancelled('Job cancelled before it started'))
+        elif process.exception():
+            future.set_exception(process.exception())
+        else:
+            future.set_result(process.result())
+
+    def _dispatch(self):
+        # Woken by submissions and finished jobs; polls while jobs wait for cores
+        while not self._closed.is_set():
+            self._wake.wait(LEASE_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                self._admit()
+            except Exception as e:
+                print(f"⚠️  Job dispatch failed: {e}")
+
+    def cancel(self, job_id: str, reason: str = 'cancelled') -> bool:
+        """
+        Cancel a queued or running job. A running job's process groups are killed
+        and its partial outputs removed; its status becomes 'cancelled'.
+
+        Returns:
+            False if the job is unknown or already finished
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['future'].done():
+                return False
+            job['cancel_reason'] = job['cancel_reason'] or reason
+            process = job['process']
+        # Still in the manager's queue, or not yet picked up by a worker
+        if job['future'].cancel() or (process and process.cancel()):
+            return True
+        request_cancel(job_id, reason)
+        return True
+
+    def heartbeat(self, job_id: str):
+        """Record that someone is still waiting for a job."""
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]['heartbeat'] = time.time()
+
+    def _reap(self):
+        while not self._closed.wait(REAPER_INTERVAL):
+            now = time.time()
+            with self._lock:
+                active = [(job_id, job) for job_id, job in self._jobs.items()
+                          if not job['future'].done() and not job['cancel_reason']]
+            for job_id, job in active:
+                if JOB_HEARTBEAT_TIMEOUT and now - job['heartbeat'] > JOB_HEARTBEAT_TIMEOUT:
+                    self.cancel(job_id, 'abandoned')
+                elif job['deadline'] and now > job['deadline']:
+                    self.cancel(job_id, 'deadline exceeded')
+            self._prune()
+
+    def _mark_finished(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['finished'] = time.time()
+        self._wake.set()
+        clear_cancel(job_id)
+        future = job['future']
+        error = future.exception() if not future.cancelled() else None
+        if future.cancelled() or isinstance(error, JobCancelled):
+            status = 'cancelled'
+        else:
+            status = 'failed' if error else 'done'
+        emit(
+            'job', job_id=job_id, status=status,
+            seconds=round(job['finished'] - job['submitted'], 3),
+            **({'reason': job['cancel_reason']} if status == 'cancelled' else {}),
+            **({'error': str(error)} if status == 'failed' else {})
+        )
+
+        if job['cleanup']:
+            # The preview may still be reading the job's input
+            if job['preview'] and not job['preview'].done():
+                job['preview'].add_done_callback(lambda _: self._run_cleanup(job))
+            else:
+                self._run_cleanup(job)
+
+    @staticmethod
+    def _run_cleanup(job: dict):
+        try:
+            job['cleanup']()
+        except Exception as e:
+            print(f"⚠️  Job cleanup failed: {e}")
+
+    def _prune(self):
+        """Forget jobs finished more than JOB_TTL ago and delete their result folders."""
+        cutoff = time.time() - JOB_TTL
+        with self._lock:
+            expired = [j for j, job in self._jobs.items() if job['finished'] and job['finished'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+            known = set(self._jobs)
+
+        # Also folders of jobs this process never knew (results left over from a restart)
+        try:
+            folders = os.listdir(RESULTS_DIR)
+        except OSError:
+            folders = []
+        for name in folders:
+            path = os.path.join(RESULTS_DIR, name)
+            if name in known or not os.path.isdir(path):
+                continue
+            try:
+                if name in expired or os.path.getmtime(path) < cutoff:
+                    remove_partial([path])
+            except OSError:
+                pass
+
+    def status(self, job_id: str) -> dict:
+        """
+        Current state of a job.
+
+        Returns:
+            Dict with 'state' ('queued', 'running', 'cancelling', 'cancelled', 'done',
+            'failed' or 'unknown'), 'position' in the queue, 'elapsed' seconds, 'error'
+            for failed jobs, 'reason' for cancelled ones and 'preview' (the preview
+            function's result) or 'preview_error' once a preview has finished
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return {'id': job_id, 'state': 'unknown'}
+            queued = [j for j, other in self._jobs.items()
+                      if not other['future'].running() and not other['future'].done()
+                      and other['submitted'] <= job['submitted']]
+
+        future = job['future']
+        status = {'id': job_id, 'elapsed': (job['finished'] or time.time()) - job['submitted']}
+        preview = job['preview']
+        if preview is not None and preview.done():
+            if preview.exception():
+                status['preview_error'] = str(preview.exception())
+            else:
+                status['preview'] = preview.result()
+        if future.cancelled() or (future.done() and isinstance(future.exception(), JobCancelled)):
+            status['state'] = 'cancelled'
+            status['reason'] = job['cancel_reason'] or 'cancelled'
+        elif future.done():
+            error = future.exception()
+            status['state'] = 'failed' if error else 'done'
+            if error:
+                status['error'] = str(error)
+        elif job['cancel_reason']:
+            status['state'] = 'cancelling'
+        elif future.running():
+            status['state'] = 'running'
+        else:
+            status['state'] = 'queued'
+            status['position'] = len(queued)
+        return status
+
+    def result(self, job_id: str):
+        """Return the job's result (raises the job's exception if it failed)."""
+        with self._lock:
+            job = self._jobs[job_id]
+        return job['future'].result()
+
+    def active_jobs(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job['future'].done())
+
+    def shutdown(self):
+        self._closed.set()
+        self._wake.set()
+        with self._lock:
+            running = [job_id for job_id, job in self._jobs.items() if not job['future'].done()]
+        for job_id in running:
+            self.cancel(job_id, 'shutdown')
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._previews.shutdown(wait=False, cancel_futures=True)
@@ -5,12 +5,51 @@ import os
 import sys
 import shutil
 import time
-import json
-from audio_separator.separator import Separator
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from stem_cache import StemCache, audio_content_hash, stem_cache_key, materialize
+from separator_pool import get_separator_pool, DEMUCS, MDX
+from audio_io import INTERMEDIATE_FORMATS, encode_args, blend_wavs, read_wav, slice_audio
+from chunked import should_chunk, separate_chunked
+from shifts import plan_shift_workers, separate_shifted
+from vad import plan_gating, separate_vocal_regions, gate_stem, regions_tag, trim_silence, VAD_ENABLED
+from ingest import ingest_stream, convert_audio, stream_duration
+from media_index import get_media_index, media_info
+from fingerprint import get_fingerprint_index, decode_mono, refine_offset
+from stages import stage, annotate
+from cancellation import run_process, atomic_outputs, remove_partial, JobCancelled, cancelled, check_cancelled
+from scheduler import cpu_lease, stage_limit, total_cores, ffmpeg_thread_args, FFMPEG_STAGE_THREADS
+from quality import plan_quality, record_throughput, demucs_passes, parse_deadline, QUALITY_TIERS, DEFAULT_QUALITY
+from workspace import Workspace, reap_stale_workspaces
+from telemetry import install_telemetry, record_cache
+
+# How separation models are run:
+# - 'inprocess': warm models kept resident in separator worker processes (default)
+# - 'cli': spawn the `demucs` / `audio-separator` command-line tools for every job
+SEPARATOR_BACKEND = os.environ.get('KARAOKE_SEPARATOR_BACKEND', 'inprocess')
+
+# Format of the files handed from one pipeline stage to the next ('mp3' or 'wav').
+# 'wav' keeps intermediates as lossless 32-bit float; only the final deliverable is MP3.
+INTERMEDIATE_FORMAT = os.environ.get('KARAOKE_INTERMEDIATE_FORMAT', 'mp3')
+
+# MDX-Net model used in professional mode (STEP 2)
+MDX_MODEL = 'model_bs_roformer_ep_317_sdr_12.9755.ckpt'
+
+_stem_cache = None
+
+def get_stem_cache():
+    """Return the process-wide stem cache, creating it on first use."""
+    global _stem_cache
+    if _stem_cache is None:
+        _stem_cache = StemCache()
+    return _stem_cache
 
 def get_audio_duration(audio_file):
     """
-    Get the duration of an audio file in seconds using FFmpeg.
+    Get the duration of an audio file in seconds.
+
+    Float/PCM WAV files are measured from their header; anything else comes from
+    the media index, which probes a file with FFprobe only the first time it is seen.
 
     Args:
         audio_file: Path to audio file
@@ -18,24 +57,63 @@ def get_audio_duration(audio_file):
     Returns:
         Duration in seconds (float)
     """
-    result = subprocess.run(
-        [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'json',
-            audio_file
-        ],
-        capture_output=True,
-        text=True
-    )
-
-    if result.returncode != 0:
-        raise RuntimeError(f"Failed to get audio duration: {result.stderr}")
-
-    data = json.loads(result.stdout)
-    duration = float(data['format']['duration'])
-    return duration
+    if audio_file.lower().endswith('.wav'):
+        try:
+            samples, sample_rate = read_wav(audio_file)
+            return samples.shape[0] / sample_rate
+        except ValueError:
+            pass  # Unsupported WAV encoding, ask FFprobe
+
+    return media_info(audio_file)['duration']
+
+def download_video_and_audio(video_stream, audio_stream, process_audio=None,
+                             video_filename='video.mp4', audio_filename='audio.mp4'):
+    """
+    Download the adaptive video and audio streams at the same time.
+
+    process_audio (if given) runs on the audio file as soon as it has landed,
+    while the video download is still in progress. If the audio download or
+    process_audio fails, the video download is stopped at its next chunk and its
+    partial file removed before the error is raised.
+
+    Args:
+        video_stream: Stream with a download(filename=..., interrupt_checker=...)
+            method (pytubefix Stream)
+        audio_stream: Stream with a download(filename=...) method
+        process_audio: Optional function(audio_file) -> processed audio file
+        video_filename: Where to save the video stream
+        audio_filename: Where to save the audio stream
+
+    Returns:
+        Tuple of (video_file, audio_file)
+    """
+    abort = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        video_future = executor.submit(
+            video_stream.download, filename=video_filename,
+            interrupt_checker=lambda: abort.is_set() or cancelled()
+        )
+        try:
+            audio_file = audio_stream.download(filename=audio_filename)
+            if process_audio:
+                audio_file = process_audio(audio_file)
+        except BaseException:
+            abort.set()
+            try:
+                video_future.result()
+            except Exception:
+                pass
+            # An interrupted download leaves what it had written so far
+            remove_partial([video_filename])
+            raise
+        video_file = video_future.result()
+    if video_file is None:
+        check_cancelled()
+        raise RuntimeError("Video download stopped before it finished")
+    return video_file, audio_file
+
+# Reduce the centre channel, where lead vocals usually sit (no model needed)
+CENTER_CANCEL_FILTER = 'stereotools=mlev=0.015625'
 
 def create_karaoke(audio_file, output_file):
     """
@@ -51,7 +129,7 @@ def create_karaoke(audio_file, output_file):
     karaoke_command = [
         'ffmpeg',
         '-i', audio_file,
-        '-af', 'stereotools=mlev=0.015625',  # Reduce center channel
+        '-af', CENTER_CANCEL_FILTER,  # Reduce center channel
         '-y',
         output_file
     ]
@@ -64,7 +142,458 @@ def create_karaoke(audio_file, output_file):
         print(f"❌ Vocal removal failed: {result.stderr}")
         return False
 
-def create_demucs_karaoke(audio_path: str, mode: str = 'basic') -> str:
+def available_cores() -> int:
+    """Number of CPU cores this process is allowed to run on (KARAOKE_CPU_CORES overrides)."""
+    return total_cores()
+
+
+def split_threads(total: int, parts: int) -> list:
+    """
+    Split a CPU thread budget between concurrent stages as evenly as possible.
+
+    Args:
+        total: Number of CPU threads available
+        parts: Number of stages sharing them
+
+    Returns:
+        List with one thread count per stage (each at least 1)
+    """
+    share, extra = divmod(max(total, parts), parts)
+    return [share + (1 if i < extra else 0) for i in range(parts)]
+
+
+def thread_env(threads: int = None) -> dict:
+    """Environment for a child process limited to `threads` CPU threads (None = library defaults)."""
+    env = {**os.environ, 'TORCH_HOME': os.path.expanduser('~/.cache/torch')}
+    if threads:
+        for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS'):
+            env[var] = str(threads)
+    return env
+
+
+def run_demucs(audio_path: str, model: str, output_dir: str, shifts: int = 1,
+               overlap: float = 0.25, float32: bool = False, threads: int = None,
+               ext: str = 'mp3', timeout: int = 7200, chunk_seconds: float = None,
+               vocal_regions: list = None, pool_workers: int = None) -> str:
+    """
+    Separate vocals from the rest with Demucs (2-stem) using the configured backend.
+
+    Args:
+        audio_path: Path to input audio file
+        model: Demucs model name ('htdemucs' or 'htdemucs_6s')
+        output_dir: Directory that will receive no_vocals.<ext> / vocals.<ext>
+        shifts: Number of random-shift passes to average (run as concurrent
+            single-shift passes when the CPU budget allows, see shifts.py)
+        overlap: Overlap between split windows
+        float32: Save stems as 32-bit float (only affects WAV output)
+        threads: CPU threads the model may use (None = all cores)
+        ext: Stem file format, 'mp3' (320kbps) or 'wav' (32-bit float)
+        timeout: Seconds before giving up (per chunk when chunked)
+        chunk_seconds: Window length for chunked separation of long tracks
+            (None = KARAOKE_CHUNK_SECONDS, 0 = never chunk)
+        vocal_regions: Only separate these (start, end) seconds and pass the
+            original audio through elsewhere (see vad.py)
+        pool_workers: Separator workers the model may have for this run, when more
+            than KARAOKE_SEPARATOR_WORKERS (set for concurrent shift passes)
+
+    Returns:
+        Path to the no_vocals stem
+    """
+    if vocal_regions:
+        def separate_segment(segment_path, segment_dir):
+            segment_output = os.path.join(segment_dir, 'separated', model, os.path.splitext(os.path.basename(segment_path))[0])
+            return run_demucs(
+                segment_path, model, segment_output,
+                shifts=shifts, overlap=overlap, float32=float32, threads=threads,
+                ext='wav', timeout=timeout, chunk_seconds=chunk_seconds
+            )
+
+        os.makedirs(output_dir, exist_ok=True)
+        return separate_vocal_regions(
+            audio_path, separate_segment,
+            os.path.join(output_dir, f'no_vocals.{ext}'),
+            vocal_regions
+        )
+
+    if chunk_seconds != 0 and should_chunk(get_audio_duration(audio_path), chunk_seconds):
+        def separate_window(chunk_path, chunk_dir):
+            chunk_output = os.path.join(chunk_dir, 'separated', model, os.path.splitext(os.path.basename(chunk_path))[0])
+            return run_demucs(
+                chunk_path, model, chunk_output,
+                shifts=shifts, overlap=overlap, float32=float32, threads=threads,
+                ext='wav', timeout=timeout, chunk_seconds=0
+            )
+
+        os.makedirs(output_dir, exist_ok=True)
+        return separate_chunked(
+            audio_path, separate_window,
+            os.path.join(output_dir, f'no_vocals.{ext}'),
+            chunk_seconds=chunk_seconds
+        )
+
+    # Shift passes are independent, so they run side by side and are averaged afterwards.
+    # Passes at a time follow the cores and free memory, not the warm-model cap.
+    pool = get_separator_pool() if SEPARATOR_BACKEND != 'cli' else None
+    shift_workers, pass_threads = plan_shift_workers(shifts, threads or stage_limit(), model)
+    if shift_workers > 1:
+        def separate_pass(shifted_path, pass_dir):
+            pass_output = os.path.join(pass_dir, 'separated', model, os.path.splitext(os.path.basename(shifted_path))[0])
+            return run_demucs(
+                shifted_path, model, pass_output,
+                shifts=1, overlap=overlap, float32=float32, threads=pass_threads,
+                ext='wav', timeout=timeout, chunk_seconds=0, pool_workers=shift_workers
+            )
+
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            return separate_shifted(
+                audio_path, separate_pass,
+                os.path.join(output_dir, f'no_vocals.{ext}'),
+                shifts, workers=shift_workers
+            )
+        finally:
+            # Keep one warm worker for the next job, not one per pass
+            if pool:
+                pool.retire(DEMUCS, model, keep=1)
+
+    # Cores are shared with every other pipeline on this host
+    with cpu_lease(f'Demucs {model}', want=threads) as threads:
+        started = time.time()
+        if SEPARATOR_BACKEND == 'cli':
+            # The CLI always writes to separated/<model>/<track> next to the working directory
+            command = ['demucs', '--two-stems=vocals', '-n', model]
+            if float32 or ext == 'wav':
+                command.append('--float32')
+            if shifts != 1:
+                command.append(f'--shifts={shifts}')
+            if overlap != 0.25:
+                command.append(f'--overlap={overlap}')
+            if ext == 'mp3':
+                command.extend([
+                    '--mp3',  # Force MP3 output to avoid Python 3.13 torchcodec issues
+                    '--mp3-bitrate=320',  # High quality
+                ])
+            command.extend(['-o', os.path.dirname(os.path.dirname(output_dir)), audio_path])
+
+            result = run_process(
+                command,
+                timeout=timeout,
+                partial=[output_dir],
+                text=True,
+                env=thread_env(threads)
+            )
+            annotate(returncode=result.returncode)
+
+            if result.returncode != 0:
+                raise RuntimeError(f"Demucs failed with return code {result.returncode}")
+
+            no_vocals = os.path.join(output_dir, f'no_vocals.{ext}')
+        else:
+            stems = get_separator_pool().separate(
+                DEMUCS, model, audio_path, output_dir,
+                threads=threads, timeout=timeout, max_workers=pool_workers,
+                two_stems='vocals', shifts=shifts, overlap=overlap, float32=float32 or ext == 'wav',
+                ext=ext, mp3_bitrate=320
+            )
+            no_vocals = stems['no_vocals']
+
+        # Measured speed feeds the --deadline quality planner
+        record_throughput(model, get_audio_duration(audio_path), time.time() - started, threads,
+                          demucs_passes(shifts, overlap))
+    return no_vocals
+
+
+def run_mdx(audio_path: str, output_dir: str, threads: int = None, output_format: str = 'MP3',
+            timeout: int = 10800, chunk_seconds: float = None, vocal_regions: list = None) -> str:
+    """
+    Extract the instrumental with the MDX-Net BS-Roformer model using the configured backend.
+
+    Args:
+        audio_path: Path to input audio file
+        output_dir: Directory for the separated instrumental
+        threads: CPU threads the model may use (None = all cores)
+        output_format: Stem file format ('MP3' or 'WAV')
+        timeout: Seconds before giving up (per chunk when chunked)
+        chunk_seconds: Window length for chunked separation of long tracks
+            (None = KARAOKE_CHUNK_SECONDS, 0 = never chunk)
+        vocal_regions: Only separate these (start, end) seconds and pass the
+            original audio through elsewhere (see vad.py)
+
+    Returns:
+        Path to the instrumental stem (None if it was not produced)
+    """
+    if vocal_regions:
+        def separate_segment(segment_path, segment_dir):
+            return run_mdx(
+                segment_path, segment_dir, threads=threads, output_format='WAV',
+                timeout=timeout, chunk_seconds=chunk_seconds
+            )
+
+        os.makedirs(output_dir, exist_ok=True)
+        track_name = os.path.splitext(os.path.basename(audio_path))[0]
+        return separate_vocal_regions(
+            audio_path, separate_segment,
+            os.path.join(output_dir, f'{track_name}_(Instrumental).{output_format.lower()}'),
+            vocal_regions
+        )
+
+    if chunk_seconds != 0 and should_chunk(get_audio_duration(audio_path), chunk_seconds):
+        def separate_window(chunk_path, chunk_dir):
+            return run_mdx(
+                chunk_path, chunk_dir, threads=threads, output_format='WAV',
+                timeout=timeout, chunk_seconds=0
+            )
+
+        os.makedirs(output_dir, exist_ok=True)
+        track_name = os.path.splitext(os.path.basename(audio_path))[0]
+        return separate_chunked(
+            audio_path, separate_window,
+            os.path.join(output_dir, f'{track_name}_(Instrumental).{output_format.lower()}'),
+            chunk_seconds=chunk_seconds
+        )
+
+    with cpu_lease('MDX-Net', want=threads) as threads:
+        started = time.time()
+        if SEPARATOR_BACKEND == 'cli':
+            result = run_process(
+                [
+                    'audio-separator',
+                    audio_path,
+                    '-m', MDX_MODEL,
+                    '--output_format', output_format,
+                    '--output_dir', output_dir,
+                    '--normalization', '0.9',
+                    '--single_stem', 'Instrumental'
+                ],
+                timeout=timeout,
+                text=True,
+                env=thread_env(threads)
+            )
+            annotate(returncode=result.returncode)
+
+            if result.returncode != 0:
+                raise RuntimeError(f"MDX-Net failed with return code {result.returncode}")
+
+            track_name = os.path.splitext(os.path.basename(audio_path))[0]
+            instrumental = None
+            for file in os.listdir(output_dir):
+                if file.startswith(track_name) and 'Instrumental' in file and file.lower().endswith(f'.{output_format.lower()}'):
+                    instrumental = os.path.join(output_dir, file)
+                    break
+        else:
+            stems = get_separator_pool().separate(
+                MDX, MDX_MODEL, audio_path, output_dir,
+                threads=threads, timeout=timeout,
+                output_format=output_format, normalization=0.9, single_stem='Instrumental'
+            )
+            instrumental = stems.get('instrumental')
+
+        if instrumental:
+            record_throughput('mdx', get_audio_duration(audio_path), time.time() - started, threads)
+    return instrumental
+
+
+# STEP 3: 50/50 ensemble of the Demucs and MDX-Net instrumentals
+ENSEMBLE_FILTER = 'amix=inputs=2:weights=0.5 0.5:duration=longest:normalize=0'
+
+# STEP 4: Enhanced post-processing with brightness preservation:
+# 1. Very gentle high-pass at 20Hz (remove DC offset only, not 30Hz)
+# 2. Presence boost at 3kHz +1dB (add clarity without harshness)
+# 3. High-shelf at 8kHz +1.5dB (restore air and sparkle)
+# 4. Light dynamic normalization (preserve dynamics better)
+# 5. Gentle compression (avoid squashing)
+# 6. Soft limiter (prevent clipping)
+POLISH_FILTER = (
+    'highpass=f=20,'
+    'equalizer=f=3000:width_type=o:width=1:g=1,'
+    'highshelf=f=8000:g=1.5,'
+    'dynaudnorm=f=300:g=10:p=0.8:m=10:r=0.4:b=0,'
+    'compand=attacks=0.15:decays=0.4:points=-80/-80|-45/-25|-27/-15|0/-8,'
+    'alimiter=limit=0.96'
+)
+
+
+def pitch_filter(semitones: int) -> str:
+    """
+    Build the Rubberband pitch-shift filter chain with brightness preservation.
+
+    Args:
+        semitones: Number of semitones to shift (+/- 12)
+
+    Returns:
+        FFmpeg audio filter chain
+    """
+    # Calculate pitch ratio for rubberband
+    # Rubberband uses pitch ratio (multiplier), not semitones
+    # Formula: ratio = 2^(semitones/12)
+    pitch_ratio = 2 ** (semitones / 12)
+    
+    # Enhanced pitch shifting with brightness preservation:
+    # Pitch shifting, especially downward, tends to dull high frequencies
+    # We compensate by boosting brightness based on shift direction
+    
+    # Calculate brightness compensation (more boost for larger pitch changes)
+    brightness_gain = abs(semitones) * 0.2  # 0.2dB per semitone
+    brightness_gain = min(brightness_gain, 2.5)  # Cap at 2.5dB to avoid harshness
+    
+    # Build filter chain for enhanced pitch shifting
+    filter_chain = []
+    
+    # 1. Pre-emphasis: Slight high-frequency boost before shifting (only for down-pitch)
+    if semitones < 0:
+        filter_chain.append(f'highshelf=f=6000:g={brightness_gain * 0.5}')
+    
+    # 2. High-quality pitch shifting with Rubberband
+    filter_chain.append(f'rubberband=pitch={pitch_ratio}')
+    
+    # 3. Post-brightness restoration (compensate for dulling)
+    # Boost highs more aggressively than pre-emphasis
+    filter_chain.append(f'highshelf=f=7000:g={brightness_gain}')
+    
+    # 4. Presence enhancement (add clarity that pitch-shifting loses)
+    filter_chain.append('equalizer=f=3500:width_type=o:width=0.8:g=0.8')
+    
+    # Combine all filters
+    return ','.join(filter_chain)
+
+
+def build_fused_filtergraph(semitones: int = 0, keep_stages=(), ensemble: bool = True):
+    """
+    Build one FFmpeg filter_complex covering ensemble blend → polish → optional pitch.
+
+    Inputs 0 and 1 are the Demucs and MDX-Net instrumentals (only input 0, the
+    Demucs instrumental, without the ensemble).
+
+    Args:
+        semitones: Pitch shift applied at the end (0 = none)
+        keep_stages: Intermediate stage labels ('ensemble', 'polished') to split off
+            as extra outputs so they can be saved alongside the final result
+        ensemble: Blend in the MDX-Net instrumental
+
+    Returns:
+        Tuple of (filter_complex string, list of output labels in stage order,
+        ending with the final output)
+    """
+    stages = [('ensemble', ENSEMBLE_FILTER)] if ensemble else []
+    stages.append(('polished', POLISH_FILTER))
+    if semitones != 0:
+        stages.append(('pitched', pitch_filter(semitones)))
+
+    graph = []
+    outputs = []
+    source = '[0:a][1:a]' if ensemble else '[0:a]'
+    for index, (label, chain) in enumerate(stages):
+        if index == len(stages) - 1:
+            graph.append(f'{source}{chain}[{label}]')
+            outputs.append(label)
+        elif label in keep_stages:
+            graph.append(f'{source}{chain},asplit=2[{label}][{label}_next]')
+            outputs.append(label)
+            source = f'[{label}_next]'
+        else:
+            graph.append(f'{source}{chain}[{label}_next]')
+            source = f'[{label}_next]'
+
+    return ';'.join(graph), outputs
+
+
+def run_fused_pipeline(demucs_no_vocals: str, mdx_instrumental: str, output_path: str,
+                       semitones: int = 0, stage_outputs: dict = None) -> str:
+    """
+    Run STEPS 3-5 as a single FFmpeg pass: one decode of each stem, one encode of the result.
+
+    Args:
+        demucs_no_vocals: Demucs instrumental (STEP 1 output)
+        mdx_instrumental: MDX-Net instrumental (STEP 2 output), None to skip the ensemble
+        output_path: Final karaoke file
+        semitones: Pitch shift applied at the end (0 = none)
+        stage_outputs: Optional mapping of stage label ('ensemble', 'polished') to a
+            path where that intermediate result should also be written
+
+    Returns:
+        Path to the final output
+    """
+    stage_outputs = stage_outputs or {}
+    ensemble = mdx_instrumental is not None
+    filter_complex, labels = build_fused_filtergraph(semitones, keep_stages=stage_outputs, ensemble=ensemble)
+
+    final_paths = [stage_outputs[label] for label in labels[:-1]] + [output_path]
+    with cpu_lease('FFmpeg post-processing', want=FFMPEG_STAGE_THREADS) as threads, \
+            atomic_outputs(*final_paths) as temp_paths:
+        command = ['ffmpeg', '-y', *ffmpeg_thread_args(threads), '-i', demucs_no_vocals]
+        if ensemble:
+            command.extend(['-i', mdx_instrumental])
+        command.extend(['-filter_complex', filter_complex])
+        for label, temp_path in zip(labels, temp_paths):
+            command.extend(['-map', f'[{label}]', *encode_args(temp_path), temp_path])
+
+        result = run_process(command, timeout=600, text=True)
+        annotate(returncode=result.returncode)
+
+        if result.returncode != 0:
+            raise RuntimeError(f"Fused post-processing failed with return code {result.returncode}")
+
+    return output_path
+
+
+def reuse_fingerprint_match(audio_path: str, content_hash: str, model: str, stem: str,
+                            dest_path: str, key_params: dict, vocal_regions: list = None):
+    """
+    Reuse the cached stem of the same recording stored under another hash
+    (re-encoded upload, trimmed copy) instead of separating again.
+
+    Every input is fingerprinted when it is hashed; when a known recording
+    contains this one, that recording's full (ungated) stem is sliced to the
+    matching span, at an offset refined to the sample, and gated again with this
+    input's vocal regions if there are any.
+
+    Args:
+        audio_path: Path to input audio file
+        content_hash: Hash of the input audio
+        model: Separation model the stem must come from
+        stem: Stem name in the cache ('no_vocals', 'instrumental')
+        dest_path: Where to write the sliced stem
+        key_params: Separation parameters of the stem cache key, without gating
+        vocal_regions: Vocal regions of this input when the separation is gated
+
+    Returns:
+        dest_path, or None if no matching recording has this stem cached
+    """
+    try:
+        with stage('fingerprint', input=audio_path):
+            matches = get_fingerprint_index().match_samples(decode_mono(audio_path), exclude=content_hash)
+    except RuntimeError as e:
+        print(f"⚠️  Fingerprint lookup skipped: {e}")
+        return None
+
+    cache = get_stem_cache()
+    for match_hash, offset, error in matches:
+        cached = cache.get(stem_cache_key(match_hash, model, **key_params), stem)
+        if not cached:
+            continue
+        duration = get_audio_duration(audio_path)
+        offset = refine_offset(audio_path, cached, offset, duration)
+        print(f"\n🔎 Recognised a cached recording (match at {offset:.3f}s, {error:.0%} bit difference)")
+        print(f"   Slicing its {stem} stem instead of separating again")
+        record_cache('fingerprint', True, stem=stem)
+        if not vocal_regions:
+            return slice_audio(cached, dest_path, offset, duration)
+
+        # Gated runs of this input keep the stem in its vocal regions only
+        sliced = slice_audio(cached, os.path.join(os.path.dirname(dest_path), f'{stem}.matched.wav'), offset, duration)
+        try:
+            return gate_stem(audio_path, sliced, dest_path, vocal_regions)
+        finally:
+            remove_partial([sliced])
+    record_cache('fingerprint', False, stem=stem)
+    return None
+
+
+def create_demucs_karaoke(audio_path: str, mode: str = 'basic', parallel: bool = True,
+                          pitch: int = 0, fused: bool = False, keep_stages: bool = False,
+                          intermediate: str = None, work_dir: str = None,
+                          quality: str = None, deadline: float = None, vad: bool = None) -> str:
     """
     Create karaoke track using AI separation.
 
@@ -75,11 +604,42 @@ def create_demucs_karaoke(audio_path: str, mode: str = 'basic') -> str:
     Args:
         audio_path: Path to input audio file
         mode: Processing mode ('basic' or 'professional')
+        parallel: Run the Demucs and MDX-Net separations concurrently (professional mode)
+        pitch: Pitch shift in semitones applied to the result (0 = none)
+        fused: Run ensemble, post-processing and pitch as one FFmpeg pass (professional mode)
+        keep_stages: With fused, also write the ensemble / polished intermediates
+        intermediate: Format handed between stages, 'mp3' or 'wav' (default: KARAOKE_INTERMEDIATE_FORMAT)
+        work_dir: Folder for separation output and stage intermediates, e.g. a job
+            workspace (default: the folder of audio_path)
+        quality: Professional-mode quality tier, see quality.QUALITY_TIERS (default: 'studio')
+        deadline: Epoch time the result is needed by; the quality is lowered until the
+            estimated run time fits (professional mode)
+        vad: Only run the separators where vocals may be, passing the original audio
+            through in long instrumental stretches (default: KARAOKE_VAD)
 
     Returns:
         Path to final processed karaoke track
     """
     base_name = os.path.splitext(audio_path)[0]
+    work_dir = work_dir or os.path.dirname(audio_path)
+    # Intermediates live in the work folder unless they were asked for as outputs
+    stage_base = base_name if keep_stages else os.path.join(work_dir, os.path.basename(base_name))
+
+    intermediate = intermediate or INTERMEDIATE_FORMAT
+    if intermediate not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"Unknown intermediate format '{intermediate}' (expected one of {', '.join(INTERMEDIATE_FORMATS)})")
+    # Stem/stage settings that change the files on disk also change the cache key
+    output_tag = 'wav-f32' if intermediate == 'wav' else 'mp3-320'
+
+    # Vocal-activity pre-pass: regions the separators have to run on (None = everything)
+    vocal_regions = None
+    if VAD_ENABLED if vad is None else vad:
+        print(f"\n🔎 Detecting vocal activity...")
+        with stage('vad', input=audio_path):
+            vocal_regions = plan_gating(audio_path, work_dir)
+    # Gated stems differ from full separations, so they are cached and indexed apart
+    gate_params = {'vad': regions_tag(vocal_regions)} if vocal_regions else {}
+    gate_suffix = '_vad' if vocal_regions else ''
 
     # BASIC MODE: Demucs only (optimized for Streamlit Cloud)
     if mode == 'basic':
@@ -87,38 +647,48 @@ def create_demucs_karaoke(audio_path: str, mode: str = 'basic') -> str:
         print(f"   🎯 Mode: Basic - Fast vocal removal")
         print(f"   ✨ Optimized for Streamlit Cloud deployment")
 
+        # The Demucs stem is the deliverable unless a pitch shift follows,
+        # so only use the lossless intermediate when there is a next stage
+        stem_ext = 'wav' if intermediate == 'wav' and pitch != 0 else 'mp3'
+        stem_tag = 'wav-f32' if stem_ext == 'wav' else 'mp3-320'
+
         # Use Demucs with --two-stems for faster processing
-        demucs_output = os.path.join(os.path.dirname(audio_path), 'separated', 'htdemucs', os.path.splitext(os.path.basename(audio_path))[0])
-        demucs_no_vocals = os.path.join(demucs_output, 'no_vocals.mp3')
+        demucs_output = os.path.join(work_dir, f'separated{gate_suffix}', 'htdemucs', os.path.splitext(os.path.basename(audio_path))[0])
+        demucs_no_vocals = os.path.join(demucs_output, f'no_vocals.{stem_ext}')
+
+        cache = get_stem_cache()
+        with stage('hash', input=audio_path):
+            content_hash = audio_content_hash(audio_path, fingerprint_audio=True)
+        full_params = dict(two_stems='vocals', shifts=1, overlap=0.25, output=stem_tag)
+        cache_key = stem_cache_key(content_hash, 'htdemucs', **full_params, **gate_params)
+        cached_no_vocals = cache.get(cache_key, 'no_vocals')
 
         if os.path.exists(demucs_no_vocals):
             print(f"\n✅ Demucs output already exists, using cached version...")
             print(f"   Using: {demucs_no_vocals}")
+        elif cached_no_vocals:
+            print(f"\n✅ Found separated stems in cache, skipping Demucs...")
+            print(f"   Using: {cached_no_vocals}")
+            materialize(cached_no_vocals, demucs_no_vocals)
+        elif reuse_fingerprint_match(audio_path, content_hash, 'htdemucs', 'no_vocals', demucs_no_vocals, full_params,
+                                     vocal_regions):
+            cache.put(cache_key, {'no_vocals': demucs_no_vocals}, model='htdemucs', source=os.path.basename(audio_path))
         else:
             print(f"\n📊 Running Demucs (2-stem separation)...")
 
-            result = subprocess.run(
-                [
-                    'demucs',
-                    '--two-stems=vocals',  # Only separate vocals/no_vocals (faster)
-                    '-n', 'htdemucs',      # Standard model (lighter than htdemucs_6s)
-                    '--mp3',               # Output as MP3
-                    '--mp3-bitrate=320',   # High quality
-                    audio_path
-                ],
-                timeout=7200,  # 2 hours max
-                text=True,
-                env={**os.environ, 'TORCH_HOME': os.path.expanduser('~/.cache/torch')}
-            )
-
-            if result.returncode != 0:
-                raise RuntimeError(f"Demucs failed with return code {result.returncode}")
+            with stage('demucs', model='htdemucs', input=audio_path):
+                run_demucs(audio_path, 'htdemucs', demucs_output, ext=stem_ext, timeout=7200,  # 2 hours max
+                           vocal_regions=vocal_regions)
 
             if not os.path.exists(demucs_no_vocals):
                 raise FileNotFoundError(f"Demucs output not found at: {demucs_no_vocals}")
 
+            cache.put(cache_key, {'no_vocals': demucs_no_vocals}, model='htdemucs', source=os.path.basename(audio_path))
             print(f"✅ Karaoke track created successfully!")
+        get_media_index().record_output(content_hash, f'htdemucs_no_vocals{gate_suffix}.{stem_ext}', demucs_no_vocals)
 
+        if pitch != 0:
+            return adjust_pitch(demucs_no_vocals, pitch)
         return demucs_no_vocals
 
     # PROFESSIONAL MODE: Full 4-step pipeline
@@ -130,131 +700,214 @@ def create_demucs_karaoke(audio_path: str, mode: str = 'basic') -> str:
     # Determine step labels
     total_steps = 4
 
-    # STEP 1: Demucs 6-stem separation (~30-40 minutes)
-    demucs_output = os.path.join(os.path.dirname(audio_path), 'separated', 'htdemucs_6s', os.path.splitext(os.path.basename(audio_path))[0])
-    demucs_no_vocals = os.path.join(demucs_output, 'no_vocals.mp3')
+    cache = get_stem_cache()
+    index = get_media_index()
+    with stage('hash', input=audio_path):
+        content_hash = audio_content_hash(audio_path, fingerprint_audio=True)
+
+    # Separation settings: the requested tier, lowered if needed to finish by the deadline
+    separated_seconds = sum(end - start for start, end in vocal_regions) if vocal_regions else get_audio_duration(audio_path)
+    plan = plan_quality(separated_seconds, quality, deadline, parallel=parallel)
+    demucs_model = plan['model']
+    print(f"   🎚️  Quality: {plan['quality']} ({demucs_model}, {plan['shifts']} shift(s)"
+          f"{', MDX-Net ensemble' if plan['ensemble'] else ''}), estimated ~{plan['estimate'] / 60:.0f} min")
+    if deadline is not None and not plan['fits']:
+        print(f"   ⚠️  Even the fastest quality is expected to miss the deadline by ~{(time.time() + plan['estimate'] - deadline) / 60:.0f} min")
+    # Results of lower tiers get their own names, so they are never reused as studio quality
+    quality_suffix = '' if plan['quality'] == DEFAULT_QUALITY else f"_{plan['quality']}"
+
+    def demucs_step(threads):
+        # STEP 1: Demucs 6-stem separation (~30-40 minutes)
+        # Tiers share the model and gated runs differ from full ones, so each keeps its own folder
+        demucs_output = os.path.join(work_dir, f'separated{quality_suffix}{gate_suffix}', demucs_model, os.path.splitext(os.path.basename(audio_path))[0])
+        demucs_no_vocals = os.path.join(demucs_output, f'no_vocals.{intermediate}')
+        full_params = dict(two_stems='vocals', shifts=plan['shifts'], overlap=plan['overlap'], float32=True,
+                           output=output_tag)
+        demucs_key = stem_cache_key(content_hash, demucs_model, **full_params, **gate_params)
+        cached_no_vocals = cache.get(demucs_key, 'no_vocals')
     
-    if os.path.exists(demucs_no_vocals):
-        print(f"\n✅ STEP 1/{total_steps}: Demucs output already exists, skipping...")
-        print(f"   Using cached: {demucs_no_vocals}")
-    else:
-        print(f"\n📊 STEP 1/{total_steps}: Running Demucs htdemucs_6s (6-stem separation)...")
-        
-        # Clean up any partial model files before running
-        cache_dir = os.path.expanduser('~/.cache/torch/hub/checkpoints')
-        if os.path.exists(cache_dir):
-            for file in os.listdir(cache_dir):
-                if file.endswith('.partial') or file.endswith('.th.part'):
-                    partial_path = os.path.join(cache_dir, file)
-                    print(f"🧹 Cleaning up partial download: {file}")
-                    try:
-                        os.remove(partial_path)
-                    except:
-                        pass
+        if os.path.exists(demucs_no_vocals):
+            print(f"\n✅ STEP 1/{total_steps}: Demucs output already exists, skipping...")
+            print(f"   Using cached: {demucs_no_vocals}")
+        elif cached_no_vocals:
+            print(f"\n✅ STEP 1/{total_steps}: Found Demucs stems in cache, skipping...")
+            print(f"   Using cached: {cached_no_vocals}")
+            materialize(cached_no_vocals, demucs_no_vocals)
+        elif reuse_fingerprint_match(audio_path, content_hash, demucs_model, 'no_vocals', demucs_no_vocals, full_params,
+                                     vocal_regions):
+            print(f"✅ STEP 1/{total_steps}: Demucs stems sliced from a matching recording")
+            cache.put(demucs_key, {'no_vocals': demucs_no_vocals}, model=demucs_model, source=os.path.basename(audio_path))
+        else:
+            print(f"\n📊 STEP 1/{total_steps}: Running Demucs {demucs_model} ({plan['shifts']} shift(s))...")
         
-        result = subprocess.run(
-            [
-                'demucs',
-                '--two-stems=vocals',
-                '-n', 'htdemucs_6s',
-                '--float32',
-                '--shifts=10',
-                '--overlap=0.25',
-                '--mp3',  # Force MP3 output to avoid Python 3.13 torchcodec issues
-                '--mp3-bitrate=320',  # High quality
-                audio_path
-            ],
-            timeout=10800,  # 3 hours max
-            text=True,
-            env={**os.environ, 'TORCH_HOME': os.path.expanduser('~/.cache/torch')}
-        )
+            # Clean up any partial model files before running
+            cache_dir = os.path.expanduser('~/.cache/torch/hub/checkpoints')
+            if os.path.exists(cache_dir):
+                for file in os.listdir(cache_dir):
+                    if file.endswith('.partial') or file.endswith('.th.part'):
+                        partial_path = os.path.join(cache_dir, file)
+                        print(f"🧹 Cleaning up partial download: {file}")
+                        try:
+                            os.remove(partial_path)
+                        except:
+                            pass
         
-        if result.returncode != 0:
-            raise RuntimeError(f"Demucs failed with return code {result.returncode}")
+            with stage('demucs', model=demucs_model, input=audio_path, shifts=plan['shifts']):
+                run_demucs(
+                    audio_path, demucs_model, demucs_output,
+                    shifts=plan['shifts'], overlap=plan['overlap'], float32=True,
+                    threads=threads, ext=intermediate,
+                    timeout=10800,  # 3 hours max
+                    vocal_regions=vocal_regions
+                )
         
-        if not os.path.exists(demucs_no_vocals):
-            raise FileNotFoundError(f"Demucs output not found at: {demucs_no_vocals}")
+            if not os.path.exists(demucs_no_vocals):
+                raise FileNotFoundError(f"Demucs output not found at: {demucs_no_vocals}")
         
-        print(f"✅ STEP 1 complete: Demucs separation finished")
-    
-    # STEP 2: MDX-Net separation (~30-40 minutes)
-    mdx_output_dir = os.path.join(os.path.dirname(audio_path), 'mdx_separated')
-    os.makedirs(mdx_output_dir, exist_ok=True)
-    
-    # Find existing MDX-Net output
-    mdx_instrumental = None
-    if os.path.exists(mdx_output_dir):
-        for file in os.listdir(mdx_output_dir):
-            if 'Instrumental' in file and file.endswith('.mp3'):
-                mdx_instrumental = os.path.join(mdx_output_dir, file)
-                break
-    
-    if mdx_instrumental and os.path.exists(mdx_instrumental):
-        print(f"\n✅ STEP 2/{total_steps}: MDX-Net output already exists, skipping...")
-        print(f"   Using cached: {mdx_instrumental}")
-    else:
-        print(f"\n📊 STEP 2/{total_steps}: Running MDX-Net BS-Roformer (professional vocal isolation)...")
+            cache.put(demucs_key, {'no_vocals': demucs_no_vocals}, model=demucs_model, source=os.path.basename(audio_path))
+            print(f"✅ STEP 1 complete: Demucs separation finished")
+        index.record_output(content_hash, f'{demucs_model}_no_vocals{quality_suffix}{gate_suffix}.{intermediate}', demucs_no_vocals)
+        return demucs_no_vocals
+
+    def mdx_step(threads):
+        # STEP 2: MDX-Net separation (~30-40 minutes)
+        mdx_output_dir = os.path.join(work_dir, f'mdx_separated{gate_suffix}')
+        os.makedirs(mdx_output_dir, exist_ok=True)
+        full_params = dict(single_stem='Instrumental', normalization=0.9, output=intermediate)
+        mdx_key = stem_cache_key(content_hash, MDX_MODEL, **full_params, **gate_params)
+        mdx_default_output = os.path.join(mdx_output_dir, f"{os.path.splitext(os.path.basename(audio_path))[0]}_(Instrumental).{intermediate}")
+        cached_instrumental = cache.get(mdx_key, 'instrumental')
+    
+        # Existing MDX-Net output for this song (index lookup, no directory scan). Only
+        # this run's own folder counts: another run's workspace may be deleted or still
+        # being written while we read it, so across runs stems come from the stem cache.
+        mdx_instrumental = index.output(content_hash, f'mdx_instrumental{gate_suffix}.{intermediate}')
+        if mdx_instrumental and os.path.dirname(mdx_instrumental) != os.path.abspath(mdx_output_dir):
+            mdx_instrumental = None
+    
+        if mdx_instrumental:
+            print(f"\n✅ STEP 2/{total_steps}: MDX-Net output already exists, skipping...")
+            print(f"   Using cached: {mdx_instrumental}")
+        elif cached_instrumental:
+            print(f"\n✅ STEP 2/{total_steps}: Found MDX-Net stems in cache, skipping...")
+            print(f"   Using cached: {cached_instrumental}")
+            mdx_instrumental = materialize(cached_instrumental, mdx_default_output)
+        elif reuse_fingerprint_match(audio_path, content_hash, MDX_MODEL, 'instrumental', mdx_default_output, full_params,
+                                     vocal_regions):
+            print(f"✅ STEP 2/{total_steps}: MDX-Net stems sliced from a matching recording")
+            mdx_instrumental = mdx_default_output
+            cache.put(mdx_key, {'instrumental': mdx_instrumental}, model=MDX_MODEL, source=os.path.basename(audio_path))
+        else:
+            print(f"\n📊 STEP 2/{total_steps}: Running MDX-Net BS-Roformer (professional vocal isolation)...")
         
-        result = subprocess.run(
-            [
-                'audio-separator',
-                audio_path,
-                '-m', 'model_bs_roformer_ep_317_sdr_12.9755.ckpt',
-                '--output_format', 'MP3',
-                '--output_dir', mdx_output_dir,
-                '--normalization', '0.9',
-                '--single_stem', 'Instrumental'
-            ],
-            timeout=10800,  # 3 hours max
-            text=True
-        )
+            with stage('mdx', model=MDX_MODEL, input=audio_path):
+                mdx_instrumental = run_mdx(
+                    audio_path, mdx_output_dir, threads=threads,
+                    output_format=intermediate.upper(),
+                    timeout=10800,  # 3 hours max
+                    vocal_regions=vocal_regions
+                )
         
-        if result.returncode != 0:
-            raise RuntimeError(f"MDX-Net failed with return code {result.returncode}")
+            if not mdx_instrumental or not os.path.exists(mdx_instrumental):
+                raise FileNotFoundError(f"MDX-Net output not found in: {mdx_output_dir}")
         
-        # Find the MDX-Net instrumental output
+            cache.put(mdx_key, {'instrumental': mdx_instrumental}, model=MDX_MODEL, source=os.path.basename(audio_path))
+            print(f"✅ STEP 2 complete: MDX-Net separation finished")
+        index.record_output(content_hash, f'mdx_instrumental{gate_suffix}.{intermediate}', mdx_instrumental)
+        return mdx_instrumental
+
+    # STEPS 1 and 2 only read the original audio, so they can run side by side
+    if not plan['ensemble']:
+        print(f"\n⏭️  STEPS 2-3/{total_steps}: MDX-Net ensemble skipped ({plan['quality']} quality)")
+        demucs_no_vocals = demucs_step(None)
         mdx_instrumental = None
-        for file in os.listdir(mdx_output_dir):
-            if 'Instrumental' in file and file.endswith('.mp3'):
-                mdx_instrumental = os.path.join(mdx_output_dir, file)
-                break
-        
-        if not mdx_instrumental or not os.path.exists(mdx_instrumental):
-            raise FileNotFoundError(f"MDX-Net output not found in: {mdx_output_dir}")
-        
-        print(f"✅ STEP 2 complete: MDX-Net separation finished")
+    elif parallel:
+        demucs_threads, mdx_threads = split_threads(stage_limit(), 2)
+        print(f"\n⚡ Running STEP 1 and STEP 2 in parallel ({demucs_threads} + {mdx_threads} CPU threads)")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            demucs_future = executor.submit(demucs_step, demucs_threads)
+            mdx_future = executor.submit(mdx_step, mdx_threads)
+            demucs_no_vocals = demucs_future.result()
+            mdx_instrumental = mdx_future.result()
+    else:
+        demucs_no_vocals = demucs_step(None)
+        mdx_instrumental = mdx_step(None)
     
+    # Without the ensemble, the Demucs instrumental goes straight to post-processing
+    ensemble_output = f"{stage_base}_ensemble_karaoke{quality_suffix}{gate_suffix}.{intermediate}" if plan['ensemble'] else demucs_no_vocals
+    final_output = f"{base_name}_final_polished_karaoke{quality_suffix}{gate_suffix}.mp3"
+    if pitch != 0 and intermediate == 'wav':
+        # Pitch shifting is the last stage, so the polished track is still an intermediate
+        final_output = f"{base_name}_final_polished_karaoke{quality_suffix}{gate_suffix}.wav"
+
+    # FUSED: STEPS 3-5 in a single FFmpeg pass (no intermediate encode/decode cycles)
+    if fused:
+        fused_output = final_output if pitch == 0 else f"{base_name}_final_polished_karaoke{quality_suffix}{gate_suffix}_pitch{pitch:+d}.mp3"
+
+        if os.path.exists(fused_output):
+            print(f"\n✅ STEPS 3-5: Fused output already exists, skipping...")
+            print(f"   Using cached: {fused_output}")
+        else:
+            print(f"\n📊 STEPS 3-5: " + ("Ensemble blend + " if plan['ensemble'] else "") + "post-processing" + (f" + pitch {pitch:+d}" if pitch else "") + " (single pass)...")
+
+            stage_outputs = {}
+            if keep_stages:
+                if plan['ensemble']:
+                    stage_outputs['ensemble'] = ensemble_output
+                if pitch != 0:
+                    stage_outputs['polished'] = final_output
+
+            with stage('fused', pitch=pitch):
+                run_fused_pipeline(demucs_no_vocals, mdx_instrumental, fused_output, pitch, stage_outputs)
+            print(f"✅ STEPS 3-5 complete: Fused post-processing finished")
+
+        index.record_output(content_hash, f'karaoke_fused{quality_suffix}{gate_suffix}_pitch{pitch:+d}', fused_output)
+        print(f"\n🎉 Enhanced karaoke pipeline complete!")
+        print(f"📁 Final polished karaoke: {fused_output}")
+        return fused_output
+
     # STEP 3: Ensemble blend (~30 seconds)
-    ensemble_output = f"{base_name}_ensemble_karaoke.mp3"
     
-    if os.path.exists(ensemble_output):
+    if not plan['ensemble']:
+        pass  # Nothing to blend, STEP 4 polishes the Demucs instrumental
+    elif os.path.exists(ensemble_output):
         print(f"\n✅ STEP 3/{total_steps}: Ensemble blend already exists, skipping...")
         print(f"   Using cached: {ensemble_output}")
     else:
         print(f"\n📊 STEP 3/{total_steps}: Blending ensemble (50% Demucs + 50% MDX-Net)...")
         
-        result = subprocess.run(
-            [
-                'ffmpeg', '-y',
-                '-i', demucs_no_vocals,
-                '-i', mdx_instrumental,
-                '-filter_complex',
-                '[0:a][1:a]amix=inputs=2:weights=0.5 0.5:duration=longest:normalize=0[mixed]',
-                '-map', '[mixed]',
-                '-b:a', '320k',
-                ensemble_output
-            ],
-            timeout=300,  # 5 minutes max
-            text=True
-        )
+        with stage('ensemble'):
+            blended = None
+            if intermediate == 'wav':
+                # Lossless stems: mix the memory-mapped samples directly, no decode/encode
+                with atomic_outputs(ensemble_output) as (temp_output,):
+                    blended = blend_wavs([demucs_no_vocals, mdx_instrumental], [0.5, 0.5], temp_output)
         
-        if result.returncode != 0:
-            raise RuntimeError(f"Ensemble blending failed with return code {result.returncode}")
+            if not blended:
+                with cpu_lease('FFmpeg ensemble', want=FFMPEG_STAGE_THREADS) as threads, \
+                        atomic_outputs(ensemble_output) as (temp_output,):
+                    result = run_process(
+                        [
+                            'ffmpeg', '-y', *ffmpeg_thread_args(threads),
+                            '-i', demucs_no_vocals,
+                            '-i', mdx_instrumental,
+                            '-filter_complex',
+                            f'[0:a][1:a]{ENSEMBLE_FILTER}[mixed]',
+                            '-map', '[mixed]',
+                            *encode_args(ensemble_output),
+                            temp_output
+                        ],
+                        timeout=300,  # 5 minutes max
+                        text=True
+                    )
+                    annotate(returncode=result.returncode)
+            
+                    if result.returncode != 0:
+                        raise RuntimeError(f"Ensemble blending failed with return code {result.returncode}")
         
         print(f"✅ STEP 3 complete: Ensemble blend finished")
     
     # STEP 4: Enhanced post-processing with brightness restoration
-    final_output = f"{base_name}_final_polished_karaoke.mp3"
     
     if os.path.exists(final_output):
         print(f"\n✅ STEP 4/{total_steps}: Post-processing already complete!")
@@ -266,33 +919,23 @@ def create_demucs_karaoke(audio_path: str, mode: str = 'basic') -> str:
         print(f"   • Subtle compression (maintain dynamics)")
         print(f"   • Soft limiting (prevent clipping)")
         
-        result = subprocess.run(
-            [
-                'ffmpeg', '-y',
-                '-i', ensemble_output,
-                '-af',
-                # Enhanced post-processing with brightness preservation:
-                # 1. Very gentle high-pass at 20Hz (remove DC offset only, not 30Hz)
-                # 2. Presence boost at 3kHz +1dB (add clarity without harshness)
-                # 3. High-shelf at 8kHz +1.5dB (restore air and sparkle)
-                # 4. Light dynamic normalization (preserve dynamics better)
-                # 5. Gentle compression (avoid squashing)
-                # 6. Soft limiter (prevent clipping)
-                'highpass=f=20,'
-                'equalizer=f=3000:width_type=o:width=1:g=1,'
-                'highshelf=f=8000:g=1.5,'
-                'dynaudnorm=f=300:g=10:p=0.8:m=10:r=0.4:b=0,'
-                'compand=attacks=0.15:decays=0.4:points=-80/-80|-45/-25|-27/-15|0/-8,'
-                'alimiter=limit=0.96',
-                '-b:a', '320k',
-                final_output
-            ],
-            timeout=300,
-            text=True
-        )
+        with stage('polish'), cpu_lease('FFmpeg post-processing', want=FFMPEG_STAGE_THREADS) as threads, \
+                atomic_outputs(final_output) as (temp_output,):
+            result = run_process(
+                [
+                    'ffmpeg', '-y', *ffmpeg_thread_args(threads),
+                    '-i', ensemble_output,
+                    '-af', POLISH_FILTER,
+                    *encode_args(final_output),
+                    temp_output
+                ],
+                timeout=300,
+                text=True
+            )
+            annotate(returncode=result.returncode)
         
-        if result.returncode != 0:
-            raise RuntimeError(f"Post-processing failed with return code {result.returncode}")
+            if result.returncode != 0:
+                raise RuntimeError(f"Post-processing failed with return code {result.returncode}")
         
         print(f"✅ STEP 4 complete: Enhanced post-processing finished")
     
@@ -301,11 +944,14 @@ def create_demucs_karaoke(audio_path: str, mode: str = 'basic') -> str:
     print(f"   🎸 Output: Pure instrumental track")
     print(f"   ✨ Sound quality: BRIGHT & FULL")
     print(f"📁 Final polished karaoke: {final_output}")
+    index.record_output(content_hash, f'karaoke{quality_suffix}{gate_suffix}.{os.path.splitext(final_output)[1][1:]}', final_output)
     
+    if pitch != 0:
+        return adjust_pitch(final_output, pitch)
     return final_output
 
 
-def adjust_pitch(audio_path: str, semitones: int) -> str:
+def adjust_pitch(audio_path: str, semitones: int, cache: bool = True) -> str:
     """
     Adjust pitch of audio file by specified semitones using high-quality Rubberband algorithm
     with brightness preservation to avoid muffled sound.
@@ -313,66 +959,21 @@ def adjust_pitch(audio_path: str, semitones: int) -> str:
     Args:
         audio_path: Path to input audio file
         semitones: Number of semitones to shift (+/- 12)
+        cache: Look up and store the result in the stem cache (off for throwaway inputs)
         
     Returns:
         Path to pitch-adjusted audio file
     """
     print(f"\n🎵 STEP 5/5: Adjusting pitch by {semitones:+d} semitones (with brightness preservation)...")
     
-    base_name = os.path.splitext(audio_path)[0]
-    output_path = f"{base_name}_pitch{semitones:+d}.mp3"
-    
-    # Calculate pitch ratio for rubberband
-    # Rubberband uses pitch ratio (multiplier), not semitones
-    # Formula: ratio = 2^(semitones/12)
     pitch_ratio = 2 ** (semitones / 12)
-    
-    # Enhanced pitch shifting with brightness preservation:
-    # Pitch shifting, especially downward, tends to dull high frequencies
-    # We compensate by boosting brightness based on shift direction
-    
-    # Calculate brightness compensation (more boost for larger pitch changes)
-    brightness_gain = abs(semitones) * 0.2  # 0.2dB per semitone
-    brightness_gain = min(brightness_gain, 2.5)  # Cap at 2.5dB to avoid harshness
-    
-    # Build filter chain for enhanced pitch shifting
-    filter_chain = []
-    
-    # 1. Pre-emphasis: Slight high-frequency boost before shifting (only for down-pitch)
-    if semitones < 0:
-        filter_chain.append(f'highshelf=f=6000:g={brightness_gain * 0.5}')
-    
-    # 2. High-quality pitch shifting with Rubberband
-    filter_chain.append(f'rubberband=pitch={pitch_ratio}')
-    
-    # 3. Post-brightness restoration (compensate for dulling)
-    # Boost highs more aggressively than pre-emphasis
-    filter_chain.append(f'highshelf=f=7000:g={brightness_gain}')
-    
-    # 4. Presence enhancement (add clarity that pitch-shifting loses)
-    filter_chain.append('equalizer=f=3500:width_type=o:width=0.8:g=0.8')
-    
-    # Combine all filters
-    audio_filter = ','.join(filter_chain)
+    brightness_gain = min(abs(semitones) * 0.2, 2.5)
     
     print(f"   • Rubberband pitch shift: {pitch_ratio:.4f}x")
     print(f"   • Brightness compensation: +{brightness_gain:.1f}dB @ 7kHz")
     print(f"   • Presence enhancement: +0.8dB @ 3.5kHz")
     
-    result = subprocess.run(
-        [
-            'ffmpeg', '-y',
-            '-i', audio_path,
-            '-af', audio_filter,
-            '-b:a', '320k',
-            output_path
-        ],
-        timeout=300,  # 5 minutes max
-        text=True
-    )
-    
-    if result.returncode != 0:
-        raise RuntimeError(f"Pitch adjustment failed with return code {result.returncode}")
+    output_path = adjust_pitch_ladder(audio_path, [semitones], cache=cache)[semitones]
     
     print(f"✅ STEP 5 complete: Pitch adjusted by {semitones:+d} semitones (brightness preserved)")
     print(f"📁 Pitch-adjusted track: {output_path}")
@@ -380,125 +981,241 @@ def adjust_pitch(audio_path: str, semitones: int) -> str:
     return output_path
 
 
+def parse_pitch_values(value: str) -> list:
+    """
+    Parse a --pitch value: a single shift ("-3"), a range ("-4..4") or a list ("-4,-2,2").
+
+    Values are capped at ±12 semitones and returned sorted without duplicates.
+
+    Raises:
+        ValueError: If the value cannot be parsed
+    """
+    if '..' in value:
+        low, high = (int(part) for part in value.split('..', 1))
+        values = range(min(low, high), max(low, high) + 1)
+    else:
+        values = [int(part) for part in value.split(',') if part.strip()]
+
+    if not values:
+        raise ValueError(f"No pitch values in '{value}'")
+    return sorted({max(-12, min(12, v)) for v in values})
+
+
+def adjust_pitch_ladder(audio_path: str, semitones_list: list, cache: bool = True) -> dict:
+    """
+    Render several pitch-shifted variants of one track from a single decode.
+
+    The source is decoded once and split (asplit) into one Rubberband chain per
+    variant inside a single FFmpeg process, which encodes all outputs in parallel.
+    Variants are cached per source audio hash and semitone value, so repeated
+    requests are served from the stem cache without running FFmpeg.
+
+    Args:
+        audio_path: Path to input audio file
+        semitones_list: Semitone shifts to render (0 maps to the source itself)
+        cache: Look up and store the variants in the stem cache. Inputs that only
+            live for one run (workspace temp files) skip it: hashing them costs a
+            full decode and their entries would only evict real stems.
+
+    Returns:
+        Mapping of semitones to output file path
+    """
+    base_name = os.path.splitext(audio_path)[0]
+    stem_cache = get_stem_cache() if cache else None
+    if stem_cache:
+        with stage('hash', input=audio_path):
+            content_hash = audio_content_hash(audio_path)
+
+    outputs = {}
+    pending = {}
+    for semitones in sorted(set(semitones_list)):
+        if semitones == 0:
+            outputs[0] = audio_path
+            continue
+
+        output_path = f"{base_name}_pitch{semitones:+d}.mp3"
+        cache_key = None
+        cached = None
+        if stem_cache:
+            cache_key = stem_cache_key(content_hash, 'rubberband', semitones=semitones, filter=pitch_filter(semitones))
+            cached = stem_cache.get(cache_key, 'pitched')
+        if cached:
+            print(f"   ✅ {semitones:+d} semitones: using cached version")
+            outputs[semitones] = materialize(cached, output_path)
+        else:
+            pending[semitones] = (output_path, cache_key)
+
+    if not pending:
+        return outputs
+
+    # One decode, one filter chain per variant
+    labels = [f'p{index}' for index in range(len(pending))]
+    graph = [f"[0:a]asplit={len(pending)}" + ''.join(f'[s{index}]' for index in range(len(pending)))]
+    command = ['ffmpeg', '-y', '-i', audio_path]
+    for index, (semitones, (output_path, _)) in enumerate(pending.items()):
+        graph.append(f'[s{index}]{pitch_filter(semitones)}[{labels[index]}]')
+    command.extend(['-filter_complex', ';'.join(graph)])
+
+    if len(pending) > 1:
+        print(f"   • Rendering {len(pending)} pitch variants in one pass: {', '.join(f'{s:+d}' for s in pending)}")
+
+    # Each variant is its own filter chain, so a ladder can use a thread per variant
+    with stage('pitch', variants=len(pending), input=audio_path), \
+            cpu_lease('FFmpeg pitch', want=max(FFMPEG_STAGE_THREADS, len(pending))) as threads, \
+            atomic_outputs(*(output_path for output_path, _ in pending.values())) as temp_paths:
+        for label, temp_path in zip(labels, temp_paths):
+            command.extend(['-map', f'[{label}]', '-b:a', '320k', temp_path])
+        result = run_process(
+            command[:1] + ffmpeg_thread_args(threads) + command[1:],
+            timeout=300 * len(pending),  # 5 minutes per variant max
+            text=True
+        )
+        annotate(returncode=result.returncode)
+    
+        if result.returncode != 0:
+            raise RuntimeError(f"Pitch adjustment failed with return code {result.returncode}")
+
+    index = get_media_index()
+    for semitones, (output_path, cache_key) in pending.items():
+        if stem_cache:
+            stem_cache.put(cache_key, {'pitched': output_path}, model='rubberband', semitones=semitones, source=os.path.basename(audio_path))
+            index.record_output(content_hash, f'pitch{semitones:+d}', output_path)
+        outputs[semitones] = output_path
+
+    return outputs
+
+
+def print_usage():
+    """Print the command-line usage and options."""
+    print("=" * 70)
+    print("YouTube Downloader with Professional Karaoke Creation")
+    print("=" * 70)
+    print("\nUsage:")
+    print("  uv run main.py <youtube_url_or_file> [options]")
+    print("  uv run main.py --batch <urls_files_or_manifest...> [options]")
+    print("\n🎯 THREE CORE SCENARIOS:")
+    print("")
+    print("  1️⃣  Download Original Video")
+    print("      uv run main.py \"https://youtube.com/watch?v=...\"")
+    print("")
+    print("  2️⃣  Download with Pitch Shift")
+    print("      uv run main.py \"URL\" --pitch=-2")
+    print("      (Adjust to match your vocal range)")
+    print("")
+    print("  3️⃣  Create Karaoke Track (AI-powered, no vocals)")
+    print("      uv run main.py \"URL\" --karaoke")
+    print("      uv run main.py \"URL\" --karaoke --pitch=-3")
+    print("")
+    print("\n💡 BONUS: Process Local Files")
+    print("  4️⃣  Adjust Pitch of Existing File")
+    print("      uv run main.py \"song.mp3\" --pitch=-2")
+    print("      (Re-pitch existing karaoke or original)")
+    print("")
+    print("  5️⃣  Create Karaoke from Local File")
+    print("      uv run main.py \"song.mp3\" --karaoke")
+    print("      uv run main.py \"song.mp3\" --karaoke --pitch=-4")
+    print("")
+    print("\n📋 OPTIONS:")
+    print("  --karaoke         Create professional karaoke (AI vocal removal)")
+    print("                    → Enhanced 4-step pipeline (bright & full sound)")
+    print("                    → Removes ALL vocals (lead + chorus + harmony)")
+    print("                    → Processing: ~45-55 min (with caching)")
+    print("                    → Output: MP3 audio only (320kbps)")
+    print("")
+    print("  --pitch=N         Adjust pitch by N semitones (±12)")
+    print("                    → Uses Rubberband with brightness preservation")
+    print("                    → Works with original OR karaoke")
+    print("                    → Examples: --pitch=2 (up), --pitch=-3 (down)")
+    print("  --pitch=A..B      Render every key from A to B in one pass (e.g. --pitch=-4..4)")
+    print("                    → Or a list: --pitch=-4,-2,2")
+    print("")
+    print("  --trim-start=N    Skip first N seconds (remove ads/intros)")
+    print("  --trim-end=N      Trim last N seconds (remove outros/ads)")
+    print("")
+    print("  --sequential      Run Demucs and MDX-Net one after the other")
+    print("                    → Default runs both in parallel (needs ~2x RAM)")
+    print("")
+    print("  --fused           Blend, polish and pitch-shift in a single FFmpeg pass")
+    print("                    → Only the final MP3 is encoded (faster, no generational loss)")
+    print("  --keep-stages     With --fused, also save the ensemble/polished intermediates")
+    print("  --intermediate=F  Format between pipeline stages: mp3 (default) or wav")
+    print("                    → wav: lossless 32-bit float, only the final MP3 is encoded")
+    print("")
+    print(f"  --quality=Q       Separation quality: {', '.join(QUALITY_TIERS)} (default: {DEFAULT_QUALITY})")
+    print("                    → Fewer Demucs shifts / no MDX-Net ensemble = much faster")
+    print("  --deadline=T      Finish by T: a duration (25m, 1h30m) or a clock time (19:30)")
+    print("                    → Picks the best quality that fits, using measured speed")
+    print("  --vad             Only separate where vocals may be (skip instrumental intros/solos)")
+    print("  --auto-trim       Cut silence at the start and end (instead of --trim-start/--trim-end)")
+    print("")
+    print("  --batch           Process several songs: every URL/file argument, plus")
+    print("                    manifest files (.txt one per line, or .json list)")
+    print("  --workers=N       Batch: songs separated at the same time (default: auto)")
+    print("  --report=FILE     Batch: summary report path (default: batch_report.json)")
+    print("")
+    print("\n📁 OUTPUT:")
+    print("  Default:          Highest quality video (up to 8K)")
+    print("  With --karaoke:   Professional karaoke MP3 (pure instrumental)")
+    print("  With --pitch:     Pitch-adjusted version (original or karaoke)")
+    print("")
+    print("=" * 70)
+
+
 def main():
+    # Stage events go to the telemetry log (KARAOKE_TELEMETRY=0 to disable)
+    install_telemetry()
+
     # Check if URL/file is provided as command-line argument
     if len(sys.argv) < 2:
-        print("=" * 70)
-        print("YouTube Downloader with Professional Karaoke Creation")
-        print("=" * 70)
-        print("\nUsage:")
-        print("  uv run main.py <youtube_url_or_file> [options]")
-        print("\n🎯 THREE CORE SCENARIOS:")
-        print("")
-        print("  1️⃣  Download Original Video")
-        print("      uv run main.py \"https://youtube.com/watch?v=...\"")
-        print("")
-        print("  2️⃣  Download with Pitch Shift")
-        print("      uv run main.py \"URL\" --pitch=-2")
-        print("      (Adjust to match your vocal range)")
-        print("")
-        print("  3️⃣  Create Karaoke Track (AI-powered, no vocals)")
-        print("      uv run main.py \"URL\" --karaoke")
-        print("      uv run main.py \"URL\" --karaoke --pitch=-3")
-        print("")
-        print("\n💡 BONUS: Process Local Files")
-        print("  4️⃣  Adjust Pitch of Existing File")
-        print("      uv run main.py \"song.mp3\" --pitch=-2")
-        print("      (Re-pitch existing karaoke or original)")
-        print("")
-        print("  5️⃣  Create Karaoke from Local File")
-        print("      uv run main.py \"song.mp3\" --karaoke")
-        print("      uv run main.py \"song.mp3\" --karaoke --pitch=-4")
-        print("")
-        print("\n📋 OPTIONS:")
-        print("  --karaoke         Create professional karaoke (AI vocal removal)")
-        print("                    → Enhanced 4-step pipeline (bright & full sound)")
-        print("                    → Removes ALL vocals (lead + chorus + harmony)")
-        print("                    → Processing: ~45-55 min (with caching)")
-        print("                    → Output: MP3 audio only (320kbps)")
-        print("")
-        print("  --pitch=N         Adjust pitch by N semitones (±12)")
-        print("                    → Uses Rubberband with brightness preservation")
-        print("                    → Works with original OR karaoke")
-        print("                    → Examples: --pitch=2 (up), --pitch=-3 (down)")
-        print("")
-        print("  --trim-start=N    Skip first N seconds (remove ads/intros)")
-        print("  --trim-end=N      Trim last N seconds (remove outros/ads)")
-        print("")
-        print("\n📁 OUTPUT:")
-        print("  Default:          Highest quality video (up to 8K)")
-        print("  With --karaoke:   Professional karaoke MP3 (pure instrumental)")
-        print("  With --pitch:     Pitch-adjusted version (original or karaoke)")
-        print("")
-        print("=" * 70)
+        print_usage()
         sys.exit(1)
     
     # Check for help flags
     if '--help' in sys.argv or '-h' in sys.argv or 'help' in sys.argv:
-        print("=" * 70)
-        print("YouTube Downloader with Professional Karaoke Creation")
-        print("=" * 70)
-        print("\nUsage:")
-        print("  uv run main.py <youtube_url_or_file> [options]")
-        print("\n🎯 THREE CORE SCENARIOS:")
-        print("")
-        print("  1️⃣  Download Original Video")
-        print("      uv run main.py \"https://youtube.com/watch?v=...\"")
-        print("")
-        print("  2️⃣  Download with Pitch Shift")
-        print("      uv run main.py \"URL\" --pitch=-2")
-        print("      (Adjust to match your vocal range)")
-        print("")
-        print("  3️⃣  Create Karaoke Track (AI-powered, no vocals)")
-        print("      uv run main.py \"URL\" --karaoke")
-        print("      uv run main.py \"URL\" --karaoke --pitch=-3")
-        print("")
-        print("\n💡 BONUS: Process Local Files")
-        print("  4️⃣  Adjust Pitch of Existing File")
-        print("      uv run main.py \"song.mp3\" --pitch=-2")
-        print("      (Re-pitch existing karaoke or original)")
-        print("")
-        print("  5️⃣  Create Karaoke from Local File")
-        print("      uv run main.py \"song.mp3\" --karaoke")
-        print("      uv run main.py \"song.mp3\" --karaoke --pitch=-4")
-        print("")
-        print("\n📋 OPTIONS:")
-        print("  --karaoke         Create professional karaoke (AI vocal removal)")
-        print("                    → Enhanced 4-step pipeline (bright & full sound)")
-        print("                    → Removes ALL vocals (lead + chorus + harmony)")
-        print("                    → Processing: ~45-55 min (with caching)")
-        print("                    → Output: MP3 audio only (320kbps)")
-        print("")
-        print("  --pitch=N         Adjust pitch by N semitones (±12)")
-        print("                    → Uses Rubberband with brightness preservation")
-        print("                    → Works with original OR karaoke")
-        print("                    → Examples: --pitch=2 (up), --pitch=-3 (down)")
-        print("")
-        print("  --trim-start=N    Skip first N seconds (remove ads/intros)")
-        print("  --trim-end=N      Trim last N seconds (remove outros/ads)")
-        print("")
-        print("\n📁 OUTPUT:")
-        print("  Default:          Highest quality video (up to 8K)")
-        print("  With --karaoke:   Professional karaoke MP3 (pure instrumental)")
-        print("  With --pitch:     Pitch-adjusted version (original or karaoke)")
-        print("")
-        print("=" * 70)
+        print_usage()
         sys.exit(1)
     
-    # Get URL/file path and remove any backslash escapes
-    input_source = sys.argv[1].replace('\\', '')
-    
-    # Check if input is a local file or YouTube URL
-    is_local_file = os.path.isfile(input_source)
-    
-    if is_local_file:
-        print(f"📂 Local file mode: {input_source}")
-    else:
-        print(f"🌐 YouTube mode: {input_source}")
-    
     # Check mode
     karaoke_mode = '--karaoke' in sys.argv or '--demucs' in sys.argv  # Support both for backward compat
+    parallel_separation = '--sequential' not in sys.argv
+    intermediate_format = INTERMEDIATE_FORMAT
+    fused_pipeline = '--fused' in sys.argv
+    keep_stages = '--keep-stages' in sys.argv
     
+    # Check for intermediate format
+    for arg in sys.argv:
+        if arg.startswith('--intermediate='):
+            value = arg.split('=')[1].lower()
+            if value in INTERMEDIATE_FORMATS:
+                intermediate_format = value
+                print(f"💾 Intermediate files: {value}")
+            else:
+                print(f"⚠️  Invalid intermediate format, ignoring (use {' or '.join(INTERMEDIATE_FORMATS)})")
+
+    # Check for quality tier and deadline (professional karaoke)
+    quality = None
+    deadline = None
+    for arg in sys.argv:
+        if arg.startswith('--quality='):
+            value = arg.split('=')[1].lower()
+            if value in QUALITY_TIERS:
+                quality = value
+                print(f"🎚️  Quality: {value}")
+            else:
+                print(f"⚠️  Invalid quality, ignoring (use {', '.join(QUALITY_TIERS)})")
+        elif arg.startswith('--deadline='):
+            try:
+                deadline = parse_deadline(arg.split('=', 1)[1])
+                print(f"⏰ Will finish by {time.strftime('%H:%M', time.localtime(deadline))} (quality adapted to fit)")
+            except ValueError as e:
+                print(f"⚠️  {e}, ignoring")
+
+    # Vocal-activity gating and silence trimming
+    vad_gating = True if '--vad' in sys.argv else None
+    auto_trim = '--auto-trim' in sys.argv
+    if vad_gating:
+        print(f"🔎 Separation limited to regions with vocal activity")
+
     # Check for trim start time
     trim_start = 0
     for arg in sys.argv:
@@ -521,8 +1238,15 @@ def main():
 
     # Check for pitch adjustment
     pitch_shift = 0
+    pitch_ladder = []  # Several keys at once (--pitch=-4..4 or --pitch=-2,2)
     for arg in sys.argv:
-        if arg.startswith('--pitch='):
+        if arg.startswith('--pitch=') and ('..' in arg or ',' in arg):
+            try:
+                pitch_ladder = parse_pitch_values(arg.split('=')[1])
+                print(f"🎵 Will render {len(pitch_ladder)} pitch variants: {', '.join(f'{v:+d}' for v in pitch_ladder)}")
+            except ValueError:
+                print(f"⚠️  Invalid pitch range, ignoring")
+        elif arg.startswith('--pitch='):
             try:
                 pitch_shift = int(arg.split('=')[1])
                 if abs(pitch_shift) > 12:
@@ -533,6 +1257,54 @@ def main():
             except:
                 print(f"⚠️  Invalid pitch value, ignoring")
     
+    # BATCH MODE: many songs through a pool of worker processes
+    if '--batch' in sys.argv:
+        from batch import collect_sources, run_batch, DEFAULT_REPORT
+
+        sources = collect_sources([arg for arg in sys.argv[1:] if not arg.startswith('--')])
+        if not sources:
+            print(f"❌ No songs given for batch mode")
+            sys.exit(1)
+        if not karaoke_mode and pitch_shift == 0 and not pitch_ladder:
+            print(f"\n⚠️  Batch mode needs --karaoke and/or --pitch")
+            sys.exit(1)
+
+        workers = None
+        report_path = DEFAULT_REPORT
+        for arg in sys.argv:
+            if arg.startswith('--workers='):
+                try:
+                    workers = max(1, int(arg.split('=')[1]))
+                except ValueError:
+                    print(f"⚠️  Invalid workers value, ignoring")
+            elif arg.startswith('--report='):
+                report_path = arg.split('=', 1)[1]
+
+        report = run_batch(
+            sources, workers=workers, report_path=report_path,
+            trim_start=trim_start, trim_end=trim_end,
+            karaoke=karaoke_mode, pitch=pitch_shift, pitch_ladder=pitch_ladder,
+            parallel=parallel_separation, fused=fused_pipeline, intermediate=intermediate_format,
+            quality=quality, deadline=deadline, vad=vad_gating,
+            auto_trim=auto_trim, keep_stages=keep_stages
+        )
+        sys.exit(1 if report['failed'] else 0)
+
+    # Get URL/file path and remove any backslash escapes
+    input_source = sys.argv[1].replace('\\', '')
+    
+    # Check if input is a local file or YouTube URL
+    is_local_file = os.path.isfile(input_source)
+    
+    if is_local_file:
+        print(f"📂 Local file mode: {input_source}")
+    else:
+        print(f"🌐 YouTube mode: {input_source}")
+    
+    # Temp downloads and separation folders of this run, removed however it ends
+    reap_stale_workspaces()
+    space = Workspace('cli', quota_gb=0)
+
     try:
         # LOCAL FILE MODE
         if is_local_file:
@@ -541,24 +1313,46 @@ def main():
             # Verify it's an audio file
             if not input_source.lower().endswith(('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg')):
                 print(f"⚠️  Warning: File doesn't have a common audio extension")
+
+            if auto_trim:
+                # The original stays untouched; results are named after the trimmed copy
+                base, ext = os.path.splitext(input_source)
+                cut_start, cut_end = trim_silence(input_source, f"{base}_trimmed{ext}", space.path)
+                if cut_start or cut_end:
+                    input_source = f"{base}_trimmed{ext}"
+                    print(f"✂️  Auto-trim: cut {cut_start:.1f}s of leading and {cut_end:.1f}s of trailing silence")
+                    print(f"   Using: {input_source}")
+                else:
+                    print(f"✂️  Auto-trim: no silence to cut")
             
             if karaoke_mode:
                 # Create karaoke from local file
                 print(f"\n🎤 Creating karaoke from local file...")
-                karaoke_output = create_demucs_karaoke(input_source, mode='professional')
-                
-                # Apply pitch adjustment if requested
-                if pitch_shift != 0:
-                    karaoke_output = adjust_pitch(karaoke_output, pitch_shift)
+                # Pitch adjustment (if requested) is applied as the last pipeline step
+                karaoke_output = create_demucs_karaoke(
+                    input_source, mode='professional', parallel=parallel_separation,
+                    pitch=pitch_shift, fused=fused_pipeline, keep_stages=keep_stages,
+                    intermediate=intermediate_format, work_dir=space.path,
+                    quality=quality, deadline=deadline, vad=vad_gating
+                )
                 
                 print(f"\n✅ Karaoke creation complete!")
                 print(f"📁 Output: {karaoke_output}")
                 
-                # Cleanup
-                for cleanup_dir in ['separated', 'mdx_separated']:
-                    if os.path.exists(cleanup_dir):
-                        shutil.rmtree(cleanup_dir)
+                if pitch_ladder:
+                    print(f"\n🎵 Rendering pitch variants...")
+                    for semitones, variant in adjust_pitch_ladder(karaoke_output, pitch_ladder).items():
+                        print(f"📁 {semitones:+d}: {variant}")
+                
+            elif pitch_ladder:
+                # Render every requested key from a single decode
+                print(f"\n🎵 Rendering pitch variants of existing file...")
+                variants = adjust_pitch_ladder(input_source, pitch_ladder)
                 
+                print(f"\n✅ Pitch adjustment complete!")
+                print(f"📁 Original: {input_source}")
+                for semitones, variant in variants.items():
+                    print(f"📁 {semitones:+d}: {variant}")
             elif pitch_shift != 0:
                 # Just apply pitch adjustment to existing file
                 print(f"\n🎵 Adjusting pitch of existing file...")
@@ -602,94 +1396,88 @@ def main():
             print(f"   • Codec: {audio_stream.audio_codec}")
             print(f"   • File type: {audio_stream.mime_type}")
             print(f"   • Will convert to: 320kbps MP3 @ 48kHz (maximum quality)")
-            print(f"\nDownloading audio stream...")
-            
-            audio_file = audio_stream.download(filename='temp_audio.mp4')
-
-            # Trim if requested
+            mp3_filename = f"{yt.title}.mp3".replace('/', '-').replace('\\', '-')
             if trim_start > 0 or trim_end > 0:
                 trim_msg = []
                 if trim_start > 0:
                     trim_msg.append(f"first {trim_start} seconds")
                 if trim_end > 0:
                     trim_msg.append(f"last {trim_end} seconds")
-                print(f"\n✂️  Trimming {' and '.join(trim_msg)}...")
-
-                trimmed_file = 'temp_audio_trimmed.mp4'
-                ffmpeg_cmd = ['ffmpeg', '-y']
-
-                # Add trim-start if specified
-                if trim_start > 0:
-                    ffmpeg_cmd.extend(['-ss', str(trim_start)])
-
-                ffmpeg_cmd.extend(['-i', audio_file])
-
-                # Add trim-end if specified (need to calculate duration)
-                if trim_end > 0:
-                    duration = get_audio_duration(audio_file)
-                    target_duration = duration - trim_start - trim_end
-                    if target_duration <= 0:
-                        print(f"⚠️  Error: Trim settings would result in zero or negative duration!")
-                        print(f"   Audio duration: {duration:.1f}s, trim-start: {trim_start}s, trim-end: {trim_end}s")
-                        sys.exit(1)
-                    ffmpeg_cmd.extend(['-t', str(target_duration)])
-
-                ffmpeg_cmd.extend(['-c', 'copy', trimmed_file])
-
-                subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-                os.remove(audio_file)
-                audio_file = trimmed_file
-            
-            # Convert to high-quality MP3
-            mp3_filename = f"{yt.title}.mp3".replace('/', '-').replace('\\', '-')
-            print(f"\nConverting to MP3...")
-            
-            convert_command = [
-                'ffmpeg',
-                '-i', audio_file,
-                '-vn',  # No video
-                '-ab', '320k',  # High quality bitrate
-                '-ar', '48000',  # Sample rate
-                '-y',
-                mp3_filename
-            ]
+                print(f"✂️  Will trim {' and '.join(trim_msg)} while converting")
+            print(f"\nStreaming audio into FFmpeg (download, trim and MP3 conversion in one pass)...")
             
-            result = subprocess.run(convert_command, capture_output=True, text=True)
+            duration = stream_duration(audio_stream, yt.length)
+            conversion_error = None
+            try:
+                try:
+                    ingest_stream(audio_stream, mp3_filename, trim_start, trim_end, duration)
+                except JobCancelled:
+                    raise
+                except RuntimeError:
+                    # Some containers can't be decoded from a pipe (index at the end of the file)
+                    print(f"⚠️  Streaming ingest not possible for this stream, downloading first...")
+                    remove_partial([mp3_filename])
+                    audio_file = audio_stream.download(output_path=space.path, filename='temp_audio.mp4')
+                    try:
+                        convert_audio(audio_file, mp3_filename, trim_start, trim_end, duration)
+                    finally:
+                        os.remove(audio_file)
+            except ValueError as e:
+                print(f"⚠️  Error: {e}")
+                print(f"   trim-start: {trim_start}s, trim-end: {trim_end}s")
+                sys.exit(1)
+            except RuntimeError as e:
+                conversion_error = e
             
-            if result.returncode == 0:
+            if conversion_error is None:
                 print(f"\n✅ Audio extraction successful!")
                 print(f"MP3 saved as: {mp3_filename}")
-                
-                # Clean up temporary file
-                os.remove(audio_file)
+
+                if auto_trim:
+                    cut_start, cut_end = trim_silence(mp3_filename, work_dir=space.path)
+                    if cut_start or cut_end:
+                        print(f"✂️  Auto-trim: cut {cut_start:.1f}s of leading and {cut_end:.1f}s of trailing silence")
                 
                 # Create karaoke track
                 karaoke_mp3_filename = f"{yt.title}_KARAOKE.mp3".replace('/', '-').replace('\\', '-')
                 
                 # Use Demucs + MDX-Net ensemble for ULTIMATE quality
-                instrumental_file = create_demucs_karaoke(mp3_filename, mode='professional')
-                
-                # Apply pitch adjustment if requested
-                if pitch_shift != 0:
-                    instrumental_file = adjust_pitch(instrumental_file, pitch_shift)
+                # Pitch adjustment (if requested) is applied as the last pipeline step
+                instrumental_file = create_demucs_karaoke(
+                    mp3_filename, mode='professional', parallel=parallel_separation,
+                    pitch=pitch_shift, fused=fused_pipeline, keep_stages=keep_stages,
+                    intermediate=intermediate_format, work_dir=space.path,
+                    quality=quality, deadline=deadline, vad=vad_gating
+                )
                 
                 if instrumental_file:
+                    variants = {}
+                    if pitch_ladder:
+                        print(f"\n🎵 Rendering pitch variants...")
+                        for semitones, variant in adjust_pitch_ladder(instrumental_file, pitch_ladder).items():
+                            if semitones != 0:
+                                variant_filename = f"{yt.title}_KARAOKE_pitch{semitones:+d}.mp3".replace('/', '-').replace('\\', '-')
+                                shutil.move(variant, variant_filename)
+                                variants[semitones] = variant_filename
+                    
                     # Rename final output to our desired filename
                     shutil.move(instrumental_file, karaoke_mp3_filename)
                     
                     print(f"\n✅ ULTIMATE karaoke audio created!")
                     print(f"Original MP3: {mp3_filename}")
                     print(f"Karaoke MP3: {karaoke_mp3_filename}")
-                    
-                    # Cleanup separated dirs
-                    for cleanup_dir in ['separated', 'mdx_separated']:
-                        if os.path.exists(cleanup_dir):
-                            shutil.rmtree(cleanup_dir)
+                    for semitones, variant_filename in variants.items():
+                        print(f"Karaoke MP3 ({semitones:+d}): {variant_filename}")
             else:
                 print(f"\n❌ MP3 conversion failed!")
-                print(f"Error: {result.stderr}")
+                print(f"Error: {conversion_error}")
         else:
             # SCENARIO 1 & 2: Video mode (download original, optionally with pitch shift)
+            if pitch_ladder:
+                print(f"\n⚠️  Pitch ranges are supported for karaoke and local files only")
+                print(f"   Use a single value (e.g. --pitch=-2) in video mode")
+                return
+            
             if pitch_shift != 0:
                 print(f"\n🎵 Video mode with pitch adjustment")
             else:
@@ -718,72 +1506,61 @@ def main():
             print(f"   • Codec: {audio_stream.audio_codec}")
             print(f"   • File type: {audio_stream.mime_type}")
             
-            print(f"\nDownloading video stream...")
-            video_file = video_stream.download(filename='video.mp4')
-            
-            print(f"\nDownloading audio stream...")
-            audio_file = audio_stream.download(filename='audio.mp4')
-
-            # Trim if requested
-            if trim_start > 0 or trim_end > 0:
-                trim_msg = []
-                if trim_start > 0:
-                    trim_msg.append(f"first {trim_start} seconds")
-                if trim_end > 0:
-                    trim_msg.append(f"last {trim_end} seconds")
-                print(f"\n✂️  Trimming {' and '.join(trim_msg)} from audio...")
-
-                trimmed_file = 'audio_trimmed.mp4'
-                ffmpeg_cmd = ['ffmpeg', '-y']
+            duration = stream_duration(audio_stream, yt.length)
 
-                # Add trim-start if specified
-                if trim_start > 0:
-                    ffmpeg_cmd.extend(['-ss', str(trim_start)])
-
-                ffmpeg_cmd.extend(['-i', audio_file])
-
-                # Add trim-end if specified (need to calculate duration)
-                if trim_end > 0:
-                    duration = get_audio_duration(audio_file)
-                    target_duration = duration - trim_start - trim_end
-                    if target_duration <= 0:
-                        print(f"⚠️  Error: Trim settings would result in zero or negative duration!")
-                        print(f"   Audio duration: {duration:.1f}s, trim-start: {trim_start}s, trim-end: {trim_end}s")
-                        sys.exit(1)
-                    ffmpeg_cmd.extend(['-t', str(target_duration)])
+            def finish_audio(audio_file):
+                if trim_start > 0 or trim_end > 0:
+                    trim_msg = []
+                    if trim_start > 0:
+                        trim_msg.append(f"first {trim_start} seconds")
+                    if trim_end > 0:
+                        trim_msg.append(f"last {trim_end} seconds")
+                    print(f"\n✂️  Trimming {' and '.join(trim_msg)} from audio...")
 
-                ffmpeg_cmd.extend(['-c', 'copy', trimmed_file])
+                try:
+                    # Apply pitch adjustment to audio if requested (SCENARIO 2)
+                    if pitch_shift != 0:
+                        print(f"\n🎵 Applying pitch adjustment to audio...")
+                        # Trim and extract audio to MP3 in one pass
+                        temp_audio_mp3 = space.file("temp_audio_for_pitch.mp3")
+                        convert_audio(audio_file, temp_audio_mp3, trim_start, trim_end, duration, sample_rate=None)
+                        
+                        # Apply pitch shift (the temp file is gone after this run, so it is not cached)
+                        pitched_audio = adjust_pitch(temp_audio_mp3, pitch_shift, cache=False)
+                        
+                        # Convert back to format suitable for merging
+                        os.remove(audio_file)
+                        result = run_process([
+                            'ffmpeg', '-y', '-i', pitched_audio, '-c:a', 'aac', '-b:a', '320k', audio_file
+                        ], partial=[audio_file], capture_output=True, text=True)
+                        if result.returncode != 0:
+                            raise RuntimeError(f"Failed to encode pitch-shifted audio: {result.stderr}")
+                        
+                        # Cleanup temp files
+                        os.remove(temp_audio_mp3)
+                        os.remove(pitched_audio)
+                    elif trim_start > 0 or trim_end > 0:
+                        # Re-encoded rather than stream-copied, so the cut lands on the exact sample
+                        trimmed_file = convert_audio(audio_file, space.file('audio_trimmed.mp4'), trim_start, trim_end, duration, sample_rate=None)
+                        os.remove(audio_file)
+                        audio_file = trimmed_file
+                except ValueError as e:
+                    print(f"⚠️  Error: {e}")
+                    print(f"   trim-start: {trim_start}s, trim-end: {trim_end}s")
+                    sys.exit(1)
+                return audio_file
 
-                subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-                os.remove(audio_file)
-                audio_file = trimmed_file
+            # Audio is trimmed / pitch-shifted while the (larger) video is still downloading
+            print(f"\nDownloading video and audio streams...")
+            video_file, audio_file = download_video_and_audio(
+                video_stream, audio_stream, finish_audio,
+                video_filename=space.file('video.mp4'), audio_filename=space.file('audio.mp4')
+            )
             
             print(f"\nDownload completed successfully!")
             print(f"Video file: {video_file}")
             print(f"Audio file: {audio_file}")
             
-            # Apply pitch adjustment to audio if requested (SCENARIO 2)
-            if pitch_shift != 0:
-                print(f"\n🎵 Applying pitch adjustment to audio...")
-                # Extract audio to MP3 first
-                temp_audio_mp3 = "temp_audio_for_pitch.mp3"
-                subprocess.run([
-                    'ffmpeg', '-y', '-i', audio_file, '-vn', '-ab', '320k', temp_audio_mp3
-                ], capture_output=True, text=True)
-                
-                # Apply pitch shift
-                pitched_audio = adjust_pitch(temp_audio_mp3, pitch_shift)
-                
-                # Convert back to format suitable for merging
-                os.remove(audio_file)
-                subprocess.run([
-                    'ffmpeg', '-y', '-i', pitched_audio, '-c:a', 'aac', '-b:a', '320k', audio_file
-                ], capture_output=True, text=True)
-                
-                # Cleanup temp files
-                os.remove(temp_audio_mp3)
-                os.remove(pitched_audio)
-            
             # Merge video and audio using ffmpeg
             output_filename = f"{yt.title}.mp4".replace('/', '-').replace('\\', '-')
             if pitch_shift != 0:
@@ -827,10 +1604,15 @@ def main():
             else:
                 print(f"\n❌ Merge failed!")
                 print(f"Error: {result.stderr}")
-                print(f"Video and audio files are still available separately.")
+                # Keep the downloads out of the workspace, which is about to be removed
+                video_file = shutil.move(video_file, os.path.basename(video_file))
+                audio_file = shutil.move(audio_file, os.path.basename(audio_file))
+                print(f"Video and audio files are still available separately: {video_file}, {audio_file}")
         
     except Exception as e:
         print(f"Error: {e}")
+    finally:
+        space.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,345 @@
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+
+# Catalog of everything learned about the audio we have processed. Lives next to the
+# stem cache (KARAOKE_CACHE_DIR) so both survive restarts and are shared by all processes.
+INDEX_FILENAME = 'media_index.sqlite'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    codec TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_hash ON files (content_hash);
+
+CREATE TABLE IF NOT EXISTS media (
+    content_hash TEXT PRIMARY KEY,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    codec TEXT,
+    loudness REAL,
+    updated REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS outputs (
+    content_hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (content_hash, name)
+);
+
+CREATE TABLE IF NOT EXISTS stem_entries (
+    key TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stem_entries_by_use ON stem_entries (last_used);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    file_hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS blobs_by_path ON blobs (path);
+
+CREATE TABLE IF NOT EXISTS fingerprints (
+    content_hash TEXT PRIMARY KEY,
+    codes BLOB NOT NULL,
+    created REAL NOT NULL
+);
+'''
+
+MEDIA_FIELDS = ('duration', 'sample_rate', 'channels', 'codec', 'loudness')
+
+
+class MediaIndex:
+    """
+    SQLite catalog keyed by content hash.
+
+    Stores per-file probe results (so a file is probed/hashed once, not once per
+    run), hashes of uploaded file bytes, per-song audio properties, the outputs
+    already produced for a song, audio fingerprints, and the size and last use
+    of every stem-cache entry.
+    All lookups are primary-key queries, so they stay O(1) however many songs
+    the cache holds.
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            from stem_cache import DEFAULT_CACHE_DIR
+            cache_dir = os.environ.get('KARAOKE_CACHE_DIR', DEFAULT_CACHE_DIR)
+            path = os.path.join(cache_dir, INDEX_FILENAME)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        # Several job/batch processes share the file; WAL lets readers run alongside a writer
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            self._db.execute(sql, params)
+
+    # Files: what we know about a path, valid while its size and mtime are unchanged
+
+    def lookup_file(self, path: str):
+        """
+        Return the recorded info for a file, or None if unknown or changed since.
+
+        Returns:
+            Dict with content_hash, duration, sample_rate, channels, codec (any may be None)
+        """
+        stat = os.stat(path)
+        rows = self._query(
+            'SELECT * FROM files WHERE path = ? AND size = ? AND mtime_ns = ?',
+            (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        )
+        return dict(rows[0]) if rows else None
+
+    def record_file(self, path: str, **fields):
+        """Remember facts about a file (content_hash, duration, sample_rate, channels, codec)."""
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        known = self.lookup_file(path) or {}
+        row = {
+            name: fields.get(name, known.get(name))
+            for name in ('content_hash', 'duration', 'sample_rate', 'channels', 'codec')
+        }
+        self._execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash, duration, sample_rate, channels, codec) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns, *row.values())
+        )
+        if row['content_hash']:
+            self._execute(
+                'UPDATE blobs SET content_hash = ? WHERE path = ? AND content_hash IS NULL',
+                (row['content_hash'], path)
+            )
+            self.record_media(row['content_hash'], **{
+                name: value for name, value in row.items() if name != 'content_hash' and value is not None
+            })
+
+    # Blobs: SHA-256 of uploaded file bytes, so a re-upload is recognised before any decode
+
+    def blob(self, file_hash: str):
+        """Content hash of the audio in a file with these exact bytes, or None if never hashed."""
+        rows = self._query('SELECT content_hash FROM blobs WHERE file_hash = ?', (file_hash,))
+        return rows[0]['content_hash'] if rows else None
+
+    def record_blob(self, file_hash: str, path: str):
+        """Remember which file holds these bytes; its content hash is filled in once it is hashed."""
+        path = os.path.abspath(path)
+        self._execute('INSERT OR IGNORE INTO blobs (file_hash, path) VALUES (?, ?)', (file_hash, path))
+        self._execute('UPDATE blobs SET path = ? WHERE file_hash = ?', (path, file_hash))
+
+    # Media: properties of a song, whatever file it came from
+
+    def media(self, content_hash: str):
+        rows = self._query('SELECT * FROM media WHERE content_hash = ?', (content_hash,))
+        return dict(rows[0]) if rows else None
+
+    def record_media(self, content_hash: str, **fields):
+        """Store or update song properties (duration, sample_rate, channels, codec, loudness)."""
+        fields = {name: value for name, value in fields.items() if name in MEDIA_FIELDS}
+        known = self.media(content_hash) or {}
+        row = [fields.get(name, known.get(name)) for name in MEDIA_FIELDS]
+        self._execute(
+            f'INSERT OR REPLACE INTO media (content_hash, {", ".join(MEDIA_FIELDS)}, updated) '
+            f'VALUES (?, {", ".join("?" * len(MEDIA_FIELDS))}, ?)',
+            (content_hash, *row, time.time())
+        )
+
+    # Outputs: stems and derived files already produced for a song
+
+    def output(self, content_hash: str, name: str):
+        """
+        Path of a previously produced output, or None if it was never made or is gone.
+
+        Args:
+            content_hash: Hash of the source audio
+            name: Output name (e.g. 'mdx_instrumental.wav', 'final')
+        """
+        rows = self._query('SELECT path FROM outputs WHERE content_hash = ? AND name = ?', (content_hash, name))
+        if not rows:
+            return None
+        path = rows[0]['path']
+        if not os.path.exists(path):
+            self._execute('DELETE FROM outputs WHERE content_hash = ? AND name = ?', (content_hash, name))
+            return None
+        return path
+
+    def outputs(self, content_hash: str) -> dict:
+        """All recorded outputs of a song that still exist, as {name: path}."""
+        rows = self._query('SELECT name, path FROM outputs WHERE content_hash = ?', (content_hash,))
+        return {row['name']: row['path'] for row in rows if os.path.exists(row['path'])}
+
+    def record_output(self, content_hash: str, name: str, path: str):
+        self._execute(
+            'INSERT OR REPLACE INTO outputs (content_hash, name, path, created) VALUES (?, ?, ?, ?)',
+            (content_hash, name, os.path.abspath(path), time.time())
+        )
+
+    # Stem cache entries: sizes and LRU order without walking the cache directory
+
+    def stem_entry_count(self) -> int:
+        return self._query('SELECT COUNT(*) AS n FROM stem_entries')[0]['n']
+
+    def stem_bytes(self) -> int:
+        return self._query('SELECT COALESCE(SUM(bytes), 0) AS total FROM stem_entries')[0]['total']
+
+    def stem_entries(self) -> list:
+        """All stem-cache entries as (key, bytes), least recently used first."""
+        rows = self._query('SELECT key, bytes FROM stem_entries ORDER BY last_used')
+        return [(row['key'], row['bytes']) for row in rows]
+
+    def record_stem_entry(self, key: str, size: int, last_used: float = None):
+        self._execute(
+            'INSERT OR REPLACE INTO stem_entries (key, bytes, last_used) VALUES (?, ?, ?)',
+            (key, size, last_used or time.time())
+        )
+
+    def touch_stem_entry(self, key: str):
+        self._execute('UPDATE stem_entries SET last_used = ? WHERE key = ?', (time.time(), key))
+
+    def remove_stem_entry(self, key: str):
+        self._execute('DELETE FROM stem_entries WHERE key = ?', (key,))
+
+    # Fingerprints: chroma codes per song, loaded into fingerprint.FingerprintIndex
+
+    def record_fingerprint(self, content_hash: str, codes: bytes):
+        self._execute(
+            'INSERT OR REPLACE INTO fingerprints (content_hash, codes, created) VALUES (?, ?, ?)',
+            (content_hash, codes, time.time())
+        )
+
+    def fingerprints(self) -> list:
+        """All stored fingerprints as (content_hash, codes blob)."""
+        rows = self._query('SELECT content_hash, codes FROM fingerprints')
+        return [(row['content_hash'], row['codes']) for row in rows]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_media_index() -> MediaIndex:
+    """Return the process-wide media index."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = MediaIndex()
+        return _index
+
+
+def probe_media(audio_file: str) -> dict:
+    """
+    Read duration, sample rate, channel count and codec of a file with a single FFprobe call.
+
+    Returns:
+        Dict with duration, sample_rate, channels and codec
+    """
+    result = subprocess.run(
+        [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'a:0',
+            '-show_entries', 'format=duration:stream=sample_rate,channels,codec_name',
+            '-of', 'json',
+            audio_file
+        ],
+        capture_output=True,
+        text=True
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to probe audio: {result.stderr}")
+
+    data = json.loads(result.stdout)
+    stream = (data.get('streams') or [{}])[0]
+    return {
+        'duration': float(data['format']['duration']),
+        'sample_rate': int(stream['sample_rate']) if stream.get('sample_rate') else None,
+        'channels': stream.get('channels'),
+        'codec': stream.get('codec_name'),
+    }
+
+
+def media_info(audio_file: str) -> dict:
+    """
+    Audio properties of a file: from the index if it was seen before, otherwise
+    probed once and recorded.
+
+    Returns:
+        Dict with duration, sample_rate, channels, codec and content_hash (None until hashed)
+    """
+    index = get_media_index()
+    known = index.lookup_file(audio_file)
+    if known and known.get('duration') is not None:
+        return known
+
+    info = probe_media(audio_file)
+    index.record_file(audio_file, **info)
+    return index.lookup_file(audio_file) or info
+
+
+def parse_loudness(log: str):
+    """Integrated loudness (LUFS) from the log of FFmpeg's ebur128 filter, or None."""
+    # The summary at the end of the log holds the integrated value: "I: -14.2 LUFS"
+    loudness = None
+    for line in log.splitlines():
+        line = line.strip()
+        if line.startswith('I:') and line.endswith('LUFS'):
+            loudness = float(line[2:-4])
+    return loudness
+
+
+def measure_loudness(audio_file: str) -> float:
+    """
+    Integrated loudness (LUFS, EBU R128) of a song, measured once per content hash.
+
+    Songs are normally measured while they are hashed (see
+    stem_cache.audio_content_hash); this runs its own pass only for songs hashed
+    before that.
+    """
+    from stem_cache import audio_content_hash
+
+    index = get_media_index()
+    content_hash = audio_content_hash(audio_file)
+    known = index.media(content_hash)
+    if known and known.get('loudness') is not None:
+        return known['loudness']
+
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-nostats', '-i', audio_file, '-vn', '-af', 'ebur128', '-f', 'null', '-'],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to measure loudness: {result.stderr}")
+
+    loudness = parse_loudness(result.stderr)
+    if loudness is None:
+        raise RuntimeError("Loudness measurement produced no result")
+
+    index.record_media(content_hash, loudness=loudness)
+    return loudness
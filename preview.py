@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+
+from cancellation import run_process
+
+# A short excerpt is processed as soon as a job is submitted, so the user hears
+# within seconds whether the song works before the full job finishes.
+PREVIEW_SECONDS = float(os.environ.get('KARAOKE_PREVIEW_SECONDS', 30))
+
+# 'filter': FFmpeg centre-channel cancellation (instant, rough)
+# 'demucs': basic Demucs on the excerpt only (a few seconds, same model as the full job)
+PREVIEW_METHOD = os.environ.get('KARAOKE_PREVIEW_METHOD', 'filter')
+PREVIEW_METHODS = ('filter', 'demucs')
+
+# Without a detected vocal region, the excerpt starts this far into the track
+FALLBACK_POSITION = 0.25
+
+# Previews run in the web app process: only this much of the track is analysed for
+# vocals, and a Demucs preview leases this many CPU threads
+ANALYSIS_SECONDS = PREVIEW_SECONDS
+PREVIEW_THREADS = 2
+
+
+def excerpt_start(duration: float, trim_start: float = 0, trim_end: float = 0,
+                  seconds: float = PREVIEW_SECONDS, regions: list = None) -> float:
+    """
+    Where the excerpt should start: at the first vocals inside the trimmed track,
+    so the preview shows whether they are removed, not an instrumental intro.
+
+    Args:
+        duration: Track length in seconds
+        trim_start: Seconds the full job cuts from the start
+        trim_end: Seconds the full job cuts from the end
+        seconds: Excerpt length
+        regions: Vocal regions from vad.analyze() (None = not analysed)
+    """
+    end = max(trim_start, duration - trim_end)
+    start = None
+    for region_start, region_end in regions or []:
+        if region_end > trim_start and region_start < end:
+            start = max(region_start, trim_start)
+            break
+    if start is None:
+        start = trim_start + (end - trim_start) * FALLBACK_POSITION
+    return max(trim_start, min(start, end - seconds))
+
+
+def render_preview(source: str, output_path: str, karaoke: bool = True, pitch: int = 0,
+                   start: float = 0, seconds: float = PREVIEW_SECONDS, method: str = None) -> str:
+    """
+    Render the preview of a job: a short excerpt with the job's karaoke and pitch settings.
+
+    Args:
+        source: Audio file or stream URL (FFmpeg seeks without reading the whole input)
+        output_path: Preview MP3 to write
+        karaoke: Remove vocals
+        pitch: Pitch shift in semitones (0 = none)
+        start: Excerpt start in seconds
+        seconds: Excerpt length
+        method: 'filter' or 'demucs' (None = KARAOKE_PREVIEW_METHOD)
+
+    Returns:
+        output_path
+    """
+    from main import CENTER_CANCEL_FILTER, pitch_filter, run_demucs, SEPARATOR_BACKEND
+
+    method = method or PREVIEW_METHOD
+    if method not in PREVIEW_METHODS:
+        raise ValueError(f"Unknown preview method '{method}' (expected one of {', '.join(PREVIEW_METHODS)})")
+    excerpt = ['-ss', f'{start:.3f}', '-t', f'{seconds:.3f}', '-i', source, '-vn']
+
+    temp_dir = tempfile.mkdtemp(prefix='preview_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        filters = []
+        if karaoke and method == 'demucs':
+            excerpt_path = os.path.join(temp_dir, 'excerpt.wav')
+            result = run_process(
+                ['ffmpeg', '-y', '-v', 'error', *excerpt, '-c:a', 'pcm_f32le', excerpt_path],
+                partial=[excerpt_path], capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                raise RuntimeError(f"Preview excerpt failed: {result.stderr}")
+            # The model runs in a separator worker process, never in the app process itself
+            no_vocals = run_demucs(
+                excerpt_path, 'htdemucs', os.path.join(temp_dir, 'separated', 'htdemucs', 'excerpt'),
+                threads=PREVIEW_THREADS, ext='wav', timeout=300, chunk_seconds=0
+            )
+            if SEPARATOR_BACKEND != 'cli':
+                # Nor is a model kept resident beside the web server once the preview is done
+                from separator_pool import get_separator_pool, DEMUCS
+                get_separator_pool().retire(DEMUCS, 'htdemucs', keep=0)
+            excerpt = ['-i', no_vocals]
+        elif karaoke:
+            filters.append(CENTER_CANCEL_FILTER)
+        if pitch != 0:
+            filters.append(pitch_filter(pitch))
+
+        command = ['ffmpeg', '-y', '-v', 'error', *excerpt]
+        if filters:
+            command.extend(['-af', ','.join(filters)])
+        command.extend(['-b:a', '192k', output_path])
+        result = run_process(command, partial=[output_path], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Preview failed: {result.stderr}")
+        return output_path
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,195 @@
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from scheduler import stage_limit
+
+# Professional-mode quality tiers, best first. Each Demucs shift is a full extra
+# pass over the track, and the MDX-Net ensemble is a second model on top.
+QUALITY_TIERS = {
+    'studio': {'model': 'htdemucs_6s', 'shifts': 10, 'overlap': 0.25, 'ensemble': True},
+    'high': {'model': 'htdemucs_6s', 'shifts': 5, 'overlap': 0.25, 'ensemble': True},
+    'balanced': {'model': 'htdemucs_6s', 'shifts': 2, 'overlap': 0.25, 'ensemble': True},
+    'fast': {'model': 'htdemucs_6s', 'shifts': 1, 'overlap': 0.25, 'ensemble': False},
+    'draft': {'model': 'htdemucs', 'shifts': 1, 'overlap': 0.1, 'ensemble': False},
+}
+DEFAULT_QUALITY = 'studio'
+
+# Measured separation speed on this host, as CPU-thread seconds per second of audio
+# for one pass at the default overlap (0.25)
+THROUGHPUT_FILE = os.path.join(
+    os.environ.get('KARAOKE_CACHE_DIR', os.path.expanduser('~/.cache/ai-karaoke-maker')), 'throughput.json'
+)
+
+# Used until a model has been measured here (a 4 minute song in professional mode
+# takes ~45-55 minutes on an M1 Max)
+DEFAULT_THREAD_SECONDS = {
+    'htdemucs': 2.5,
+    'htdemucs_6s': 4.0,
+    'mdx': 35.0,
+}
+
+# Ensemble blend, post-processing and encode, in seconds per second of audio
+POST_SECONDS_PER_SECOND = 0.05
+
+# Weight of a new measurement in the running average
+THROUGHPUT_SMOOTHING = 0.3
+
+# Short runs (previews, short vocal regions) are dominated by model load and
+# start-up: runs under MIN_SAMPLE_SECONDS of audio are not recorded, and shorter
+# runs than FULL_WEIGHT_SECONDS count for proportionally less
+MIN_SAMPLE_SECONDS = 60
+FULL_WEIGHT_SECONDS = 240
+
+_lock = threading.Lock()
+
+
+def _load_throughput() -> dict:
+    try:
+        with open(THROUGHPUT_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def thread_seconds(model: str) -> float:
+    """CPU-thread seconds one pass of model needs per second of audio on this host."""
+    measured = _load_throughput().get(model)
+    if measured:
+        return measured['thread_seconds']
+    return DEFAULT_THREAD_SECONDS.get(model, DEFAULT_THREAD_SECONDS['htdemucs_6s'])
+
+
+def record_throughput(model: str, audio_seconds: float, elapsed: float, threads: int,
+                      passes: float = 1):
+    """
+    Fold one separation run into the measured throughput of model, weighted by
+    the length of the audio it separated.
+
+    Args:
+        model: Model name ('mdx' for the MDX-Net model)
+        audio_seconds: Length of the separated audio
+        elapsed: Wall-clock seconds the separation took
+        threads: CPU threads it ran with
+        passes: Passes over the audio at the default overlap (shifts, overlap)
+    """
+    if audio_seconds < MIN_SAMPLE_SECONDS or elapsed <= 0 or passes <= 0:
+        return
+    sample = elapsed * threads / (audio_seconds * passes)
+    weight = THROUGHPUT_SMOOTHING * min(1.0, audio_seconds / FULL_WEIGHT_SECONDS)
+    with _lock:
+        throughput = _load_throughput()
+        previous = throughput.get(model)
+        if previous:
+            sample = previous['thread_seconds'] + weight * (sample - previous['thread_seconds'])
+        throughput[model] = {'thread_seconds': round(sample, 4), 'runs': (previous or {}).get('runs', 0) + 1}
+        os.makedirs(os.path.dirname(THROUGHPUT_FILE), exist_ok=True)
+        with open(THROUGHPUT_FILE + '.tmp', 'w') as f:
+            json.dump(throughput, f, indent=2)
+        os.replace(THROUGHPUT_FILE + '.tmp', THROUGHPUT_FILE)
+
+
+def demucs_passes(shifts: int, overlap: float) -> float:
+    """Work of a Demucs run relative to one pass at the default overlap."""
+    return max(1, shifts) * 0.75 / (1 - overlap)
+
+
+def estimate_seconds(tier: dict, duration: float, threads: int = None, parallel: bool = True) -> float:
+    """
+    Predicted wall-clock time of the professional pipeline for one track.
+
+    Args:
+        tier: Entry of QUALITY_TIERS
+        duration: Track length in seconds
+        threads: CPU threads available to the run (None = scheduler.stage_limit())
+        parallel: Demucs and MDX-Net run side by side, sharing the threads
+    """
+    threads = threads or stage_limit()
+    demucs = thread_seconds(tier['model']) * demucs_passes(tier['shifts'], tier['overlap']) * duration
+    post = POST_SECONDS_PER_SECOND * duration
+    if not tier['ensemble']:
+        return demucs / threads + post
+
+    mdx = thread_seconds('mdx') * duration
+    if parallel and threads > 1:
+        half = threads / 2
+        return max(demucs, mdx) / half + post
+    return (demucs + mdx) / threads + post
+
+
+def plan_quality(duration: float, quality: str = None, deadline: float = None,
+                 threads: int = None, parallel: bool = True) -> dict:
+    """
+    Choose the separation settings for a professional-mode run.
+
+    With a deadline, the best tier (no better than `quality`) whose estimate fits
+    the remaining time is chosen; if none fits, the cheapest tier is used.
+
+    Args:
+        duration: Track length in seconds
+        quality: Tier name, the best quality allowed (None = DEFAULT_QUALITY)
+        deadline: Epoch time the result is needed by (None = no deadline)
+        threads: CPU threads available to the run (None = scheduler.stage_limit())
+        parallel: Demucs and MDX-Net run side by side
+
+    Returns:
+        Copy of the chosen tier with 'quality' (tier name), 'estimate' (seconds)
+        and 'fits' (False if even the cheapest tier misses the deadline)
+
+    Raises:
+        ValueError: If quality is not a known tier
+    """
+    quality = quality or DEFAULT_QUALITY
+    if quality not in QUALITY_TIERS:
+        raise ValueError(f"Unknown quality '{quality}' (expected one of {', '.join(QUALITY_TIERS)})")
+
+    names = list(QUALITY_TIERS)
+    candidates = names[names.index(quality):]
+    remaining = None if deadline is None else deadline - time.time()
+
+    for name in candidates:
+        estimate = estimate_seconds(QUALITY_TIERS[name], duration, threads, parallel)
+        if remaining is None or estimate <= remaining or name == candidates[-1]:
+            return {
+                **QUALITY_TIERS[name],
+                'quality': name,
+                'estimate': estimate,
+                'fits': remaining is None or estimate <= remaining,
+            }
+
+
+def parse_deadline(value: str, now: float = None) -> float:
+    """
+    Parse a --deadline value into an epoch time.
+
+    Accepts a duration ('90s', '25m', '1h30m', or plain minutes like '25') or a
+    clock time ('19:30', the next time that clock time comes round).
+
+    Raises:
+        ValueError: If the value is not understood
+    """
+    now = time.time() if now is None else now
+    value = value.strip().lower()
+
+    clock = re.fullmatch(r'(\d{1,2}):(\d{2})', value)
+    if clock:
+        hour, minute = int(clock.group(1)), int(clock.group(2))
+        if hour > 23 or minute > 59:
+            raise ValueError(f"Invalid clock time '{value}'")
+        start = datetime.fromtimestamp(now)
+        target = start.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if target <= start:
+            target += timedelta(days=1)
+        return target.timestamp()
+
+    if re.fullmatch(r'\d+(\.\d+)?', value):
+        return now + float(value) * 60
+
+    parts = re.findall(r'(\d+(?:\.\d+)?)([hms])', value)
+    if not parts or ''.join(number + unit for number, unit in parts) != value:
+        raise ValueError(f"Invalid deadline '{value}' (use e.g. 25m, 1h30m or 19:30)")
+    seconds = {'h': 3600, 'm': 60, 's': 1}
+    return now + sum(float(number) * seconds[unit] for number, unit in parts)
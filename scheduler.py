@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from cancellation import check_cancelled
+from stages import annotate
+
+try:
+    import fcntl
+except ImportError:  # Windows: leases are only coordinated within one process
+    fcntl = None
+
+# CPU threads handed out across every pipeline process on this host. Each separation
+# or FFmpeg stage leases a share before it starts, so concurrent runs never ask the
+# OS for more threads than there are cores.
+LEASE_FILE = os.path.join(
+    os.environ.get('KARAOKE_CACHE_DIR', os.path.expanduser('~/.cache/ai-karaoke-maker')), 'cpu_leases.json'
+)
+
+# Threads an FFmpeg stage asks for (decoding and filtergraph threads)
+FFMPEG_STAGE_THREADS = int(os.environ.get('KARAOKE_FFMPEG_THREADS', 2))
+
+# How often a stage waiting for cores checks again
+LEASE_POLL_INTERVAL = 0.5
+
+_local_lock = threading.Lock()
+_stage_limit = None
+
+
+def total_cores() -> int:
+    """CPU cores pipelines may use on this host (KARAOKE_CPU_CORES overrides)."""
+    if os.environ.get('KARAOKE_CPU_CORES'):
+        return max(1, int(os.environ['KARAOKE_CPU_CORES']))
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory_gb():
+    """Free physical memory in GB, or None where the OS does not report it."""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def set_stage_limit(threads: int):
+    """Cap the threads any single stage of this process asks for (e.g. cores / job workers)."""
+    global _stage_limit
+    _stage_limit = max(1, int(threads))
+
+
+def stage_limit() -> int:
+    """Threads one stage of this process asks for by default."""
+    return min(_stage_limit or total_cores(), total_cores())
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _ledger():
+    """Lock the lease file and yield its leases; changes are written back on exit."""
+    os.makedirs(os.path.dirname(LEASE_FILE), exist_ok=True)
+    with _local_lock, open(LEASE_FILE + '.lock', 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(LEASE_FILE) as f:
+                    leases = json.load(f)
+            except (OSError, ValueError):
+                leases = {}
+            # Leases of processes that died without releasing them
+            leases = {key: lease for key, lease in leases.items() if _pid_alive(lease['pid'])}
+            yield leases
+            with open(LEASE_FILE + '.tmp', 'w') as f:
+                json.dump(leases, f)
+            os.replace(LEASE_FILE + '.tmp', LEASE_FILE)
+        finally:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def leased_threads(exclude_pids=()) -> int:
+    """Threads currently leased by all pipeline processes, except those in exclude_pids."""
+    with _ledger() as leases:
+        return sum(lease['threads'] for lease in leases.values() if lease['pid'] not in exclude_pids)
+
+
+@contextmanager
+def cpu_lease(name: str, want: int = None, minimum: int = None):
+    """
+    Reserve CPU threads for one stage, waiting until enough cores are free.
+
+    The stage gets min(want, free cores), but is only admitted once at least
+    `minimum` cores are free, so a new stage never piles onto busy cores.
+
+    Args:
+        name: Stage name (shown while waiting)
+        want: Threads the stage would like (None = stage_limit())
+        minimum: Threads needed to start (None = half of want)
+
+    Yields:
+        Number of threads granted; use it for torch/OMP/MKL and FFmpeg settings
+    """
+    cores = total_cores()
+    want = max(1, min(want or stage_limit(), cores))
+    minimum = max(1, min(minimum or (want + 1) // 2, want))
+    lease_id = uuid.uuid4().hex
+    waiting_since = time.time()
+    announced = False
+
+    while True:
+        with _ledger() as leases:
+            free = cores - sum(lease['threads'] for lease in leases.values())
+            if free >= minimum:
+                granted = min(want, free)
+                leases[lease_id] = {'pid': os.getpid(), 'name': name, 'threads': granted, 'since': time.time()}
+                break
+        if not announced:
+            print(f"⏳ {name}: waiting for {minimum} free CPU core(s) ({cores - free}/{cores} in use)...")
+            announced = True
+        check_cancelled()
+        time.sleep(LEASE_POLL_INTERVAL)
+
+    annotate(threads=granted, cpu_wait_seconds=round(time.time() - waiting_since, 3))
+    try:
+        yield granted
+    finally:
+        with _ledger() as leases:
+            leases.pop(lease_id, None)
+
+
+def ffmpeg_thread_args(threads: int) -> list:
+    """
+    FFmpeg options limiting filtergraph threads and the decoding threads of the
+    first input. Put them right after 'ffmpeg'.
+    """
+    return ['-threads', str(threads), '-filter_threads', str(threads), '-filter_complex_threads', str(threads)]
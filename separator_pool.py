@@ -0,0 +1,379 @@
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+
+from cancellation import cancelled, check_cancelled
+
+# Backends that can be hosted by a separator worker
+DEMUCS = 'demucs'
+MDX = 'mdx'
+
+# Separator workers per model at most; every worker keeps a full model in memory
+MAX_WORKERS_PER_MODEL = int(os.environ.get('KARAOKE_SEPARATOR_WORKERS', 2))
+
+# Seconds a worker may sit idle before it is shut down (0 = keep forever)
+IDLE_TIMEOUT = float(os.environ.get('KARAOKE_SEPARATOR_IDLE_SECONDS', 600))
+
+# How often idle workers are checked
+REAP_INTERVAL = 30
+
+
+def _load_demucs(model_name):
+    """
+    Load a Demucs model and return a function that separates one file with it.
+    Mirrors what the `demucs` CLI does, minus the per-run torch import and model load.
+    """
+    import torch
+    from demucs.pretrained import get_model
+    from demucs.apply import apply_model
+    from demucs.audio import AudioFile, save_audio
+    from audio_io import write_wav
+
+    model = get_model(model_name)
+    model.cpu()
+    model.eval()
+
+    def separate(audio_path, output_dir, options):
+        wav = AudioFile(audio_path).read(
+            streams=0,
+            samplerate=model.samplerate,
+            channels=model.audio_channels
+        )
+        ref = wav.mean(0)
+        wav = (wav - ref.mean()) / ref.std()
+
+        with torch.no_grad():
+            sources = apply_model(
+                model, wav[None],
+                device='cpu',
+                shifts=options.get('shifts', 1),
+                split=True,
+                overlap=options.get('overlap', 0.25),
+                progress=True
+            )[0]
+        sources = sources * ref.std() + ref.mean()
+
+        two_stems = options.get('two_stems')
+        if two_stems:
+            stem_index = model.sources.index(two_stems)
+            stems = {
+                two_stems: sources[stem_index],
+                f'no_{two_stems}': sources.sum(0) - sources[stem_index]
+            }
+        else:
+            stems = dict(zip(model.sources, sources))
+
+        ext = options.get('ext', 'mp3')
+        os.makedirs(output_dir, exist_ok=True)
+        outputs = {}
+        for name, source in stems.items():
+            path = os.path.join(output_dir, f'{name}.{ext}')
+            if ext == 'wav' and options.get('float32', False):
+                # Lossless intermediate: raw float samples, readable with a memory map
+                write_wav(path, source.cpu().numpy().T, model.samplerate)
+            else:
+                save_audio(
+                    source, path,
+                    samplerate=model.samplerate,
+                    bitrate=options.get('mp3_bitrate', 320),
+                    clip='rescale',
+                    as_float=options.get('float32', False)
+                )
+            outputs[name] = path
+        return outputs
+
+    return separate
+
+
+def _load_mdx(model_name):
+    """
+    Load an audio-separator (MDX-Net / Roformer) model and return a function
+    that separates one file with it.
+    """
+    from audio_separator.separator import Separator
+
+    separator = Separator(normalization_threshold=0.9)
+    separator.load_model(model_filename=model_name)
+
+    def separate(audio_path, output_dir, options):
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Per-job settings live on the loaded model instance
+        model_instance = separator.model_instance
+        model_instance.output_dir = output_dir
+        model_instance.output_format = options.get('output_format', 'MP3')
+        model_instance.output_single_stem = options.get('single_stem')
+        model_instance.normalization_threshold = options.get('normalization', 0.9)
+
+        outputs = {}
+        for path in separator.separate(audio_path):
+            if not os.path.isabs(path):
+                path = os.path.join(output_dir, path)
+            # audio-separator names outputs "<song>_(<Stem>)_<model>.<ext>"
+            labels = re.findall(r'\(([^()]+)\)', os.path.basename(path))
+            stem = labels[-1] if labels else os.path.splitext(os.path.basename(path))[0]
+            outputs[stem.lower()] = path
+        return outputs
+
+    return separate
+
+
+_LOADERS = {
+    DEMUCS: _load_demucs,
+    MDX: _load_mdx,
+}
+
+
+def _worker_main(backend, model_name, requests, responses):
+    """Separator worker process: load the model once, then serve requests until told to stop."""
+    os.environ.setdefault('TORCH_HOME', os.path.expanduser('~/.cache/torch'))
+    try:
+        separate = _LOADERS[backend](model_name)
+    except Exception:
+        responses.put(('error', traceback.format_exc()))
+        return
+
+    import torch
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+
+        audio_path, output_dir, options, threads = request
+        try:
+            if threads:
+                torch.set_num_threads(threads)
+            responses.put(('ok', separate(audio_path, output_dir, options)))
+        except Exception:
+            responses.put(('error', traceback.format_exc()))
+
+
+class SeparatorWorker:
+    """
+    A child process that keeps one separation model loaded in memory.
+
+    Requests are handled one at a time; use SeparatorPool to run several in parallel.
+    """
+
+    def __init__(self, backend: str, model_name: str):
+        context = multiprocessing.get_context('spawn')
+        self.backend = backend
+        self.model_name = model_name
+        self.requests = context.Queue()
+        self.responses = context.Queue()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(backend, model_name, self.requests, self.responses),
+            name=f'separator-{backend}-{model_name}',
+            daemon=True
+        )
+        self.process.start()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def separate(self, audio_path: str, output_dir: str, options: dict, threads: int = None, timeout: float = None) -> dict:
+        """
+        Run one separation in the worker and wait for the result.
+
+        Returns:
+            Mapping of stem name to output file path
+        """
+        self.requests.put((os.path.abspath(audio_path), os.path.abspath(output_dir), options, threads))
+
+        waited = 0.0
+        while True:
+            try:
+                status, payload = self.responses.get(timeout=1.0)
+                break
+            except queue.Empty:
+                waited += 1.0
+                if cancelled():
+                    # The job was cancelled: the model can't be interrupted, so drop the worker
+                    self.stop(force=True)
+                    check_cancelled()
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Separator worker for {self.model_name} exited with code {self.process.exitcode}")
+                if timeout is not None and waited >= timeout:
+                    self.stop(force=True)
+                    raise TimeoutError(f"{self.model_name} separation timed out after {timeout:.0f} seconds")
+
+        if status != 'ok':
+            raise RuntimeError(f"{self.model_name} separation failed:\n{payload}")
+        return payload
+
+    def stop(self, force: bool = False):
+        if force:
+            self.process.kill()
+        elif self.process.is_alive():
+            self.requests.put(None)
+        self.process.join(timeout=10)
+
+
+class SeparatorPool:
+    """
+    Long-lived separator workers, one warm model per worker process.
+
+    Idle workers are reused across jobs so each model is loaded once per
+    process rather than once per song. Concurrent requests for the same model
+    get their own worker, up to max_workers per model; further requests wait
+    for a worker to come free. Workers idle for longer than idle_timeout are
+    shut down, so a model is not kept in memory after the work for it is done.
+    """
+
+    def __init__(self, max_workers: int = None, idle_timeout: float = None):
+        self.max_workers = max_workers or MAX_WORKERS_PER_MODEL
+        self.idle_timeout = IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self._idle = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._reaper = None
+
+    def _live(self, key) -> set:
+        """Workers of a model that are still running (busy or idle); call with the lock held."""
+        workers = self._workers.setdefault(key, set())
+        for worker in [worker for worker in workers if not worker.is_alive()]:
+            workers.discard(worker)
+        return workers
+
+    def _acquire(self, backend: str, model_name: str, max_workers: int = None) -> SeparatorWorker:
+        key = (backend, model_name)
+        limit = max(self.max_workers, max_workers or 0)
+        with self._available:
+            while True:
+                idle = self._idle.setdefault(key, [])
+                while idle:
+                    worker, _ = idle.pop()
+                    if worker.is_alive():
+                        return worker
+                if len(self._live(key)) < limit:
+                    break
+                self._available.wait(timeout=1.0)
+                check_cancelled()
+
+            print(f"🔥 Loading {model_name} into a new separator worker...")
+            worker = SeparatorWorker(backend, model_name)
+            self._workers[key].add(worker)
+            self._start_reaper()
+            return worker
+
+    def _release(self, worker: SeparatorWorker):
+        with self._available:
+            if worker.is_alive():
+                self._idle.setdefault((worker.backend, worker.model_name), []).append((worker, time.monotonic()))
+            else:
+                self._workers.get((worker.backend, worker.model_name), set()).discard(worker)
+            self._available.notify_all()
+
+    def _start_reaper(self):
+        """Start the thread that retires idle workers; call with the lock held."""
+        if self.idle_timeout > 0 and (self._reaper is None or not self._reaper.is_alive()):
+            self._reaper = threading.Thread(target=self._reap, name='separator-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(min(REAP_INTERVAL, self.idle_timeout))
+            with self._available:
+                expired = self._take_idle(lambda idle_since: time.monotonic() - idle_since >= self.idle_timeout)
+                if not any(self._workers.values()):
+                    self._reaper = None
+                    return
+            for worker in expired:
+                print(f"💤 Retiring idle separator worker for {worker.model_name}")
+                worker.stop()
+
+    def _take_idle(self, should_take, keys=None) -> list:
+        """Remove matching idle workers from the pool; call with the lock held."""
+        taken = []
+        for key, idle in self._idle.items():
+            if keys is not None and key not in keys:
+                continue
+            kept = []
+            for worker, idle_since in idle:
+                if should_take(idle_since):
+                    taken.append(worker)
+                    self._workers.get(key, set()).discard(worker)
+                else:
+                    kept.append((worker, idle_since))
+            idle[:] = kept
+        if taken:
+            self._available.notify_all()
+        return taken
+
+    def retire(self, backend: str, model_name: str, keep: int = 1):
+        """Shut down idle workers of a model beyond the `keep` most recently used."""
+        key = (backend, model_name)
+        with self._available:
+            idle = self._idle.get(key, [])
+            # Idle lists are in release order, so the oldest are at the front
+            extra = idle[:max(0, len(idle) - keep)]
+            idle[:] = idle[len(extra):]
+            for worker, _ in extra:
+                self._workers.get(key, set()).discard(worker)
+            self._available.notify_all()
+        for worker, _ in extra:
+            worker.stop()
+
+    def warm(self, backend: str, model_name: str):
+        """Start a worker for a model ahead of the first job."""
+        key = (backend, model_name)
+        with self._available:
+            if any(worker.is_alive() for worker, _ in self._idle.setdefault(key, [])):
+                return
+            if len(self._live(key)) >= self.max_workers:
+                return
+            worker = SeparatorWorker(backend, model_name)
+            self._workers[key].add(worker)
+            self._idle[key].append((worker, time.monotonic()))
+            self._start_reaper()
+
+    def separate(self, backend: str, model_name: str, audio_path: str, output_dir: str,
+                 threads: int = None, timeout: float = None, max_workers: int = None, **options) -> dict:
+        """
+        Separate an audio file with a warm model.
+
+        Args:
+            backend: DEMUCS or MDX
+            model_name: Model to use (e.g. 'htdemucs', 'htdemucs_6s', MDX checkpoint name)
+            audio_path: Path to input audio file
+            output_dir: Directory for the separated stems
+            threads: Torch intra-op thread count for this job (None = torch default)
+            timeout: Seconds to wait before killing the worker
+            max_workers: Workers this model may have for this request, when more than
+                the pool's max_workers (e.g. concurrent shift passes)
+            **options: Backend options (shifts, overlap, two_stems, ext, output_format, ...)
+
+        Returns:
+            Mapping of stem name to output file path
+        """
+        worker = self._acquire(backend, model_name, max_workers)
+        try:
+            return worker.separate(audio_path, output_dir, options, threads=threads, timeout=timeout)
+        finally:
+            self._release(worker)
+
+    def shutdown(self):
+        with self._available:
+            workers = self._take_idle(lambda idle_since: True)
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_separator_pool() -> SeparatorPool:
+    """Return the process-wide separator pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SeparatorPool()
+        return _pool
@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from audio_io import read_wav, create_wav, decode_to_wav, to_float, BLOCK_FRAMES
+from cancellation import run_process
+from chunked import SAMPLE_RATE
+from scheduler import available_memory_gb
+
+# Demucs shifts the input by up to this much per pass (same as demucs.apply.apply_model)
+MAX_SHIFT_SECONDS = 0.5
+
+# Shift passes run at the same time (0 = as many as the CPU allows, 1 = let Demucs
+# run all shifts in one process as before)
+DEFAULT_SHIFT_WORKERS = int(os.environ.get('KARAOKE_SHIFT_WORKERS', 0))
+
+# CPU threads per pass when the number of passes at a time is automatic. Torch scales
+# poorly past a few threads per model, while separate passes scale almost linearly.
+SHIFT_PASS_THREADS = 2
+
+# Memory one shift pass needs (model weights plus the activations of one segment),
+# in GB; every pass at a time is a separate worker process with its own model copy
+PASS_MEMORY_GB = {
+    'htdemucs': 1.5,
+    'htdemucs_6s': 2.0,
+}
+DEFAULT_PASS_MEMORY_GB = 2.0
+
+
+def shift_offsets(shifts: int, max_shift: int) -> list:
+    """
+    Frame offsets of the shift passes, spread evenly over [0, max_shift).
+
+    Demucs draws them at random; even spacing gives the same averaging effect and
+    makes the result reproducible.
+    """
+    return [index * max_shift // shifts for index in range(shifts)]
+
+
+def plan_shift_workers(shifts: int, threads: int, model: str = None, max_workers: int = None) -> tuple:
+    """
+    Split a thread budget between concurrent shift passes.
+
+    Passes at a time follow the thread budget (SHIFT_PASS_THREADS per pass) and are
+    limited by free memory (PASS_MEMORY_GB per pass), so a high shift count never
+    starts more model processes than the host can hold.
+
+    Args:
+        shifts: Number of shift passes
+        threads: CPU threads for all passes together
+        model: Demucs model, for its memory footprint
+        max_workers: Cap on passes at a time (None = no cap)
+
+    Returns:
+        (passes at a time, threads per pass); 1 pass at a time means the shifts
+        are better left to a single Demucs run
+    """
+    if shifts <= 1 or DEFAULT_SHIFT_WORKERS == 1:
+        return 1, threads
+    workers = min(shifts, DEFAULT_SHIFT_WORKERS or max(1, threads // SHIFT_PASS_THREADS))
+
+    available_gb = available_memory_gb()
+    if available_gb is not None:
+        workers = min(workers, max(1, int(available_gb // PASS_MEMORY_GB.get(model, DEFAULT_PASS_MEMORY_GB))))
+    if max_workers:
+        workers = min(workers, max_workers)
+    return workers, max(1, threads // workers)
+
+
+def separate_shifted(audio_path: str, separate_pass, output_path: str, shifts: int,
+                     workers: int = None, max_shift_seconds: float = MAX_SHIFT_SECONDS,
+                     progress=None) -> str:
+    """
+    Run Demucs test-time shifts as independent passes and average the aligned results.
+
+    `demucs --shifts=N` runs N time-shifted separations one after another inside a
+    single process. Here every shift is its own task: the input is decoded once,
+    each pass gets a copy delayed by its offset (padded to a common length), and
+    the separated stems are trimmed back into alignment and averaged into a
+    memory-mapped output. Passes only exchange files, so they can run in any
+    separator worker.
+
+    Args:
+        audio_path: Path to input audio file
+        separate_pass: Function (shifted_wav_path, pass_output_dir) -> path of the
+            separated stem for that pass (a single-shift separation)
+        output_path: Where to write the averaged stem (.wav, or .mp3 to encode at the end)
+        shifts: Number of shift passes
+        workers: Number of passes separated at the same time
+        max_shift_seconds: Largest delay applied to the input
+        progress: Optional callback(done_passes, total_passes) called as passes finish
+
+    Returns:
+        output_path
+    """
+    workers = max(1, min(workers or DEFAULT_SHIFT_WORKERS or shifts, shifts))
+
+    work_dir = tempfile.mkdtemp(prefix='shifts_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        source_wav = decode_to_wav(audio_path, os.path.join(work_dir, 'source.wav'), SAMPLE_RATE)
+        source, sample_rate = read_wav(source_wav)
+        total_frames, channels = source.shape
+
+        max_shift = int(max_shift_seconds * sample_rate)
+        offsets = shift_offsets(shifts, max_shift)
+        print(f"   🔀 Distributed shifts: {shifts} passes, {workers} at a time")
+
+        averaged_path = output_path if output_path.lower().endswith('.wav') else os.path.join(work_dir, 'averaged.wav')
+        averaged = create_wav(averaged_path, total_frames, channels, sample_rate)
+        average_lock = threading.Lock()
+
+        def run_pass(index):
+            offset = offsets[index]
+            pass_dir = os.path.join(work_dir, f'shift_{index:02d}')
+            shifted_path = os.path.join(pass_dir, f'shift_{index:02d}.wav')
+            # Every pass sees the same length: the offset as leading silence, the rest trailing
+            shifted = create_wav(shifted_path, total_frames + max_shift, channels, sample_rate)
+            for start in range(0, total_frames, BLOCK_FRAMES):
+                end = min(start + BLOCK_FRAMES, total_frames)
+                shifted[offset + start:offset + end] = to_float(source[start:end])
+            shifted.flush()
+            del shifted
+
+            separated_path = separate_pass(shifted_path, os.path.join(pass_dir, 'out'))
+            if not separated_path or not os.path.exists(separated_path):
+                raise FileNotFoundError(f"Separator produced no output for shift {index + 1}/{shifts}")
+            if not separated_path.lower().endswith('.wav'):
+                separated_path = decode_to_wav(separated_path, os.path.join(pass_dir, 'separated.wav'), sample_rate, channels)
+            separated, separated_rate = read_wav(separated_path)
+            if separated_rate != sample_rate:
+                raise RuntimeError(f"Separator returned {separated_rate}Hz audio for a {sample_rate}Hz pass")
+
+            with average_lock:
+                for start in range(0, total_frames, BLOCK_FRAMES):
+                    end = min(start + BLOCK_FRAMES, total_frames, separated.shape[0] - offset)
+                    if end <= start:
+                        break
+                    averaged[start:end] += to_float(separated[offset + start:offset + end]) / shifts
+
+            del separated
+            shutil.rmtree(pass_dir, ignore_errors=True)
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_pass, index) for index in range(shifts)]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                print(f"   ✅ Shift {done}/{shifts} separated")
+                if progress:
+                    progress(done, shifts)
+
+        averaged.flush()
+        del averaged
+        del source
+
+        if averaged_path != output_path:
+            result = run_process(
+                ['ffmpeg', '-y', '-v', 'error', '-i', averaged_path, '-b:a', '320k', output_path],
+                partial=[output_path],
+                capture_output=True,
+                text=True
+            )
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to encode averaged output: {result.stderr}")
+
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
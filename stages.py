@@ -0,0 +1,74 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Callbacks notified when a pipeline stage starts and ends: listener(event, name, info)
+# with event 'start' or 'end'. Used by the benchmark harness and telemetry.
+_listeners = []
+_listeners_lock = threading.Lock()
+
+# Stages currently open in this thread (innermost last), for annotate()
+_local = threading.local()
+
+
+def add_stage_listener(listener):
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_stage_listener(listener):
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def _notify(event: str, name: str, info: dict):
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(event, name, info)
+        except Exception as e:
+            # Observers must never break the pipeline
+            print(f"⚠️  Stage listener failed: {e}")
+
+
+def annotate(**fields):
+    """
+    Attach facts to the innermost open stage of this thread (e.g. returncode=...);
+    they are included in the stage's end event. No-op outside a stage.
+    """
+    open_stages = getattr(_local, 'stack', None)
+    if open_stages:
+        open_stages[-1].update(fields)
+
+
+@contextmanager
+def stage(name: str, **info):
+    """
+    Mark a block of pipeline work as a named stage.
+
+    Listeners get ('start', name, info) on entry and ('end', name, info) on exit,
+    where the end info adds 'seconds', anything passed to annotate() inside the
+    block and, if the stage raised, 'error'.
+    """
+    if not _listeners:
+        yield
+        return
+
+    _notify('start', name, dict(info))
+    notes = {}
+    open_stages = getattr(_local, 'stack', None)
+    if open_stages is None:
+        open_stages = _local.stack = []
+    open_stages.append(notes)
+
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        open_stages.pop()
+        _notify('end', name, dict(info, **notes, seconds=time.perf_counter() - started, error=str(e) or type(e).__name__))
+        raise
+    open_stages.pop()
+    _notify('end', name, dict(info, **notes, seconds=time.perf_counter() - started))
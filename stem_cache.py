@@ -0,0 +1,350 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from media_index import MediaIndex, INDEX_FILENAME, get_media_index, parse_loudness
+from telemetry import record_cache
+from fingerprint import get_fingerprint_index, fingerprint, fingerprint_samples, SAMPLE_RATE as FINGERPRINT_RATE
+from cancellation import popen, release, check_cancelled
+
+# Persistent cache location and disk budget (override with environment variables)
+DEFAULT_CACHE_DIR = os.path.expanduser('~/.cache/ai-karaoke-maker')
+DEFAULT_MAX_GB = 20
+
+# Linux ioctl that makes a copy-on-write clone of a file (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# Decoded-audio hashes already computed in this process, keyed by (path, size, mtime)
+_hash_memo = {}
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's bytes (same as uploads.save_upload records for uploads)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def audio_content_hash(audio_file: str, fingerprint_audio: bool = False) -> str:
+    """
+    Hash the decoded audio of a file, so the same song hashes identically
+    regardless of file name or container metadata.
+
+    The file is decoded with FFmpeg to 44.1kHz stereo 16-bit PCM and the
+    samples are streamed through SHA-256. The same decode measures the song's
+    integrated loudness (EBU R128) on a second output, recorded in the media index.
+
+    The decode is skipped when the media index already knows the answer: for
+    this path while its size and mtime are unchanged, or for any file with the
+    same bytes (a stem copied out of the cache, a re-uploaded file).
+
+    Args:
+        audio_file: Path to audio file
+        fingerprint_audio: Also add the song to the fingerprint index (pipeline
+            inputs), from a third output of the same decode
+
+    Returns:
+        Hex digest of the decoded audio
+    """
+    stat = os.stat(audio_file)
+    memo_key = (os.path.abspath(audio_file), stat.st_size, stat.st_mtime_ns)
+    fingerprints = get_fingerprint_index() if fingerprint_audio else None
+
+    # Hashed by this process, an earlier run or another process?
+    content_hash = _hash_memo.get(memo_key)
+    index = get_media_index()
+    if content_hash is None:
+        known = index.lookup_file(audio_file)
+        content_hash = known.get('content_hash') if known else None
+    if content_hash is None:
+        # Reading the bytes is far cheaper than decoding them
+        file_hash = file_digest(audio_file)
+        content_hash = index.blob(file_hash)
+        if content_hash:
+            index.record_file(audio_file, content_hash=content_hash)
+    if content_hash:
+        _hash_memo[memo_key] = content_hash
+        if fingerprints and fingerprints.codes(content_hash) is None:
+            fingerprints.add(content_hash, fingerprint(audio_file))
+        return content_hash
+
+    # Third output: mono samples at the fingerprint rate
+    fingerprint_output = []
+    if fingerprints:
+        fd, fingerprint_path = tempfile.mkstemp(prefix='fingerprint_', suffix='.f32')
+        os.close(fd)
+        fingerprint_output = ['-vn', '-ac', '1', '-ar', str(FINGERPRINT_RATE), '-f', 'f32le', fingerprint_path]
+
+    # FFmpeg's log (progress and the ebur128 summary) goes to a file: a full stderr
+    # pipe would stall FFmpeg while stdout is still being read
+    log = tempfile.TemporaryFile()
+    try:
+        process = popen(
+            [
+                'ffmpeg', '-y',
+                '-hide_banner', '-nostats',
+                '-v', 'info',  # The ebur128 summary is logged at info level
+                '-i', audio_file,
+                '-vn',
+                '-f', 's16le',
+                '-acodec', 'pcm_s16le',
+                '-ar', '44100',
+                '-ac', '2',
+                '-',
+                # Second output: loudness of the same decoded audio, per-frame log kept quiet
+                '-vn',
+                '-af', 'ebur128=framelog=verbose',
+                '-f', 'null',
+                '-',
+                *fingerprint_output
+            ],
+            stdout=subprocess.PIPE,
+            stderr=log
+        )
+
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: process.stdout.read(1024 * 1024), b''):
+            digest.update(chunk)
+        process.wait()
+        release(process)
+        check_cancelled()
+        log.seek(0)
+        stderr = log.read().decode(errors='replace')
+
+        if process.returncode != 0:
+            raise RuntimeError(f"Failed to decode audio for hashing: {stderr}")
+
+        content_hash = digest.hexdigest()
+        _hash_memo[memo_key] = content_hash
+        index.record_blob(file_hash, audio_file)
+        index.record_file(audio_file, content_hash=content_hash)
+        loudness = parse_loudness(stderr)
+        if loudness is not None:
+            index.record_media(content_hash, loudness=loudness)
+        if fingerprints:
+            # Indexed as the song comes in, so any later variant of it is recognised
+            fingerprints.add(content_hash, fingerprint_samples(np.fromfile(fingerprint_path, dtype=np.float32)))
+        return content_hash
+    finally:
+        log.close()
+        if fingerprints:
+            os.remove(fingerprint_path)
+
+
+def stem_cache_key(content_hash: str, model: str, **params) -> str:
+    """
+    Build the cache key for one separation run.
+
+    Args:
+        content_hash: Hash of the decoded input audio (see audio_content_hash)
+        model: Separation model name
+        **params: Separation parameters that change the output (shifts, overlap, two_stems, ...)
+
+    Returns:
+        Hex digest identifying the separation output
+    """
+    payload = json.dumps(
+        {'audio': content_hash, 'model': model, 'params': params},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def clone_file(source_path: str, dest_path: str):
+    """Copy a file, as a copy-on-write reflink where the filesystem supports it."""
+    try:
+        import fcntl
+        with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+            fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(source_path, dest_path)
+
+
+def materialize(cached_path: str, dest_path: str) -> str:
+    """
+    Place an independent copy of a file at dest_path.
+
+    Cache entries and outputs never share an inode: a stage overwriting its
+    output in place would otherwise rewrite the cached stem as well. The copy is
+    written next to dest_path and renamed over it, so an existing file at
+    dest_path (possibly open elsewhere) is replaced, never truncated.
+
+    Returns:
+        dest_path
+    """
+    os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+    root, ext = os.path.splitext(dest_path)
+    tmp_path = f'{root}.{os.getpid()}.{threading.get_ident()}.tmp{ext}'
+    try:
+        clone_file(cached_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return dest_path
+
+
+class StemCache:
+    """
+    Content-addressed on-disk cache of separated stems with LRU eviction.
+
+    Each entry is a directory named after its cache key holding the stem files
+    plus a meta.json. Entry sizes and "last used" times are kept in the media
+    index, so eviction never has to walk the cache directory.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        if cache_dir is None:
+            cache_dir = os.environ.get('KARAOKE_CACHE_DIR', DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_gb = float(os.environ.get('KARAOKE_CACHE_MAX_GB', DEFAULT_MAX_GB))
+            max_bytes = int(max_gb * 1024 ** 3)
+
+        self.root = os.path.join(cache_dir, 'stems')
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self.index = MediaIndex(os.path.join(cache_dir, INDEX_FILENAME))
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str, stem: str):
+        """
+        Look up a cached stem.
+
+        Args:
+            key: Cache key from stem_cache_key
+            stem: Stem name (e.g. 'no_vocals', 'instrumental')
+
+        Returns:
+            Path to the cached stem file, or None on a cache miss. The file is
+            shared by every job: read it, or materialize() a copy, never write to it.
+        """
+        stem_path = self._lookup(key, stem)
+        record_cache('stems', stem_path is not None, stem=stem)
+        return stem_path
+
+    def _lookup(self, key: str, stem: str):
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            self.index.remove_stem_entry(key)
+            return None
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        filename = meta.get('stems', {}).get(stem)
+        if not filename:
+            return None
+
+        stem_path = os.path.join(entry_dir, filename)
+        if not os.path.exists(stem_path):
+            return None
+
+        # Mark as recently used
+        self.index.touch_stem_entry(key)
+        return stem_path
+
+    def put(self, key: str, stems: dict, **metadata) -> dict:
+        """
+        Store copies of stem files in the cache and evict old entries if over budget.
+
+        Args:
+            key: Cache key from stem_cache_key
+            stems: Mapping of stem name to the freshly produced file
+            **metadata: Extra information recorded in meta.json (model, params, ...)
+
+        Returns:
+            Mapping of stem name to the cached file path
+        """
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        cached = {}
+        for stem, path in stems.items():
+            filename = stem + os.path.splitext(path)[1]
+            cached[stem] = materialize(path, os.path.join(entry_dir, filename))
+
+        meta = {
+            'stems': {stem: os.path.basename(path) for stem, path in cached.items()},
+            'created': time.time(),
+            **metadata
+        }
+        # Write atomically so a concurrent reader never sees half a meta.json
+        tmp_path = os.path.join(entry_dir, f'meta.json.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(entry_dir, 'meta.json'))
+
+        self.index.record_stem_entry(key, self._entry_size(entry_dir))
+        self.evict(keep=key)
+        return cached
+
+    def evict(self, keep: str = None) -> int:
+        """
+        Remove least recently used entries until the cache fits its disk budget.
+
+        Args:
+            keep: Cache key that must not be evicted (the entry just written)
+
+        Returns:
+            Number of bytes freed
+        """
+        if self.index.stem_entry_count() == 0:
+            self._reindex()
+
+        total = self.index.stem_bytes()
+        if total <= self.max_bytes:
+            return 0
+
+        freed = 0
+        for key, size in self.index.stem_entries():
+            if total - freed <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            print(f"🧹 Evicting cached stems: {key[:12]} ({size / 1024 ** 2:.1f} MB)")
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            self.index.remove_stem_entry(key)
+            freed += size
+
+        return freed
+
+    @staticmethod
+    def _entry_size(entry_dir: str) -> int:
+        size = 0
+        for name in os.listdir(entry_dir):
+            try:
+                size += os.path.getsize(os.path.join(entry_dir, name))
+            except OSError:
+                pass
+        return size
+
+    def _reindex(self):
+        """Register entries already on disk (cache created before the index existed)."""
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                try:
+                    last_used = os.path.getmtime(os.path.join(entry_dir, 'meta.json'))
+                except OSError:
+                    last_used = 0  # Incomplete entry, evict first
+                self.index.record_stem_entry(key, self._entry_size(entry_dir), last_used)
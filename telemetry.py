@@ -0,0 +1,312 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from stages import add_stage_listener
+
+# Structured events from every pipeline process are appended to one JSON-lines file;
+# the metrics endpoint aggregates them. KARAOKE_TELEMETRY=0 turns both off.
+TELEMETRY_ENABLED = os.environ.get('KARAOKE_TELEMETRY', '1') != '0'
+TELEMETRY_LOG = os.path.expanduser(os.environ.get('KARAOKE_TELEMETRY_LOG', '~/.cache/ai-karaoke-maker/telemetry.jsonl'))
+METRICS_PORT = int(os.environ.get('KARAOKE_METRICS_PORT', 9108))
+# Interface the metrics endpoint binds to; set e.g. 0.0.0.0 for a scraper on another host
+METRICS_HOST = os.environ.get('KARAOKE_METRICS_HOST', '127.0.0.1')
+
+# The log is rolled over to <log>.1 (replacing the previous one) once it reaches this size
+TELEMETRY_MAX_BYTES = int(float(os.environ.get('KARAOKE_TELEMETRY_MAX_MB', 50)) * 1024 ** 2)
+
+# Stage duration histogram buckets in seconds (short FFmpeg passes up to multi-hour separations)
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 10800)
+
+# How often peak memory is sampled while a stage is running
+RSS_SAMPLE_INTERVAL = 0.5
+
+
+def process_rss_bytes() -> int:
+    """Resident memory of this process plus its child processes (Linux /proc; 0 elsewhere)."""
+    try:
+        with open('/proc/self/statm') as f:
+            total = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+
+    pid = str(os.getpid())
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = f.read().rsplit(')', 1)[1].split()[1]
+            if ppid == pid:
+                with open(f'/proc/{entry}/statm') as f:
+                    total += int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    return total * os.sysconf('SC_PAGE_SIZE')
+
+
+def emit(event: str, **fields):
+    """
+    Append one structured event to the telemetry log.
+
+    Each line is a JSON object with 'ts', 'event', 'pid' and the given fields.
+    Lines are written with a single append, so several processes can share the file.
+    A log past TELEMETRY_MAX_BYTES is rolled over before the line is written.
+    """
+    if not TELEMETRY_ENABLED:
+        return
+    record = {'ts': round(time.time(), 3), 'event': event, 'pid': os.getpid(), **fields}
+    line = json.dumps(record, default=str) + '\n'
+    try:
+        os.makedirs(os.path.dirname(TELEMETRY_LOG) or '.', exist_ok=True)
+        fd = os.open(TELEMETRY_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if TELEMETRY_MAX_BYTES and os.fstat(fd).st_size >= TELEMETRY_MAX_BYTES:
+                _roll_over(fd)
+                os.close(fd)
+                fd = os.open(TELEMETRY_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+    except OSError:
+        pass  # Telemetry must never break processing
+
+
+def _roll_over(fd: int):
+    """Move the full log (open as fd) to <log>.1, unless another process already did."""
+    try:
+        if os.stat(TELEMETRY_LOG).st_ino != os.fstat(fd).st_ino:
+            return
+    except FileNotFoundError:
+        return
+    os.replace(TELEMETRY_LOG, TELEMETRY_LOG + '.1')
+
+
+def record_cache(cache: str, hit: bool, **fields):
+    """Record a cache lookup (cache='stems', 'fingerprint', ...)."""
+    emit('cache', cache=cache, result='hit' if hit else 'miss', **fields)
+
+
+class _StageTelemetry:
+    """Stage listener turning stage start/end into events, with input size and peak memory."""
+
+    def __init__(self):
+        self._open = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+            rss = process_rss_bytes()
+            with self._lock:
+                for record in self._open.values():
+                    record['peak'] = max(record['peak'], rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+    def __call__(self, event: str, name: str, info: dict):
+        key = (name, threading.get_ident())
+        fields = {k: v for k, v in info.items() if k not in ('input', 'seconds', 'error')}
+        input_path = info.get('input')
+        if input_path and os.path.exists(input_path):
+            fields['input_bytes'] = os.path.getsize(input_path)
+
+        if event == 'start':
+            with self._lock:
+                self._open[key] = {'peak': process_rss_bytes()}
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample, daemon=True)
+                    self._sampler.start()
+            emit('stage_start', stage=name, **fields)
+            return
+
+        with self._lock:
+            record = self._open.pop(key, {'peak': 0})
+        peak = max(record['peak'], process_rss_bytes())
+        emit(
+            'stage_end', stage=name,
+            status='error' if 'error' in info else 'ok',
+            seconds=round(info.get('seconds', 0.0), 3),
+            peak_rss_bytes=peak,
+            **({'error': info['error']} if 'error' in info else {}),
+            **fields
+        )
+
+
+_installed = False
+
+
+def install_telemetry():
+    """
+    Start emitting stage events from this process (idempotent).
+
+    Called by entry points (CLI, web app) and by the worker processes they start,
+    never on import, so importing the pipeline has no side effects.
+    """
+    global _installed
+    if _installed or not TELEMETRY_ENABLED:
+        return
+    _installed = True
+    add_stage_listener(_StageTelemetry())
+
+
+def telemetry_installed() -> bool:
+    """Whether this process emits stage events (passed on to worker processes)."""
+    return _installed
+
+
+class Metrics:
+    """
+    Aggregates telemetry events into Prometheus counters and histograms.
+
+    A background thread follows the telemetry log, so events from job workers,
+    batch workers and separator processes all end up in one place.
+    """
+
+    def __init__(self, log_path: str = TELEMETRY_LOG):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def _inc(self, name: str, labels: tuple, value: float = 1):
+        self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def _observe(self, name: str, labels: tuple, value: float):
+        counts, total = self._histograms.get((name, labels), ([0] * len(DURATION_BUCKETS), 0.0))
+        counts = [count + (value <= bound) for count, bound in zip(counts, DURATION_BUCKETS)]
+        self._histograms[(name, labels)] = (counts, total + value)
+        self._inc(f'{name}_count', labels)
+
+    def observe_event(self, record: dict):
+        event = record.get('event')
+        with self._lock:
+            if event == 'stage_end':
+                labels = (('stage', record.get('stage', '')), ('status', record.get('status', '')))
+                self._inc('karaoke_stage_total', labels)
+                self._observe('karaoke_stage_duration_seconds', (('stage', record.get('stage', '')),), record.get('seconds', 0.0))
+                if record.get('peak_rss_bytes'):
+                    key = ('karaoke_stage_peak_rss_bytes', (('stage', record.get('stage', '')),))
+                    self._gauges[key] = max(self._gauges.get(key, 0), record['peak_rss_bytes'])
+                if record.get('input_bytes'):
+                    self._inc('karaoke_stage_input_bytes_total', (('stage', record.get('stage', '')),), record['input_bytes'])
+                if 'returncode' in record:
+                    self._inc('karaoke_subprocess_total', (
+                        ('stage', record.get('stage', '')), ('returncode', str(record['returncode']))
+                    ))
+            elif event == 'cache':
+                self._inc('karaoke_cache_requests_total', (
+                    ('cache', record.get('cache', '')), ('result', record.get('result', ''))
+                ))
+            elif event == 'job':
+                self._inc('karaoke_jobs_total', (('status', record.get('status', '')),))
+                if record.get('seconds') is not None:
+                    self._observe('karaoke_job_duration_seconds', (), record['seconds'])
+
+    def follow(self, poll_interval: float = 1.0):
+        """Tail the telemetry log from its current end, forever (run in a thread)."""
+        position = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        pending = b''
+        while True:
+            try:
+                if os.path.getsize(self.log_path) < position:
+                    position = 0  # Log was rotated or truncated
+                with open(self.log_path, 'rb') as f:
+                    f.seek(position)
+                    data = f.read()
+                    position = f.tell()
+            except OSError:
+                data = b''
+
+            *lines, pending = (pending + data).split(b'\n')
+            for line in lines:
+                try:
+                    self.observe_event(json.loads(line))
+                except ValueError:
+                    continue
+            time.sleep(poll_interval)
+
+    @staticmethod
+    def _labels(labels: tuple, extra: tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def exposition(self) -> str:
+        """Metrics in the Prometheus text format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+            gauges = dict(self._gauges)
+
+        lines = []
+        histogram_names = {name for name, _ in histograms}
+        for name in sorted(histogram_names):
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), (counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(DURATION_BUCKETS, counts):
+                    lines.append(f'{name}_bucket{self._labels(labels, (("le", bound),))} {count}')
+                count = counters.get((f'{name}_count', labels), 0)
+                lines.append(f'{name}_bucket{self._labels(labels, (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{self._labels(labels)} {total}')
+                lines.append(f'{name}_count{self._labels(labels)} {count}')
+
+        counter_names = sorted({name for name, _ in counters if not any(name == f'{h}_count' for h in histogram_names)})
+        for name in counter_names:
+            lines.append(f'# TYPE {name} counter')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{self._labels(labels)} {value}')
+
+        for name in sorted({name for name, _ in gauges}):
+            lines.append(f'# TYPE {name} gauge')
+            for (metric, labels), value in sorted(gauges.items()):
+                if metric == name:
+                    lines.append(f'{name}{self._labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(port: int = None, host: str = None) -> Metrics:
+    """
+    Serve aggregated metrics at http://<host>:<port>/metrics (Prometheus text format)
+    from a background thread.
+
+    Binds to KARAOKE_METRICS_HOST (default 127.0.0.1), so job metrics are not
+    exposed on every interface unless asked for.
+
+    Returns:
+        The Metrics aggregator
+    """
+    metrics = Metrics()
+    threading.Thread(target=metrics.follow, name='telemetry-follow', daemon=True).start()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.exposition().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the app log
+
+    host = host or METRICS_HOST
+    server = ThreadingHTTPServer((host, METRICS_PORT if port is None else port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"📈 Metrics endpoint: http://{host}:{server.server_port}/metrics")
+    return metrics
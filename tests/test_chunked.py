@@ -0,0 +1,42 @@
+import numpy as np
+
+from chunked import plan_windows, crossfade_weights, should_chunk
+
+
+def test_short_track_is_one_window():
+    assert plan_windows(1000, 4000, 100) == [(0, 1000)]
+    assert plan_windows(4000, 4000, 100) == [(0, 4000)]
+
+
+def test_windows_cover_track_with_overlap():
+    windows = plan_windows(10000, 4000, 500)
+    assert windows[0][0] == 0
+    assert windows[-1][1] == 10000
+    for (_, previous_end), (start, _) in zip(windows, windows[1:]):
+        assert previous_end - start == 500
+
+
+def test_tiny_tail_is_folded_into_previous_window():
+    # A third window would only hold the overlap itself
+    assert plan_windows(7600, 4000, 400) == [(0, 4000), (3600, 7600)]
+    # ...a longer tail keeps its own window
+    assert plan_windows(7700, 4000, 400) == [(0, 4000), (3600, 7600), (7200, 7700)]
+
+
+def test_crossfade_ramps_sum_to_one():
+    overlap = 64
+    first = crossfade_weights(256, 0, overlap)
+    second = crossfade_weights(256, overlap, 0)
+    np.testing.assert_allclose(first[-overlap:] + second[:overlap], 1.0, rtol=1e-6)
+    assert first[0] == 1.0 and second[-1] == 1.0
+    assert first.dtype == np.float32
+
+
+def test_crossfade_without_fades_is_flat():
+    np.testing.assert_array_equal(crossfade_weights(10, 0, 0), np.ones(10, dtype=np.float32))
+
+
+def test_should_chunk():
+    assert not should_chunk(400, chunk_seconds=300)
+    assert should_chunk(451, chunk_seconds=300)
+    assert not should_chunk(10000, chunk_seconds=0)
@@ -0,0 +1,116 @@
+import http.client
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from file_server import ResultFileHandler, parse_range
+
+CONTENT = bytes(range(256)) * 40
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-99', 1000) == (0, 99)
+    assert parse_range('bytes=500-', 1000) == (500, 999)
+    assert parse_range('bytes=900-5000', 1000) == (900, 999)
+    assert parse_range('bytes=-100', 1000) == (900, 999)
+    assert parse_range('bytes=-5000', 1000) == (0, 999)
+
+
+def test_parse_range_whole_file():
+    assert parse_range(None, 1000) is None
+    assert parse_range('items=0-10', 1000) is None
+    assert parse_range('bytes=0-10,20-30', 1000) is None
+    assert parse_range('bytes=abc-', 1000) is None
+
+
+def test_parse_range_unsatisfiable():
+    assert parse_range('bytes=1000-', 1000) is False
+    assert parse_range('bytes=50-10', 1000) is False
+    assert parse_range('bytes=-0', 1000) is False
+
+
+@pytest.fixture
+def server(tmp_path):
+    job_dir = tmp_path / 'job1'
+    job_dir.mkdir()
+    (job_dir / 'song.mp3').write_bytes(CONTENT)
+    (job_dir / 'notes.txt').write_text('not audio')
+    (tmp_path / 'loose.mp3').write_bytes(CONTENT)
+
+    handler = type('Handler', (ResultFileHandler,), {'root': str(tmp_path)})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def request(port, path, method='GET', **headers):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    connection.request(method, path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response, body
+
+
+def test_whole_file(server):
+    response, body = request(server, '/results/job1/song.mp3')
+    assert response.status == 200
+    assert body == CONTENT
+    assert response.getheader('Accept-Ranges') == 'bytes'
+    assert response.getheader('Content-Type') == 'audio/mpeg'
+
+
+def test_range_request(server):
+    response, body = request(server, '/results/job1/song.mp3', Range='bytes=100-199')
+    assert response.status == 206
+    assert body == CONTENT[100:200]
+    assert response.getheader('Content-Range') == f'bytes 100-199/{len(CONTENT)}'
+
+
+def test_unsatisfiable_range(server):
+    response, body = request(server, '/results/job1/song.mp3', Range=f'bytes={len(CONTENT)}-')
+    assert response.status == 416
+    assert response.getheader('Content-Range') == f'bytes */{len(CONTENT)}'
+    assert body == b''
+
+
+def test_etag_revalidation(server):
+    response, _ = request(server, '/results/job1/song.mp3')
+    etag = response.getheader('ETag')
+    response, body = request(server, '/results/job1/song.mp3', **{'If-None-Match': etag})
+    assert response.status == 304
+    assert body == b''
+
+
+def test_stale_if_range_sends_whole_file(server):
+    response, body = request(server, '/results/job1/song.mp3', Range='bytes=0-9', **{'If-Range': '"stale"'})
+    assert response.status == 200
+    assert body == CONTENT
+
+
+def test_head_has_no_body(server):
+    response, body = request(server, '/results/job1/song.mp3', method='HEAD')
+    assert response.status == 200
+    assert response.getheader('Content-Length') == str(len(CONTENT))
+    assert body == b''
+
+
+def test_download_disposition(server):
+    response, _ = request(server, '/results/job1/song.mp3?download=1')
+    assert response.getheader('Content-Disposition') == "attachment; filename*=UTF-8''song.mp3"
+
+
+@pytest.mark.parametrize('path', [
+    '/results/job1/notes.txt',       # Not a served extension
+    '/results/loose.mp3',            # Not inside a job folder
+    '/results/../job1/song.mp3',     # Outside the results directory
+    '/results/job1/missing.mp3',
+    '/job1/song.mp3',
+])
+def test_not_found(server, path):
+    response, _ = request(server, path)
+    assert response.status == 404
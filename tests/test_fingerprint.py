@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from fingerprint import (
+    HOP_SECONDS, HOP_SIZE, PHASES, SAMPLE_RATE, SILENCE,
+    FingerprintIndex, bit_error_rate, correlation_lag, fingerprint_samples,
+)
+from media_index import MediaIndex
+
+
+def song(seed, seconds=30.0):
+    """A sequence of random three-note chords, a quarter of a second each."""
+    rng = np.random.default_rng(seed)
+    note = int(0.25 * SAMPLE_RATE)
+    t = np.arange(note) / SAMPLE_RATE
+    chords = []
+    for _ in range(int(seconds / 0.25)):
+        frequencies = 110 * 2 ** (rng.integers(0, 36, 3) / 12)
+        chords.append(sum(np.sin(2 * np.pi * f * t) for f in frequencies) / 3)
+    return np.concatenate(chords).astype(np.float32)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return FingerprintIndex(MediaIndex(str(tmp_path / 'index.db')))
+
+
+def test_one_code_per_hop():
+    samples = song(1, 10)
+    codes = fingerprint_samples(samples)
+    assert codes.dtype == np.uint32
+    assert abs(len(codes) - len(samples) / HOP_SIZE) < 5
+    assert (codes[codes != SILENCE] < 1 << 24).all()
+
+
+def test_silence_gets_silent_codes():
+    samples = song(1, 10)
+    samples[SAMPLE_RATE * 4:SAMPLE_RATE * 6] = 0
+    codes = fingerprint_samples(samples)
+    silent = int(4.5 / HOP_SECONDS), int(5.5 / HOP_SECONDS)
+    assert (codes[silent[0]:silent[1]] == SILENCE).all()
+
+
+def test_bit_error_rate():
+    codes = fingerprint_samples(song(1, 10))
+    assert bit_error_rate(codes, codes) == 0.0
+    assert bit_error_rate(codes, codes ^ np.uint32(0xFFFFFF)) == 1.0
+    assert bit_error_rate(np.full(5, SILENCE), np.full(5, SILENCE)) == 1.0
+
+
+def test_excerpt_is_found_at_its_offset(index):
+    reference = song(1)
+    index.add('song-a', fingerprint_samples(reference))
+    index.add('song-b', fingerprint_samples(song(2)))
+
+    frames = 200
+    excerpt = reference[frames * HOP_SIZE:frames * HOP_SIZE + 10 * SAMPLE_RATE]
+    matches = index.match(fingerprint_samples(excerpt))
+    assert matches[0][0] == 'song-a'
+    assert matches[0][1] == pytest.approx(frames * HOP_SECONDS)
+    assert matches[0][2] < 0.05
+    assert all(content_hash != 'song-b' for content_hash, _, _ in matches)
+
+
+def test_unrelated_audio_does_not_match(index):
+    index.add('song-a', fingerprint_samples(song(1)))
+    assert index.match(fingerprint_samples(song(3, 10))) == []
+
+
+def test_query_itself_can_be_excluded(index):
+    codes = fingerprint_samples(song(1))
+    index.add('song-a', codes)
+    assert index.match(codes)[0][0] == 'song-a'
+    assert index.match(codes, exclude='song-a') == []
+
+
+def test_unaligned_noisy_excerpt_is_found(index):
+    reference = song(1)
+    index.add('song-a', fingerprint_samples(reference))
+
+    # Starts part-way through a hop, with some noise on top
+    start = 321 * HOP_SIZE + 200
+    excerpt = reference[start:start + 10 * SAMPLE_RATE]
+    excerpt = excerpt + np.random.default_rng(0).normal(0, 0.05, len(excerpt)).astype(np.float32)
+
+    matches = index.match_samples(excerpt)
+    assert matches[0][0] == 'song-a'
+    assert abs(matches[0][1] - start / SAMPLE_RATE) <= HOP_SECONDS / PHASES
+
+
+def test_fingerprints_are_persisted(tmp_path):
+    media_index = MediaIndex(str(tmp_path / 'index.db'))
+    codes = fingerprint_samples(song(1))
+    FingerprintIndex(media_index).add('song-a', codes)
+
+    reloaded = FingerprintIndex(media_index)
+    np.testing.assert_array_equal(reloaded.codes('song-a'), codes)
+    assert reloaded.codes('song-b') is None
+
+
+def test_songs_added_later_match_a_fresh_load(index):
+    index.add('song-a', fingerprint_samples(song(1)))
+    index.add('song-b', fingerprint_samples(song(2)))
+    index.add('song-c', fingerprint_samples(song(3)))
+
+    reloaded = FingerprintIndex(index.media_index)
+    reloaded.codes('song-a')
+    for merged, loaded in zip(index._sorted, reloaded._sorted):
+        np.testing.assert_array_equal(merged, loaded)
+
+
+def test_correlation_lag_finds_exact_position():
+    reference = np.random.default_rng(0).normal(size=20000).astype(np.float32)
+    query = reference[5037:7037]
+    assert correlation_lag(query, reference, expected=5000, max_lag=100) == 37
+    assert correlation_lag(query, reference, expected=5100, max_lag=100) == -63
+
+
+def test_correlation_lag_without_room_is_zero():
+    reference = np.zeros(1000, dtype=np.float32)
+    assert correlation_lag(reference[:500], reference, expected=900, max_lag=10) == 0
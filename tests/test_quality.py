@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+import quality
+from quality import QUALITY_TIERS, estimate_seconds, parse_deadline, plan_quality, record_throughput, thread_seconds
+
+
+@pytest.fixture(autouse=True)
+def throughput_file(tmp_path, monkeypatch):
+    """Start every test from the default (unmeasured) throughput."""
+    path = tmp_path / 'throughput.json'
+    monkeypatch.setattr(quality, 'THROUGHPUT_FILE', str(path))
+    return path
+
+
+def test_no_deadline_uses_requested_tier():
+    plan = plan_quality(240, threads=8)
+    assert plan['quality'] == 'studio'
+    assert plan['fits']
+    assert plan_quality(240, 'fast', threads=8)['quality'] == 'fast'
+
+
+def test_deadline_picks_best_tier_that_fits():
+    estimates = {name: estimate_seconds(tier, 240, threads=8) for name, tier in QUALITY_TIERS.items()}
+    # Halfway between the 'high' and 'studio' estimates
+    deadline = time.time() + (estimates['high'] + estimates['studio']) / 2
+    plan = plan_quality(240, deadline=deadline, threads=8)
+    assert plan['quality'] == 'high'
+    assert plan['fits']
+    assert plan['shifts'] == QUALITY_TIERS['high']['shifts']
+
+
+def test_missed_deadline_falls_back_to_cheapest_tier():
+    plan = plan_quality(240, deadline=time.time() + 1, threads=8)
+    assert plan['quality'] == list(QUALITY_TIERS)[-1]
+    assert not plan['fits']
+
+
+def test_unknown_tier_is_rejected():
+    with pytest.raises(ValueError):
+        plan_quality(240, 'ultra')
+
+
+def test_estimate_scales_with_threads():
+    tier = QUALITY_TIERS['fast']
+    assert estimate_seconds(tier, 240, threads=2) > estimate_seconds(tier, 240, threads=8)
+
+
+def test_short_runs_are_not_recorded(throughput_file):
+    record_throughput('htdemucs', audio_seconds=20, elapsed=200, threads=4)
+    assert not throughput_file.exists()
+    assert thread_seconds('htdemucs') == quality.DEFAULT_THREAD_SECONDS['htdemucs']
+
+
+def test_measured_throughput_replaces_default():
+    record_throughput('htdemucs', audio_seconds=240, elapsed=120, threads=4)
+    assert thread_seconds('htdemucs') == pytest.approx(2.0)
+
+    # Later runs move the average part of the way
+    record_throughput('htdemucs', audio_seconds=240, elapsed=240, threads=4)
+    assert 2.0 < thread_seconds('htdemucs') < 4.0
+
+
+def test_parse_deadline():
+    now = 1_700_000_000.0
+    assert parse_deadline('90s', now) == now + 90
+    assert parse_deadline('1h30m', now) == now + 5400
+    assert parse_deadline('25', now) == now + 1500
+    assert 0 < parse_deadline('19:30', now) - now <= 24 * 3600
+    with pytest.raises(ValueError):
+        parse_deadline('soon', now)
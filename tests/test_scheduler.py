@@ -0,0 +1,61 @@
+import os
+import threading
+import time
+
+import pytest
+
+import scheduler
+from scheduler import cpu_lease, leased_threads
+
+
+@pytest.fixture(autouse=True)
+def four_cores(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, 'LEASE_FILE', str(tmp_path / 'cpu_leases.json'))
+    monkeypatch.setattr(scheduler, 'LEASE_POLL_INTERVAL', 0.01)
+    monkeypatch.setenv('KARAOKE_CPU_CORES', '4')
+
+
+def test_lease_is_granted_and_released():
+    with cpu_lease('stage', want=3) as granted:
+        assert granted == 3
+        assert leased_threads() == 3
+    assert leased_threads() == 0
+
+
+def test_want_is_capped_at_the_core_count():
+    with cpu_lease('stage', want=16) as granted:
+        assert granted == 4
+
+
+def test_second_stage_gets_the_remaining_cores():
+    with cpu_lease('first', want=3):
+        with cpu_lease('second', want=2, minimum=1) as granted:
+            assert granted == 1
+            assert leased_threads() == 4
+
+
+def test_stage_waits_for_its_minimum():
+    admitted = threading.Event()
+
+    def second_stage():
+        with cpu_lease('second', want=2, minimum=2):
+            admitted.set()
+
+    with cpu_lease('first', want=3):
+        thread = threading.Thread(target=second_stage)
+        thread.start()
+        time.sleep(0.1)
+        assert not admitted.is_set()
+    thread.join(timeout=5)
+    assert admitted.is_set()
+
+
+def test_leases_of_other_processes_can_be_excluded():
+    with cpu_lease('stage', want=2):
+        assert leased_threads(exclude_pids={os.getpid()}) == 0
+
+
+def test_leases_of_dead_processes_are_dropped(monkeypatch):
+    with cpu_lease('stage', want=2):
+        monkeypatch.setattr(scheduler, '_pid_alive', lambda pid: False)
+        assert leased_threads() == 0
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import vad
+from vad import HOP_SECONDS, MIN_GAP_SECONDS, PAD_SECONDS, frame_levels, plan_gating, vocal_regions, vocal_scores
+
+RATE = 22050
+
+
+def frames_for(seconds):
+    return int(round(seconds / HOP_SECONDS))
+
+
+def scores_with(vocal_spans, seconds):
+    """Scores that are vocal during the given (start, end) spans."""
+    scores = np.zeros(frames_for(seconds), dtype=np.float32)
+    for start, end in vocal_spans:
+        scores[frames_for(start):frames_for(end)] = 1.0
+    return scores
+
+
+def loud(count):
+    return np.full(count, -20.0, dtype=np.float32)
+
+
+def test_no_vocals_no_regions():
+    assert vocal_regions(np.zeros(100), loud(100)) == []
+
+
+def test_region_is_padded_and_clamped():
+    scores = scores_with([(0.5, 10)], 60)
+    assert vocal_regions(scores, loud(len(scores)), threshold=0.5) == [(0.0, 10 + PAD_SECONDS)]
+
+
+def test_short_gaps_are_filled():
+    gap = MIN_GAP_SECONDS / 2
+    scores = scores_with([(10, 20), (20 + gap, 30)], 60)
+    assert vocal_regions(scores, loud(len(scores)), threshold=0.5) == [(10 - PAD_SECONDS, 30 + PAD_SECONDS)]
+
+
+def test_long_gaps_are_skipped():
+    scores = scores_with([(10, 20), (40, 50)], 60)
+    assert vocal_regions(scores, loud(len(scores)), threshold=0.5) == [
+        (10 - PAD_SECONDS, 20 + PAD_SECONDS),
+        (40 - PAD_SECONDS, 50 + PAD_SECONDS),
+    ]
+
+
+def test_silent_frames_are_not_vocal():
+    scores = scores_with([(10, 20)], 60)
+    silent = np.full(len(scores), vad.SILENCE_DB - 10, dtype=np.float32)
+    assert vocal_regions(scores, silent, threshold=0.5) == []
+
+
+def test_regions_end_at_duration():
+    scores = scores_with([(55, 60)], 60)
+    assert vocal_regions(scores, loud(len(scores)), threshold=0.5, duration=58.0)[-1][1] == 58.0
+
+
+def test_centred_tone_scores_above_side_noise():
+    rng = np.random.default_rng(0)
+    t = np.arange(RATE * 2) / RATE
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t)
+    centred = np.stack([tone, tone], axis=1).astype(np.float32)
+    noise = rng.normal(0, 0.1, (len(t), 2)).astype(np.float32)
+    noise[:, 1] = -noise[:, 0]  # Pure side signal
+
+    assert vocal_scores(centred, RATE).mean() > 0.5
+    assert vocal_scores(noise, RATE).mean() < 0.05
+
+
+def test_frame_levels():
+    samples = np.full((RATE, 2), 0.5, dtype=np.float32)
+    np.testing.assert_allclose(frame_levels(samples, RATE), 20 * np.log10(0.5), atol=0.01)
+    assert (frame_levels(np.zeros((RATE, 2), dtype=np.float32), RATE) < vad.SILENCE_DB).all()
+
+
+@pytest.mark.parametrize('fraction, gated', [(0.5, True), (0.95, False)])
+def test_plan_gating(monkeypatch, fraction, gated):
+    regions = [(0.0, 100.0 * fraction)]
+    monkeypatch.setattr(vad, 'analyze', lambda audio_path, work_dir=None: {
+        'duration': 100.0, 'regions': regions, 'vocal_fraction': fraction, 'content': (0.0, 100.0),
+    })
+    assert plan_gating('song.wav') == (regions if gated else None)
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import struct
+import uuid
+
+from media_index import get_media_index
+
+# Uploads are copied to disk in pieces of this size, so memory per upload stays flat
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Bytes kept from the start of the file for container detection and header parsing
+HEAD_SIZE = 64 * 1024
+
+# MPEG-1 Layer III bitrates (kbps) by header index, for a CBR duration estimate
+_MP3_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_MP3_SAMPLE_RATES = (44100, 48000, 32000)
+
+
+def sniff_container(head: bytes):
+    """
+    Identify an audio container from its first bytes.
+
+    Returns:
+        'wav', 'flac', 'ogg', 'mp4', 'aac', 'mp3', or None if it is not audio we accept
+    """
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[4:8] == b'ftyp':
+        return 'mp4'
+    if head[:3] == b'ID3':
+        return 'mp3'
+    if len(head) >= 2 and head[0] == 0xFF:
+        if head[1] & 0xF6 == 0xF0:
+            return 'aac'  # ADTS
+        if head[1] & 0xE0 == 0xE0:
+            return 'mp3'  # MPEG audio frame sync
+    return None
+
+
+def _wav_info(head: bytes, size: int) -> dict:
+    position = 12
+    info = {}
+    while position + 8 <= len(head):
+        chunk_id, chunk_size = struct.unpack('<4sI', head[position:position + 8])
+        if chunk_id == b'fmt ' and position + 24 <= len(head):
+            _, channels, sample_rate, byte_rate = struct.unpack('<HHII', head[position + 8:position + 20])
+            info.update(channels=channels, sample_rate=sample_rate, byte_rate=byte_rate)
+        elif chunk_id == b'data':
+            data_size = min(chunk_size, size - position - 8)
+            if info.get('byte_rate'):
+                return {
+                    'duration': data_size / info['byte_rate'],
+                    'sample_rate': info['sample_rate'],
+                    'channels': info['channels'],
+                }
+            break
+        position += 8 + chunk_size + (chunk_size & 1)
+    return {}
+
+
+def _flac_info(head: bytes) -> dict:
+    # STREAMINFO is always the first metadata block
+    if len(head) < 26:
+        return {}
+    sample_rate = int.from_bytes(head[18:21], 'big') >> 4
+    channels = ((head[20] >> 1) & 0x07) + 1
+    total_samples = ((head[21] & 0x0F) << 32) | int.from_bytes(head[22:26], 'big')
+    if not sample_rate or not total_samples:
+        return {}
+    return {'duration': total_samples / sample_rate, 'sample_rate': sample_rate, 'channels': channels}
+
+
+def _mp3_info(head: bytes, size: int) -> dict:
+    position = 0
+    if head[:3] == b'ID3' and len(head) >= 10:
+        tag_size = 0
+        for byte in head[6:10]:
+            tag_size = (tag_size << 7) | (byte & 0x7F)
+        position = 10 + tag_size
+    if position + 4 > len(head):
+        return {}
+
+    header = head[position:position + 4]
+    # Only MPEG-1 Layer III headers are parsed; anything else is left to FFprobe
+    if header[0] != 0xFF or header[1] & 0xFE != 0xFA:
+        return {}
+    bitrate_index, rate_index = header[2] >> 4, (header[2] >> 2) & 0x03
+    if not 0 < bitrate_index < 15 or rate_index == 3:
+        return {}
+    sample_rate = _MP3_SAMPLE_RATES[rate_index]
+    channels = 1 if header[3] >> 6 == 3 else 2
+
+    # A Xing/Info header (VBR files) holds the exact frame count
+    side_info = 17 if channels == 1 else 32
+    xing = head[position + 4 + side_info:position + 12 + side_info]
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 0x01:
+        frames = struct.unpack('>I', head[position + 12 + side_info:position + 16 + side_info])[0]
+        duration = frames * 1152 / sample_rate
+    else:
+        duration = (size - position) * 8 / (_MP3_BITRATES[bitrate_index] * 1000)
+    return {'duration': duration, 'sample_rate': sample_rate, 'channels': channels, 'codec': 'mp3'}
+
+
+def header_info(container: str, head: bytes, size: int) -> dict:
+    """
+    Duration, sample rate and channels read from the file header, where the
+    container allows it without decoding (WAV, FLAC, MPEG-1 Layer III).
+
+    Returns:
+        Dict with the fields found (empty if the header has to be probed instead)
+    """
+    try:
+        if container == 'wav':
+            return _wav_info(head, size)
+        if container == 'flac':
+            return dict(_flac_info(head), codec='flac')
+        if container == 'mp3':
+            return _mp3_info(head, size)
+    except (struct.error, IndexError):
+        pass
+    return {}
+
+
+def save_upload(upload, dest_path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> dict:
+    """
+    Stream an uploaded file to disk, hashing and validating it in the same pass.
+
+    The file is written next to dest_path and renamed into place once complete,
+    so a job never sees half an upload. If the same bytes were uploaded and hashed
+    before, the audio content hash is attached to the new file right away and the
+    stem cache can be consulted without decoding anything.
+
+    Args:
+        upload: Readable binary file object (e.g. a Streamlit UploadedFile)
+        dest_path: Where to store the file
+        chunk_size: Bytes read and written at a time
+
+    Returns:
+        Dict with path, size, file_hash (SHA-256 of the bytes), container,
+        content_hash (None if not known yet) and the header fields found
+        (duration, sample_rate, channels, codec)
+
+    Raises:
+        ValueError: If the file is not a recognised audio container
+    """
+    if hasattr(upload, 'seek'):
+        upload.seek(0)
+
+    digest = hashlib.sha256()
+    head = b''
+    size = 0
+    part_path = f"{dest_path}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        with open(part_path, 'wb') as f:
+            for chunk in iter(lambda: upload.read(chunk_size), b''):
+                if len(head) < HEAD_SIZE:
+                    head += chunk[:HEAD_SIZE - len(head)]
+                    if size == 0 and sniff_container(head) is None:
+                        raise ValueError("Unsupported file: not a recognised audio format")
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        if size == 0:
+            raise ValueError("Unsupported file: the upload is empty")
+        os.replace(part_path, dest_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    container = sniff_container(head)
+    info = header_info(container, head, size)
+    file_hash = digest.hexdigest()
+
+    index = get_media_index()
+    content_hash = index.blob(file_hash)
+    index.record_blob(file_hash, dest_path)
+    fields = {name: value for name, value in info.items() if value is not None}
+    if content_hash:
+        fields['content_hash'] = content_hash
+    if fields:
+        index.record_file(dest_path, **fields)
+
+    return {
+        'path': dest_path,
+        'size': size,
+        'file_hash': file_hash,
+        'container': container,
+        'content_hash': content_hash,
+        **info,
+    }
@@ -0,0 +1,370 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from audio_io import read_wav, write_wav, create_wav, decode_to_wav, to_float, BLOCK_FRAMES
+from cancellation import run_process
+from chunked import SAMPLE_RATE, crossfade_weights
+from ingest import convert_audio
+
+# Vocal-activity gating: the separators only run on the parts of a track that may
+# contain vocals; everywhere else the original audio is already the instrumental.
+VAD_ENABLED = os.environ.get('KARAOKE_VAD', '0') == '1'
+
+# Frame score above which a frame counts as possibly vocal. The score (0..1) is the
+# share of a frame's energy that is centred, tonal and in the vocal band; lower
+# values skip less but are safer.
+VAD_THRESHOLD = float(os.environ.get('KARAOKE_VAD_THRESHOLD', 0.12))
+
+# Only vocal-free stretches at least this long are skipped
+MIN_GAP_SECONDS = 8.0
+
+# Extra context separated on both sides of every vocal region
+PAD_SECONDS = 1.5
+
+# Crossfade between separated and original audio at region boundaries
+CROSSFADE_SECONDS = 0.5
+
+# Gating is not worth it if vocals cover more of the track than this
+MAX_VOCAL_FRACTION = 0.9
+
+# Analysis settings: decoded at a low rate, one score per hop
+ANALYSIS_RATE = 22050
+FFT_SIZE = 2048
+HOP_SECONDS = 0.1
+VOCAL_BAND = (200, 4000)
+
+# Silence trimming (--auto-trim): frames quieter than this, relative to full scale
+SILENCE_DB = -50.0
+TRIM_MARGIN_SECONDS = 0.2
+
+
+def _frames(samples, hop: int, size: int):
+    """Yield (first_frame_index, block of windows shaped (n, size, channels)) in blocks."""
+    total = samples.shape[0]
+    count = max(0, (total - size) // hop + 1)
+    per_block = max(1, BLOCK_FRAMES // hop)
+    for first in range(0, count, per_block):
+        last = min(first + per_block, count)
+        block = to_float(samples[first * hop:(last - 1) * hop + size])
+        windows = np.lib.stride_tricks.sliding_window_view(block, size, axis=0)[::hop]
+        yield first, windows.transpose(0, 2, 1)
+
+
+def vocal_scores(samples, sample_rate: int, hop_seconds: float = HOP_SECONDS) -> np.ndarray:
+    """
+    Cheap per-frame vocal-likeness score (0..1) from the spectrum.
+
+    Lead vocals sit in the centre of the stereo image, in the 200-4000 Hz band, and
+    are harmonic. The score is the share of a frame's energy that is in that band
+    in the mid signal but not in the side signal, weighted by how tonal (not noisy)
+    the band is. Centre-panned instruments score high too, which only means less
+    is skipped; vocal-free frames reliably score low.
+
+    Args:
+        samples: Array of shape (frames, channels)
+        sample_rate: Sample rate in Hz
+
+    Returns:
+        One score per hop
+    """
+    hop = max(1, int(hop_seconds * sample_rate))
+    window = np.hanning(FFT_SIZE).astype(np.float32)
+    frequencies = np.fft.rfftfreq(FFT_SIZE, 1 / sample_rate)
+    band = (frequencies >= VOCAL_BAND[0]) & (frequencies <= VOCAL_BAND[1])
+    scores = []
+
+    for _, windows in _frames(samples, hop, FFT_SIZE):
+        if windows.shape[2] > 1:
+            mid = windows[:, :, :2].mean(axis=2)
+            side = (windows[:, :, 0] - windows[:, :, 1]) / 2
+        else:
+            mid = windows[:, :, 0]
+            side = np.zeros_like(mid)
+        mid_power = np.abs(np.fft.rfft(mid * window, axis=1)) ** 2
+        side_power = np.abs(np.fft.rfft(side * window, axis=1)) ** 2
+
+        total = mid_power.sum(axis=1) + side_power.sum(axis=1) + 1e-12
+        centred = np.clip(mid_power[:, band] - side_power[:, band], 0, None)
+        centred_share = centred.sum(axis=1) / total
+
+        # Spectral flatness of the band: ~1 for noise, ~0 for harmonic sounds
+        band_power = mid_power[:, band] + 1e-12
+        flatness = np.exp(np.log(band_power).mean(axis=1)) / band_power.mean(axis=1)
+        scores.append(centred_share * (1 - flatness))
+
+    return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+
+def frame_levels(samples, sample_rate: int, hop_seconds: float = HOP_SECONDS) -> np.ndarray:
+    """RMS level of each hop in dBFS."""
+    hop = max(1, int(hop_seconds * sample_rate))
+    levels = []
+    for _, windows in _frames(samples, hop, hop):
+        rms = np.sqrt((windows ** 2).mean(axis=(1, 2)))
+        levels.append(20 * np.log10(rms + 1e-10))
+    return np.concatenate(levels) if levels else np.zeros(0, dtype=np.float32)
+
+
+def vocal_regions(scores: np.ndarray, levels: np.ndarray, hop_seconds: float = HOP_SECONDS,
+                  threshold: float = None, duration: float = None) -> list:
+    """
+    Turn frame scores into the regions that need separation.
+
+    Frames above the threshold (and above the silence floor) are vocal; vocal-free
+    gaps shorter than MIN_GAP_SECONDS are filled in, and every region is padded by
+    PAD_SECONDS, so only long, clearly instrumental stretches are skipped.
+
+    Args:
+        duration: Track length in seconds (None = the length covered by the scores)
+
+    Returns:
+        List of (start, end) times in seconds, sorted and non-overlapping
+    """
+    threshold = VAD_THRESHOLD if threshold is None else threshold
+    count = min(len(scores), len(levels))
+    vocal = (scores[:count] > threshold) & (levels[:count] > SILENCE_DB)
+
+    regions = []
+    for index in np.flatnonzero(vocal):
+        start, end = index * hop_seconds, (index + 1) * hop_seconds
+        if regions and start - regions[-1][1] < MIN_GAP_SECONDS:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    duration = count * hop_seconds if duration is None else duration
+    padded = []
+    for start, end in regions:
+        start, end = max(0.0, start - PAD_SECONDS), min(duration, end + PAD_SECONDS)
+        if padded and start <= padded[-1][1]:
+            padded[-1][1] = end
+        else:
+            padded.append([start, end])
+    return [(round(float(start), 3), round(float(end), 3)) for start, end in padded]
+
+
+def regions_tag(regions: list) -> str:
+    """Short stable ID of a region list, for cache keys of gated separations."""
+    return hashlib.sha1(repr(regions).encode()).hexdigest()[:12]
+
+
+def analyze(audio_path: str, work_dir: str = None, start: float = 0.0, seconds: float = None) -> dict:
+    """
+    Vocal-activity and silence analysis of a track.
+
+    The track is decoded once at a low sample rate; the scoring is pure NumPy.
+
+    Args:
+        start: Analyse from this many seconds into the track
+        seconds: Analyse only this long a window (None = to the end)
+
+    Returns:
+        Dict with 'duration' (end of the analysed audio, in track time), 'regions'
+        (see vocal_regions), 'vocal_fraction' and 'content' ((start, end) seconds
+        of non-silent audio); all times are track times
+    """
+    temp_dir = tempfile.mkdtemp(prefix='vad_', dir=work_dir)
+    try:
+        wav_path = decode_to_wav(audio_path, os.path.join(temp_dir, 'analysis.wav'), ANALYSIS_RATE,
+                                 start=start, duration=seconds)
+        samples, sample_rate = read_wav(wav_path)
+        length = samples.shape[0] / sample_rate
+        levels = frame_levels(samples, sample_rate)
+        regions = vocal_regions(vocal_scores(samples, sample_rate), levels, duration=length)
+        del samples
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    audible = np.flatnonzero(levels > SILENCE_DB)
+    if len(audible):
+        content = (
+            max(0.0, audible[0] * HOP_SECONDS - TRIM_MARGIN_SECONDS),
+            min(length, (audible[-1] + 1) * HOP_SECONDS + TRIM_MARGIN_SECONDS),
+        )
+    else:
+        content = (0.0, length)
+
+    vocal_seconds = sum(end - region_start for region_start, end in regions)
+    return {
+        'duration': start + length,
+        'regions': [(round(start + region_start, 3), round(start + end, 3)) for region_start, end in regions],
+        'vocal_fraction': vocal_seconds / length if length else 1.0,
+        'content': (float(start + content[0]), float(start + content[1])),
+    }
+
+
+def plan_gating(audio_path: str, work_dir: str = None):
+    """
+    Regions to separate for a track, or None if gating would not save enough.
+
+    Returns:
+        List of (start, end) seconds, or None to separate the whole track
+    """
+    analysis = analyze(audio_path, work_dir)
+    regions, fraction = analysis['regions'], analysis['vocal_fraction']
+    skipped = analysis['duration'] - sum(end - start for start, end in regions)
+    if fraction > MAX_VOCAL_FRACTION:
+        print(f"   🗣️  Vocals in {fraction:.0%} of the track, separating all of it")
+        return None
+    print(f"   🗣️  Vocals in {fraction:.0%} of the track: separating {len(regions)} region(s), "
+          f"passing {skipped:.0f}s of instrumental audio through")
+    return regions
+
+
+def separate_vocal_regions(audio_path: str, separate_segment, output_path: str, regions: list,
+                           crossfade_seconds: float = CROSSFADE_SECONDS) -> str:
+    """
+    Separate only the vocal regions of a track and pass the original audio through elsewhere.
+
+    The input is decoded once to a float WAV and copied to the output; each region is
+    sliced out, separated on its own and crossfaded over the original at its edges.
+
+    Args:
+        audio_path: Path to input audio file
+        separate_segment: Function (segment_wav_path, segment_output_dir) -> path of
+            the separated stem for that segment
+        output_path: Where to write the result (.wav, or .mp3 to encode at the end)
+        regions: (start, end) seconds to separate, e.g. from plan_gating()
+        crossfade_seconds: Length of the blend at each region boundary
+
+    Returns:
+        output_path
+    """
+    def separate_region(index, segment, sample_rate, segment_dir):
+        segment_path = write_wav(os.path.join(segment_dir, f'segment_{index:03d}.wav'), segment, sample_rate)
+        return separate_segment(segment_path, os.path.join(segment_dir, 'out'))
+
+    return _merge_regions(audio_path, separate_region, output_path, regions, crossfade_seconds)
+
+
+def gate_stem(audio_path: str, stem_path: str, output_path: str, regions: list,
+              crossfade_seconds: float = CROSSFADE_SECONDS) -> str:
+    """
+    Gate an already separated stem: keep it in the vocal regions and pass the
+    original audio through elsewhere, blended exactly like separate_vocal_regions().
+
+    Used when the stem of the whole track is available (e.g. sliced from a
+    fingerprint match), so it can stand in for a gated separation.
+
+    Args:
+        audio_path: Path to input audio file
+        stem_path: Separated stem of the whole input, sample-aligned with it
+        output_path: Where to write the result (.wav, or .mp3 to encode at the end)
+        regions: (start, end) seconds to take from the stem
+
+    Returns:
+        output_path
+    """
+    work_dir = tempfile.mkdtemp(prefix='gate_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        stem, _ = read_wav(decode_to_wav(stem_path, os.path.join(work_dir, 'stem.wav'), SAMPLE_RATE))
+
+        def stem_region(index, segment, sample_rate, segment_dir):
+            start = int(regions[index][0] * sample_rate)
+            return write_wav(os.path.join(segment_dir, 'stem.wav'), to_float(stem[start:start + len(segment)]), sample_rate)
+
+        return _merge_regions(audio_path, stem_region, output_path, regions, crossfade_seconds)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _merge_regions(audio_path: str, separate_region, output_path: str, regions: list,
+                   crossfade_seconds: float) -> str:
+    """
+    Copy the input to the output and crossfade a separated version over it in each
+    region; separate_region(index, segment_samples, sample_rate, segment_dir) returns
+    the path of the separated region.
+    """
+    work_dir = tempfile.mkdtemp(prefix='vad_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        source_wav = decode_to_wav(audio_path, os.path.join(work_dir, 'source.wav'), SAMPLE_RATE)
+        source, sample_rate = read_wav(source_wav)
+        total_frames, channels = source.shape
+
+        merged_path = output_path if output_path.lower().endswith('.wav') else os.path.join(work_dir, 'merged.wav')
+        merged = create_wav(merged_path, total_frames, channels, sample_rate)
+        for start in range(0, total_frames, BLOCK_FRAMES):
+            end = min(start + BLOCK_FRAMES, total_frames)
+            merged[start:end] = to_float(source[start:end])
+
+        fade = int(crossfade_seconds * sample_rate)
+        for index, (start_seconds, end_seconds) in enumerate(regions):
+            start = int(start_seconds * sample_rate)
+            end = min(int(end_seconds * sample_rate), total_frames)
+            if end <= start:
+                continue
+            segment_dir = os.path.join(work_dir, f'segment_{index:03d}')
+            os.makedirs(segment_dir, exist_ok=True)
+            print(f"   🎙️  Region {index + 1}/{len(regions)}: {start_seconds:.1f}s - {end_seconds:.1f}s")
+
+            separated_path = separate_region(index, source[start:end], sample_rate, segment_dir)
+            if not separated_path or not os.path.exists(separated_path):
+                raise FileNotFoundError(f"Separator produced no output for region {index + 1}/{len(regions)}")
+            if not separated_path.lower().endswith('.wav'):
+                separated_path = decode_to_wav(separated_path, os.path.join(segment_dir, 'separated.wav'), sample_rate, channels)
+            separated, separated_rate = read_wav(separated_path)
+            if separated_rate != sample_rate:
+                raise RuntimeError(f"Separator returned {separated_rate}Hz audio for a {sample_rate}Hz segment")
+
+            length = min(end - start, separated.shape[0])
+            fade_in = min(fade, length // 2) if start > 0 else 0
+            fade_out = min(fade, length // 2) if start + length < total_frames else 0
+            weights = crossfade_weights(length, fade_in, fade_out)[:, None]
+            for offset in range(0, length, BLOCK_FRAMES):
+                block_end = min(offset + BLOCK_FRAMES, length)
+                gain = weights[offset:block_end]
+                merged[start + offset:start + block_end] = (
+                    to_float(separated[offset:block_end]) * gain
+                    + to_float(source[start + offset:start + block_end]) * (1 - gain)
+                )
+
+            del separated
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+        merged.flush()
+        del merged
+        del source
+
+        if merged_path != output_path:
+            result = run_process(
+                ['ffmpeg', '-y', '-v', 'error', '-i', merged_path, '-b:a', '320k', output_path],
+                partial=[output_path],
+                capture_output=True,
+                text=True
+            )
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to encode merged output: {result.stderr}")
+
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def trim_silence(audio_path: str, output_path: str = None, work_dir: str = None) -> tuple:
+    """
+    Cut leading and trailing silence (--auto-trim, instead of --trim-start/--trim-end).
+
+    Args:
+        audio_path: Track to trim
+        output_path: Where to write the trimmed track (None = replace audio_path)
+        work_dir: Folder for temporary files
+
+    Returns:
+        (seconds cut from the start, seconds cut from the end); (0, 0) if there was
+        nothing worth cutting, in which case no file is written
+    """
+    analysis = analyze(audio_path, work_dir)
+    start, end = analysis['content']
+    cut_start, cut_end = start, analysis['duration'] - end
+    if cut_start < TRIM_MARGIN_SECONDS and cut_end < TRIM_MARGIN_SECONDS:
+        return 0.0, 0.0
+
+    temp_path = os.path.join(work_dir or os.path.dirname(os.path.abspath(audio_path)),
+                             f'trimmed_{os.getpid()}{os.path.splitext(audio_path)[1]}')
+    convert_audio(audio_path, temp_path, cut_start, cut_end, analysis['duration'])
+    shutil.move(temp_path, output_path or audio_path)
+    return cut_start, cut_end
@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+from cancellation import request_cancel
+
+# Every run gets its own scratch folder below this root, so concurrent runs never
+# share file names. KARAOKE_WORKSPACE_TMPFS=1 puts them in RAM (/dev/shm) when there is room.
+WORKSPACE_ROOT = os.environ.get('KARAOKE_WORKSPACE_DIR', os.path.join(tempfile.gettempdir(), 'ai-karaoke-maker'))
+TMPFS_ROOT = '/dev/shm/ai-karaoke-maker'
+USE_TMPFS = os.environ.get('KARAOKE_WORKSPACE_TMPFS', '0') == '1'
+
+# Disk space one workspace may use (0 = unlimited); a job that grows past it is cancelled
+WORKSPACE_QUOTA_GB = float(os.environ.get('KARAOKE_WORKSPACE_QUOTA_GB', 10))
+
+# How often workspace usage is measured against the quota
+QUOTA_CHECK_INTERVAL = 2.0
+
+
+class WorkspaceQuotaExceeded(RuntimeError):
+    """Raised when a workspace grows past its quota."""
+
+
+def _free_bytes(path: str) -> int:
+    try:
+        usage = shutil.disk_usage(path)
+    except OSError:
+        return 0
+    return usage.free
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def directory_size(path: str) -> int:
+    """Bytes allocated by all files below path."""
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(folder, name))
+            except OSError:
+                continue
+            total += stat.st_blocks * 512 if hasattr(stat, 'st_blocks') else stat.st_size
+    return total
+
+
+def reap_stale_workspaces(root: str = None):
+    """Remove workspaces left behind by processes that no longer exist (crash, kill -9)."""
+    for base in ([root] if root else [WORKSPACE_ROOT, TMPFS_ROOT]):
+        if not os.path.isdir(base):
+            continue
+        for name in os.listdir(base):
+            pid = name.rsplit('-', 2)[-2] if name.count('-') >= 2 else ''
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+
+
+class Workspace:
+    """
+    Private scratch folder of one pipeline run.
+
+    Folder names carry the owning process ID, so workspaces of crashed runs are
+    recognised and removed by reap_stale_workspaces().
+    """
+
+    def __init__(self, name: str = None, tmpfs: bool = None, quota_gb: float = None):
+        self.name = name or uuid.uuid4().hex[:12]
+        self.quota_bytes = int((WORKSPACE_QUOTA_GB if quota_gb is None else quota_gb) * 1024 ** 3)
+
+        tmpfs = USE_TMPFS if tmpfs is None else tmpfs
+        root = WORKSPACE_ROOT
+        if tmpfs and os.path.isdir('/dev/shm'):
+            # RAM is only used when the whole quota fits, otherwise fall back to disk
+            if not self.quota_bytes or _free_bytes('/dev/shm') >= self.quota_bytes:
+                root = TMPFS_ROOT
+            else:
+                print(f"⚠️  Not enough free RAM for a {self.quota_bytes / 1024 ** 3:.0f} GB workspace, using disk")
+        self.on_tmpfs = root == TMPFS_ROOT
+
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, f'{self.name}-{os.getpid()}-{uuid.uuid4().hex[:6]}')
+        os.makedirs(self.path)
+        self.exceeded = False
+        self._stop = threading.Event()
+        self._monitor = None
+
+    def file(self, *parts: str) -> str:
+        """Path of a file inside the workspace (parent folders are created)."""
+        path = os.path.join(self.path, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def usage(self) -> int:
+        return directory_size(self.path)
+
+    def check_quota(self):
+        """Raise WorkspaceQuotaExceeded if the workspace is larger than its quota."""
+        if self.quota_bytes and (self.exceeded or self.usage() > self.quota_bytes):
+            self.exceeded = True
+            raise WorkspaceQuotaExceeded(
+                f"Workspace {self.name} exceeded its {self.quota_bytes / 1024 ** 3:.1f} GB quota"
+            )
+
+    def _watch(self):
+        while not self._stop.wait(QUOTA_CHECK_INTERVAL):
+            try:
+                self.check_quota()
+            except WorkspaceQuotaExceeded as e:
+                print(f"❌ {e}, stopping")
+                # Kills the run's processes if it is inside cancel_scope(name)
+                request_cancel(self.name, f'exceeded its {self.quota_bytes / 1024 ** 3:.1f} GB workspace quota')
+                return
+
+    def start_monitor(self):
+        """Measure usage in the background and cancel the run once it passes the quota."""
+        if self.quota_bytes and self._monitor is None:
+            self._monitor = threading.Thread(target=self._watch, name=f'workspace-{self.name}', daemon=True)
+            self._monitor.start()
+
+    def cleanup(self):
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@contextmanager
+def workspace(name: str = None, tmpfs: bool = None, quota_gb: float = None):
+    """
+    Create a workspace for the duration of a block and always remove it afterwards.
+
+    Args:
+        name: Identifier, e.g. a job ID (pair with cancellation.cancel_scope(name)
+            so a quota breach stops the run's processes)
+        tmpfs: Keep it in RAM (None = KARAOKE_WORKSPACE_TMPFS)
+        quota_gb: Size limit (None = KARAOKE_WORKSPACE_QUOTA_GB, 0 = unlimited)
+    """
+    reap_stale_workspaces()
+    space = Workspace(name, tmpfs=tmpfs, quota_gb=quota_gb)
+    space.start_monitor()
+    try:
+        yield space
+    finally:
+        space.cleanup()